@@ -1,39 +1,139 @@
 import asyncio
+import bisect
+import contextlib
 import logging
 import uuid
 import json
 import datetime
+import hashlib
 import time
 import traceback
-from fastapi import FastAPI, WebSocket, HTTPException
+import heapq
+import itertools
+import queue
+import random
+import re
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from typing import List, Dict, Any, Optional, Annotated
+from fastapi.responses import FileResponse, JSONResponse
+from typing import List, Dict, Any, Optional, Annotated, Literal, Callable
 import asyncssh
+import msgpack
 from pydantic import BaseModel, Field, IPvAnyAddress, StringConstraints, field_validator, model_validator
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float
+from sqlalchemy import bindparam, create_engine, event, insert, select, text, update, Column, Index, Integer, String, Text, DateTime, Float, LargeBinary, ForeignKey
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import joinedload, relationship, sessionmaker
 from fastapi.middleware.cors import CORSMiddleware
 
-# 数据库配置
-DATABASE_URL = "sqlite:///./test.db"  # SQLite数据库
+# 数据库配置：桌面版通过 CYCLOPS_DATA_DIR 指定数据目录（见 desktop/electron/pyinstaller/backend_entry.py）
+DATA_DIR = os.getenv("CYCLOPS_DATA_DIR", ".")
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(DATA_DIR, 'test.db')}")  # SQLite数据库
+# SQLite 页缓存（KB）和内存映射大小（字节）
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# 命令输出块的 zlib 压缩级别（1-9）
+OUTPUT_BLOB_COMPRESSION_LEVEL = int(os.getenv("OUTPUT_BLOB_COMPRESSION_LEVEL", "6"))
 Base = declarative_base()
 
 
 class ServerCommandResult(Base):
     __tablename__ = 'server_command_results'
+    # 结果查询的组合索引；SQLite 索引隐含 rowid（即 id），按 id 游标分页时无需再排序
+    __table_args__ = (
+        Index('ix_server_command_results_ip_command', 'ip', 'command'),
+        Index('ix_server_command_results_command_exit_status', 'command', 'exit_status'),
+        Index('ix_server_command_results_run_id_exit_status', 'run_id', 'exit_status'),
+        Index('ix_server_command_results_timestamp', 'timestamp'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     ip = Column(String, index=True)
     user = Column(String, default='root')
     password = Column(String, default='huawei@1234')
     port = Column(Integer, default=22)
     command = Column(String)
-    output = Column(Text)
+    output = Column(Text)  # 旧版本直接保存的输出；新结果为空，输出保存在 output_blobs
+    output_hash = Column(String, ForeignKey('output_blobs.hash'), nullable=True, index=True)
     exit_status = Column(Integer, nullable=True)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    run_id = Column(Integer, ForeignKey('runs.id'), nullable=True, index=True)
+
+    blob = relationship("OutputBlob", lazy="select")
+
+    @property
+    def output_text(self) -> Optional[str]:
+        """命令输出；读取时才加载并解压输出块"""
+        if self.output is not None or self.blob is None:
+            return self.output
+        return self.blob.text
+
+
+# 按内容寻址的命令输出：相同输出只保存一份，zlib 压缩
+class OutputBlob(Base):
+    __tablename__ = 'output_blobs'
+    hash = Column(String, primary_key=True)  # 未压缩输出的 sha256
+    size = Column(Integer)  # 未压缩的字节数
+    data = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(self.data).decode("utf-8")
+
+
+# 全文检索表 output_fts 的 rowid 与输出块的对应关系（output_blobs 没有整数主键，VACUUM 可能改变其 rowid）
+class OutputSearchEntry(Base):
+    __tablename__ = 'output_search'
+    id = Column(Integer, primary_key=True)
+    hash = Column(String, ForeignKey('output_blobs.hash'), unique=True)
+
+
+# 一次执行（``/api/v1/execute`` 创建的一个房间）；结果通过 run_id 关联
+class ExecutionRun(Base):
+    __tablename__ = 'runs'
+    id = Column(Integer, primary_key=True)
+    request_id = Column(String, unique=True, index=True)
+    room = Column(String, index=True)
+    status = Column(String, default='running')  # running/completed/cancelled/aborted/failed/interrupted
+    started_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    server_count = Column(Integer, default=0)
+    command_count = Column(Integer, default=0)
+    # 随结果写入递增，由结果写入线程在保存结果的同一事务中更新
+    result_count = Column(Integer, default=0)
+    failed_result_count = Column(Integer, default=0)  # 退出码非0的结果
+    # 执行结束时写入的行汇总，见 RoomRun.summary
+    rows_completed = Column(Integer, nullable=True)
+    rows_failed = Column(Integer, nullable=True)
+    rows_cancelled = Column(Integer, nullable=True)
+    rows_skipped = Column(Integer, nullable=True)
+    errors = Column(Integer, nullable=True)
+    config = Column(Text)  # JSON：执行参数和各行配置（不含密码）
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "requestId": self.request_id,
+            "room": self.room,
+            "status": self.status,
+            "startedAt": self.started_at.isoformat() if self.started_at else None,
+            "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+            "serverCount": self.server_count,
+            "commandCount": self.command_count,
+            "results": self.result_count,
+            "failedResults": self.failed_result_count,
+            "rowsCompleted": self.rows_completed,
+            "rowsFailed": self.rows_failed,
+            "rowsCancelled": self.rows_cancelled,
+            "rowsSkipped": self.rows_skipped,
+            "errors": self.errors,
+        }
 
 
 # 服务器配置存储模型
@@ -45,13 +145,62 @@ class ServerConfig(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
+def create_database_engine(url: str):
+    """创建数据库引擎；SQLite 使用 WAL 和适合高频写入的 pragma
+
+    WAL 模式下读（配置查询）和写（结果写入线程）互不阻塞，``synchronous=NORMAL`` 只在检查点时 fsync。
+    连接池允许多个线程各自持有连接，``busy_timeout`` 让偶发的写锁竞争等待而不是立即报错。
+    """
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+
+    sqlite_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": 30},
+        pool_size=8,
+        max_overflow=8,
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
+
+    return sqlite_engine
+
+
 # 创建数据库引擎和会话
-engine = create_engine(DATABASE_URL)
+engine = create_database_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # 创建数据库表
 Base.metadata.create_all(bind=engine)
 
+
+def create_output_search_index() -> bool:
+    """创建命令输出的 FTS5 全文检索表；不是 SQLite 或 SQLite 未编译 FTS5 时返回 False，不提供检索
+
+    每个输出块索引一次（contentless，不重复保存输出文本），rowid 对应 ``output_search.id``。
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS output_fts USING fts5(body, content='', tokenize='unicode61')"))
+        return True
+    except Exception as e:
+        logger.warning(f"Full-text search over command outputs is unavailable: {e}")
+        return False
+
+
+OUTPUT_SEARCH_ENABLED = create_output_search_index()
+
 # 日志配置 - 增强为结构化日志
 class JsonFormatter(logging.Formatter):
     def format(self, record):
@@ -134,10 +283,6 @@ async def http_exception_handler(request, exc):
         error = error_payload("VALIDATION_ERROR" if exc.status_code == 400 else "INTERNAL_ERROR", str(detail))
     return JSONResponse(status_code=exc.status_code, content={"error": error})
 
-# SSH连接池
-ssh_connections = {}
-jump_server_connections = {}  # 跳板机连接池
-
 ERROR_MESSAGES = {
     "VALIDATION_ERROR": "请求参数校验失败，请修正后重试。",
     "SSH_AUTH_FAILED": "SSH 认证失败，请检查用户名、密码或跳板机密钥配置。",
@@ -148,6 +293,11 @@ ERROR_MESSAGES = {
     "SSH_CHANNEL_ERROR": "SSH 通道打开失败，请检查服务器会话限制或网络状态。",
     "COMMAND_TIMEOUT": "命令执行超时，请检查命令是否长时间阻塞。",
     "COMMAND_EXECUTION_FAILED": "命令执行失败，请检查命令内容或服务器状态。",
+    "OUTPUT_NOT_FOUND": "命令完整输出不存在或已过期。",
+    "DEADLINE_EXCEEDED": "已超过执行截止时间，命令未执行。",
+    "ROOM_NOT_FOUND": "房间不存在或已过期。",
+    "RUN_NOT_FOUND": "执行记录不存在。",
+    "COMMAND_SKIPPED": "前面的命令执行失败，已跳过该命令。",
     "INTERNAL_ERROR": "服务内部错误，请稍后重试。",
 }
 
@@ -207,55 +357,685 @@ def classify_command_error(exc: Exception) -> Dict[str, str]:
         return classify_ssh_error(exc)
     return error_payload("COMMAND_EXECUTION_FAILED")
 
-async def get_jump_server_connection(jump_host, jump_username, jump_port=22):
-    """获取跳板机SSH连接或创建新连接"""
-    jump_host = jump_host.replace(" ", "")
-    key = f"jump_{jump_host}:{jump_port}:{jump_username}"
-    
-    # 检查是否有可用的缓存连接
-    if key in jump_server_connections:
+# asyncssh 连接内部记录未响应keepalive次数的属性（私有，升级 asyncssh 时由测试检查是否仍存在）
+ASYNCSSH_KEEPALIVE_COUNT_ATTR = "_keepalive_count"
+
+
+class PooledConnection:
+    """连接池中的单个SSH连接及其被动存活状态"""
+
+    def __init__(self, key: str, conn, client=None, host: Optional[str] = None, jump: Optional[str] = None):
+        now = time.monotonic()
+        self.key = key
+        self.conn = conn
+        self.client = client
+        self.host = host
+        self.jump = jump
+        self.created_at = now
+        self.last_used = now
+        self.last_ok = now  # 最近一次成功打开通道的时间
+        self.in_use = 0  # 当前持有该连接的调用者数量，为0时才允许被LRU淘汰
+        self.closed = False
+        self.suspect = False
+        self.expiry_scheduled = False  # 是否已在连接池的空闲过期堆中
+        self.on_closed = None
+
+    def mark_closed(self, exc: Optional[Exception] = None):
+        self.closed = True
+        if self.on_closed is not None:
+            self.on_closed(self)
+
+    def keepalive_pending(self) -> bool:
+        """是否已有keepalive未得到响应；只是提前探测的提示，不影响正确性
+
+        asyncssh 没有公开这个计数（收到任何数据后清零），读取不到时视为没有未响应的keepalive：
+        超过 ``keepalive_count_max`` 次未响应时 asyncssh 会自行断开连接，由 ``connection_lost`` 标记。
+        """
+        count = getattr(self.conn, ASYNCSSH_KEEPALIVE_COUNT_ATTR, None)
+        return isinstance(count, int) and count > 0
+
+    def is_closed(self) -> bool:
+        if self.closed:
+            return True
+        is_closed = getattr(self.conn, "is_closed", None)
+        return bool(is_closed()) if callable(is_closed) else False
+
+    def needs_probe(self, now: float, probe_idle: float) -> bool:
+        return self.suspect or self.keepalive_pending() or now - self.last_ok > probe_idle
+
+
+class PoolClient(asyncssh.SSHClient):
+    """把 asyncssh 的传输层事件转发给连接池条目"""
+
+    def __init__(self):
+        self.entry: Optional[PooledConnection] = None
+        self.lost = False
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.lost = True
+        if self.entry is not None:
+            self.entry.mark_closed(exc)
+
+
+class PoolExhausted(Exception):
+    """连接池已达上限且没有可淘汰的空闲连接；只在不等待的获取（``wait=False``）时抛出"""
+
+
+class SSHConnectionPool:
+    """有界的SSH连接池，基于被动存活跟踪
+
+    复用连接时不做网络I/O：连接断开由 ``connection_lost`` 回调和 asyncssh 的
+    keepalive 机制标记，只有被标记为可疑或长时间没有成功打开通道的连接才会
+    进行一次主动探测。
+
+    连接总数、单个主机以及单个跳板机后的连接数都有上限；达到上限时按LRU淘汰
+    空闲连接，没有可淘汰的连接时调用者按先来先服务排队等待，只有受同一上限限制的调用者之间才会互相等待。
+    """
+
+    def __init__(self, name: str, max_size: int = 512, max_per_host: int = 4, max_per_jump: int = 256,
+                 probe_idle: float = 180, probe_timeout: float = 10,
+                 idle_ttl: float = 300, via_jump_idle_ttl: Optional[float] = None,
+                 health_check_interval: float = 1800, health_check_rate: float = 2, health_check_burst: int = 4):
+        self.name = name
+        self.max_size = max_size
+        self.max_per_host = max_per_host
+        self.max_per_jump = max_per_jump
+        self.probe_idle = probe_idle
+        self.probe_timeout = probe_timeout
+        self.idle_ttl = idle_ttl
+        self.via_jump_idle_ttl = idle_ttl if via_jump_idle_ttl is None else via_jump_idle_ttl
+        self.health_check_interval = health_check_interval
+        self.health_check_rate = health_check_rate  # 每秒最多发起的健康检查数
+        self.health_check_burst = health_check_burst
+        self._entries: "OrderedDict[str, PooledConnection]" = OrderedDict()  # 按最近使用排序
+        self._pending: Dict[str, asyncio.Future] = {}  # 正在建连或探测的key
+        self._waiters: deque = deque()  # (future, host, jump)
+        self._slots = 0  # 已建立和正在建立的连接数
+        self._host_slots: Dict[str, int] = defaultdict(int)
+        self._jump_slots: Dict[str, int] = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.dials = 0
+        self.dial_failures = 0
+        self.waits = 0
+        self._dial_times: deque = deque(maxlen=1024)
+        self.expired = 0
+        self.health_checks = 0
+        self.health_check_failures = 0
+        # 空闲过期堆和健康检查堆：(到期时间, 序号, 条目)，每个条目在每个堆中最多一项
+        self._expiry_heap: list = []
+        self._health_heap: list = []
+        self._heap_seq = itertools.count()
+        self._check_tokens = float(health_check_burst)
+        self._tokens_at = time.monotonic()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._health_tasks: set = set()  # 进行中的健康检查，持有引用以免任务被回收
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self):
+        return list(self._entries.items())
+
+    async def get(self, key: str, dial, host: Optional[str] = None, jump: Optional[str] = None, wait: bool = True):
+        """获取可用连接并登记一次占用，用完后需调用 :meth:`release`
+
+        ``dial`` 是返回 ``(conn, client)`` 的协程函数。同一个key同时只会有一次
+        建连或探测在进行，其余调用者等待同一个结果，建连失败时异常会传递给所有等待者。
+        ``wait`` 为 False 时达到上限不排队，直接抛出 :class:`PoolExhausted`。
+        """
+        entry = self._entries.get(key)
+        if entry is not None and not entry.is_closed() and not entry.needs_probe(time.monotonic(), self.probe_idle):
+            self.hits += 1
+            logger.debug(f"Reusing pooled SSH connection", extra={"connection_key": key, "pool": self.name})
+            return self._lease(entry)
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._checkout_slow(key, dial, host, jump, wait))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda fut: self._finish_pending(key, fut))
+        else:
+            self.coalesced += 1
+            logger.debug(f"Waiting for in-flight SSH connection", extra={"connection_key": key, "pool": self.name})
+        # shield: 单个等待者被取消时不影响其他等待者共享的建连任务
+        return self._lease(await asyncio.shield(pending))
+
+    def release(self, key: str, conn):
+        """归还一次 :meth:`get` 登记的占用；连接本身留在池中供复用"""
+        entry = self._entries.get(key)
+        if entry is None or entry.conn is not conn or entry.in_use <= 0:
+            return
+        entry.in_use -= 1
+        entry.last_used = time.monotonic()
+        if entry.in_use == 0:
+            if entry.closed:
+                self.discard(key, entry)
+                return
+            self._schedule_expiry(entry)
+            if self._waiters:
+                self._wake_waiters()
+
+    def _lease(self, entry: PooledConnection):
+        entry.in_use += 1
+        entry.last_used = time.monotonic()
+        if entry.key in self._entries:
+            self._entries.move_to_end(entry.key)
+        return entry.conn
+
+    def _finish_pending(self, key: str, fut: asyncio.Future):
+        if self._pending.get(key) is fut:
+            del self._pending[key]
+        if not fut.cancelled():
+            fut.exception()  # 所有等待者都已取消时避免 "exception was never retrieved"
+
+    async def _checkout_slow(self, key: str, dial, host: Optional[str], jump: Optional[str],
+                             wait: bool = True) -> PooledConnection:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.is_closed():
+                logger.debug(f"Pooled SSH connection closed by transport, redialing", extra={"connection_key": key})
+                self.discard(key, entry)
+            elif entry.needs_probe(time.monotonic(), self.probe_idle) and not await self._probe(entry):
+                logger.warning(f"Pooled SSH connection failed liveness probe, redialing", extra={"connection_key": key})
+                self.discard(key, entry)
+            else:
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        await self._reserve(host, jump, wait)
+        started = time.monotonic()
+        self.dials += 1
         try:
-            # 尝试执行一个简单的命令来验证连接是否活跃
-            conn = jump_server_connections[key]["conn"]
-            
-            # 实际测试连接是否有效
+            conn, client = await dial()
+        except BaseException:
+            self.dial_failures += 1
+            self._release_slot(host, jump)
+            raise
+        self._dial_times.append(time.monotonic() - started)
+
+        entry = PooledConnection(key, conn, client, host=host, jump=jump)
+        entry.on_closed = self._on_entry_closed
+        previous = self._entries.get(key)
+        if previous is not None:
+            self.discard(key, previous)
+        self._entries[key] = entry
+        if isinstance(client, PoolClient):
+            client.entry = entry
+            if client.lost:
+                entry.mark_closed()
+        self._schedule_expiry(entry)
+        self._schedule_health_check(entry)
+        logger.info(f"Created new pooled SSH connection", extra={"connection_key": key, "pool": self.name})
+        return entry
+
+    def _blocked_by(self, host: Optional[str], jump: Optional[str]):
+        """返回阻止新建连的约束 ``(字段, 值)``，没有约束时返回 None"""
+        if host is not None and self._host_slots[host] >= self.max_per_host:
+            return ("host", host)
+        if jump is not None and self._jump_slots[jump] >= self.max_per_jump:
+            return ("jump", jump)
+        if self._slots >= self.max_size:
+            return ("all", None)
+        return None
+
+    def _try_reserve(self, host: Optional[str], jump: Optional[str]) -> bool:
+        while True:
+            blocked = self._blocked_by(host, jump)
+            if blocked is None:
+                break
+            field, value = blocked
+            victim = next((
+                entry for entry in self._entries.values()
+                if entry.in_use == 0 and entry.key not in self._pending
+                and (field == "all" or getattr(entry, field) == value)
+            ), None)
+            if victim is None:
+                return False
+            self.evictions += 1
+            logger.debug(f"Evicting idle SSH connection", extra={"connection_key": victim.key, "pool": self.name})
+            self.discard(victim.key, victim)
+
+        self._slots += 1
+        if host is not None:
+            self._host_slots[host] += 1
+        if jump is not None:
+            self._jump_slots[jump] += 1
+        return True
+
+    async def _reserve(self, host: Optional[str], jump: Optional[str], wait: bool = True):
+        # 自身约束允许时直接获取名额，不被其他主机/跳板机上的排队者挡住；名额释放时会同步按先来先服务
+        # 唤醒排队者，因此受同一约束限制的新调用者无法越过已在排队的调用者
+        if self._try_reserve(host, jump):
+            return
+        if not wait:
+            raise PoolExhausted(f"SSH connection pool {self.name} is at its limit for host={host} jump={jump}")
+        self.waits += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, host, jump))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot(host, jump)  # 已分配到名额但调用者被取消
+            else:
+                try:
+                    self._waiters.remove((waiter, host, jump))
+                except ValueError:
+                    pass
+            raise
+
+    def _wake_waiters(self):
+        for item in list(self._waiters):
+            waiter, host, jump = item
+            if waiter.done():
+                self._waiters.remove(item)
+            elif self._try_reserve(host, jump):
+                self._waiters.remove(item)
+                waiter.set_result(None)
+
+    def _release_slot(self, host: Optional[str], jump: Optional[str]):
+        self._slots -= 1
+        if host is not None:
+            self._host_slots[host] -= 1
+            if not self._host_slots[host]:
+                del self._host_slots[host]
+        if jump is not None:
+            self._jump_slots[jump] -= 1
+            if not self._jump_slots[jump]:
+                del self._jump_slots[jump]
+        if self._waiters:
+            self._wake_waiters()
+
+    async def _probe(self, entry: PooledConnection) -> bool:
+        try:
+            await asyncio.wait_for(entry.conn.run("true", check=False), timeout=self.probe_timeout)
+        except Exception as e:
+            logger.debug(f"Liveness probe failed: {e}", extra={"connection_key": entry.key})
+            return False
+        entry.suspect = False
+        entry.last_ok = entry.last_used = time.monotonic()
+        return True
+
+    def mark_ok(self, key: str):
+        """命令通道成功打开后调用，刷新存活时间"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.suspect = False
+            entry.last_ok = entry.last_used = time.monotonic()
+
+    def mark_suspect(self, key: str):
+        """通道打开失败等异常后调用，下一次复用前会主动探测"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.suspect = True
+
+    def _on_entry_closed(self, entry: PooledConnection):
+        # 传输层断开后立即归还空闲连接的名额；仍被持有的连接在 release 时移除
+        if entry.in_use == 0:
+            self.discard(entry.key, entry)
+
+    def idle_ttl_for(self, entry: PooledConnection) -> float:
+        return self.via_jump_idle_ttl if entry.jump is not None else self.idle_ttl
+
+    def _push(self, heap: list, when: float, entry: PooledConnection):
+        heapq.heappush(heap, (when, next(self._heap_seq), entry))
+        if heap[0][2] is entry and self._wakeup is not None:
+            self._wakeup.set()  # 新的最早到期时间，唤醒维护任务重新计算睡眠时长
+
+    def _schedule_expiry(self, entry: PooledConnection):
+        if not entry.expiry_scheduled:
+            entry.expiry_scheduled = True
+            self._push(self._expiry_heap, entry.last_used + self.idle_ttl_for(entry), entry)
+
+    def _schedule_health_check(self, entry: PooledConnection):
+        # 加入 ±20% 抖动，避免同一批建立的连接同时做健康检查
+        delay = self.health_check_interval * random.uniform(0.8, 1.2)
+        self._push(self._health_heap, time.monotonic() + delay, entry)
+
+    def expire_idle(self, now: Optional[float] = None) -> int:
+        """关闭所有已超过空闲期限的连接，只检查堆顶已到期的条目"""
+        now = time.monotonic() if now is None else now
+        expired = 0
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, _, entry = heapq.heappop(self._expiry_heap)
+            entry.expiry_scheduled = False
+            if self._entries.get(entry.key) is not entry or entry.in_use:
+                continue  # 已被移除，或正在使用（归还时会重新加入堆）
+            deadline = entry.last_used + self.idle_ttl_for(entry)
+            if deadline > now:
+                self._schedule_expiry(entry)  # 期间被使用过，按新的期限重新入堆
+                continue
+            self.discard(entry.key, entry)
+            expired += 1
+            logger.debug(f"Closed idle SSH connection", extra={"connection_key": entry.key, "pool": self.name})
+        self.expired += expired
+        return expired
+
+    def _take_check_token(self, now: float) -> bool:
+        self._check_tokens = min(self.health_check_burst,
+                                 self._check_tokens + (now - self._tokens_at) * self.health_check_rate)
+        self._tokens_at = now
+        if self._check_tokens >= 1:
+            self._check_tokens -= 1
+            return True
+        return False
+
+    def start_health_checks(self, now: Optional[float] = None) -> List[asyncio.Task]:
+        """为到期的连接发起健康检查，受令牌桶限速；未拿到令牌的留在堆中下次处理"""
+        now = time.monotonic() if now is None else now
+        tasks = []
+        while self._health_heap and self._health_heap[0][0] <= now:
+            entry = self._health_heap[0][2]
+            if self._entries.get(entry.key) is not entry:
+                heapq.heappop(self._health_heap)
+                continue
+            if now - entry.last_ok < self.health_check_interval:
+                # 近期有成功的通道，已足以证明连接健康，无需主动探测
+                heapq.heappop(self._health_heap)
+                self._schedule_health_check(entry)
+                continue
+            if not self._take_check_token(now):
+                break
+            heapq.heappop(self._health_heap)
+            task = asyncio.ensure_future(self._health_check(entry))
+            self._health_tasks.add(task)
+            task.add_done_callback(self._health_tasks.discard)
+            tasks.append(task)
+        return tasks
+
+    async def _health_check(self, entry: PooledConnection):
+        self.health_checks += 1
+        if await self._probe(entry):
+            logger.debug(f"SSH connection is healthy", extra={"connection_key": entry.key, "pool": self.name})
+            if self._entries.get(entry.key) is entry:
+                self._schedule_health_check(entry)
+            return
+        self.health_check_failures += 1
+        logger.warning(f"Health check failed for SSH connection", extra={"connection_key": entry.key, "pool": self.name})
+        if entry.in_use:
+            entry.suspect = True  # 仍有调用者持有，下一次复用前会再次探测
+            self._schedule_health_check(entry)
+        else:
+            self.discard(entry.key, entry)
+
+    def _next_maintenance_at(self) -> Optional[float]:
+        deadlines = [heap[0][0] for heap in (self._expiry_heap, self._health_heap) if heap]
+        if self._health_heap and self._check_tokens < 1:
+            deadlines.append(self._tokens_at + (1 - self._check_tokens) / self.health_check_rate)
+        return min(deadlines) if deadlines else None
+
+    async def run_maintenance(self, max_sleep: float = 60):
+        """后台维护循环：按各连接自己的期限关闭空闲连接，并分散执行健康检查"""
+        self._wakeup = asyncio.Event()
+        while True:
             try:
-                # 使用较短的超时时间来测试连接
-                test_proc = await asyncio.wait_for(
-                    conn.create_process("echo jump_connection_test"),
-                    timeout=10
-                )
-                test_result = await test_proc.wait()
-                
-                # 连接有效，更新最后使用时间
-                jump_server_connections[key]["last_used"] = time.time()
-                logger.debug(f"Reusing jump server SSH connection to {jump_host}:{jump_port}")
-                return conn
+                now = time.monotonic()
+                expired = self.expire_idle(now)
+                checks = self.start_health_checks(now)
+                if expired or checks:
+                    logger.debug(f"Connection pool maintenance: expired {expired}, checking {len(checks)}",
+                                 extra={"pool": self.name})
             except Exception as e:
-                # 测试命令失败，连接可能已断开
-                logger.warning(f"Jump server SSH connection test failed: {e}")
-                raise  # 继续处理异常
-                
-        except Exception as e:
-            # 连接可能已关闭或失效，记录日志并从池中移除
-            logger.warning(f"Cached jump server SSH connection to {jump_host}:{jump_port} is invalid, creating new one: {e}")
+                logger.error(f"Error during connection pool maintenance: {e}", exc_info=True, extra={"pool": self.name})
+
+            next_at = self._next_maintenance_at()
+            timeout = max_sleep if next_at is None else min(max_sleep, max(0.0, next_at - time.monotonic()))
+            self._wakeup.clear()
             try:
-                if key in jump_server_connections:
-                    try:
-                        jump_server_connections[key]["conn"].close()
-                    except:
-                        pass
-                    del jump_server_connections[key]
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def discard(self, key: str, entry: Optional[PooledConnection] = None):
+        """移除并关闭连接；传入 ``entry`` 时只在池中仍是同一条目时才移除"""
+        if entry is not None and self._entries.get(key) is not entry:
+            return None
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            try:
+                entry.conn.close()
             except Exception:
                 pass
-    
-    # 创建新的跳板机连接
+            self._release_slot(entry.host, entry.jump)
+        return entry
+
+    def discard_conn(self, key: str, conn):
+        """仅当池中该key仍对应 ``conn`` 时才移除，避免误关其他调用者刚重建的连接"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.conn is conn:
+            return self.discard(key, entry)
+        return None
+
+    async def close(self):
+        """服务关闭时调用：结束进行中的健康检查并关闭池中所有连接"""
+        tasks = list(self._health_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for key in list(self._entries):
+            self.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        dial_times = sorted(self._dial_times)
+
+        def percentile(p):
+            return round(dial_times[min(len(dial_times) - 1, int(len(dial_times) * p))], 4) if dial_times else None
+
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "in_use": sum(1 for entry in self._entries.values() if entry.in_use),
+            "dialing": len(self._pending),
+            "waiting": len(self._waiters),
+            "max_size": self.max_size,
+            "max_per_host": self.max_per_host,
+            "max_per_jump": self.max_per_jump,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "dials": self.dials,
+            "dial_failures": self.dial_failures,
+            "waits": self.waits,
+            "expired": self.expired,
+            "health_checks": self.health_checks,
+            "health_check_failures": self.health_check_failures,
+            "idle_ttl": self.idle_ttl,
+            "via_jump_idle_ttl": self.via_jump_idle_ttl,
+            "dial_latency": {
+                "avg": round(sum(dial_times) / len(dial_times), 4) if dial_times else None,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(dial_times[-1], 4) if dial_times else None,
+            },
+        }
+
+
+def env_int(name: str, default: int) -> int:
     try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid integer for {name}, using default {default}")
+        return default
+
+
+# SSH连接池；上限可通过环境变量调整，便于在小规格机器上控制文件描述符数量
+ssh_connections = SSHConnectionPool(
+    "ssh",
+    max_size=env_int("SSH_POOL_MAX_SIZE", 512),
+    max_per_host=env_int("SSH_POOL_MAX_PER_HOST", 4),
+    max_per_jump=env_int("SSH_POOL_MAX_PER_JUMP", 256),
+    idle_ttl=env_int("SSH_POOL_IDLE_TTL", 300),
+    via_jump_idle_ttl=env_int("SSH_POOL_VIA_JUMP_IDLE_TTL", 300),
+)
+jump_server_connections = SSHConnectionPool(  # 跳板机连接池
+    "jump",
+    max_size=env_int("JUMP_POOL_MAX_SIZE", 32),
+    max_per_host=env_int("JUMP_POOL_MAX_PER_HOST", 2),
+    probe_idle=120,
+    idle_ttl=env_int("JUMP_POOL_IDLE_TTL", 600),
+)
+
+
+def direct_connection_key(host, port, username) -> str:
+    return f"{host.replace(' ', '')}:{port}:{username}"
+
+
+def via_jump_connection_key(host, port, username) -> str:
+    return f"via_jump_{host.replace(' ', '')}:{port}:{username}"
+
+
+def jump_connection_key(jump_host, jump_port, jump_username) -> str:
+    return f"jump_{jump_host.replace(' ', '')}:{jump_port}:{jump_username}"
+
+
+def connection_slot_key(key: str, slot: int = 0) -> str:
+    """同一目标的第 ``slot`` 条连接在池中的key；第一条连接沿用原key"""
+    return key if slot == 0 else f"{key}#{slot + 1}"
+
+
+# 会话通道调度
+DEFAULT_SESSION_LIMIT = 10  # OpenSSH 默认 MaxSessions
+MAX_CONNECTIONS_PER_TARGET = env_int("SSH_MAX_CONNECTIONS_PER_TARGET", 3)  # 通道不足时单行最多使用的连接数
+MAX_CHANNEL_REQUEUES = 20  # 因通道上限被拒绝后重新排队的最大次数
+CHANNEL_LIMIT_CODES = {asyncssh.OPEN_ADMINISTRATIVELY_PROHIBITED, asyncssh.OPEN_RESOURCE_SHORTAGE}
+learned_session_limits: Dict[str, int] = {}  # 从 ChannelOpenError 学到的单连接会话上限
+channel_schedulers: Dict[str, "ChannelScheduler"] = {}
+
+
+class ChannelLimitReached(Exception):
+    """服务器因会话数上限拒绝打开通道；命令应重新排队而不是重连"""
+
+
+class ChannelScheduler:
+    """同一目标（host:port:user）上各条连接的通道计数，在所有行和房间之间共享"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.active: Dict[int, int] = defaultdict(int)  # 连接序号 -> 已打开的通道数
+        self.cond = asyncio.Condition()
+        self.users = 0
+
+    @classmethod
+    def attach(cls, key: str) -> "ChannelScheduler":
+        scheduler = channel_schedulers.get(key)
+        if scheduler is None:
+            scheduler = channel_schedulers[key] = cls(key)
+        scheduler.users += 1
+        return scheduler
+
+    def detach(self):
+        self.users -= 1
+        if self.users <= 0 and channel_schedulers.get(self.key) is self:
+            del channel_schedulers[self.key]
+
+    @property
+    def limit(self) -> int:
+        return learned_session_limits.get(self.key, DEFAULT_SESSION_LIMIT)
+
+    def limit_reached(self, slot: int, exc: Exception) -> bool:
+        """判断通道打开失败是否由会话上限导致，是则记录新的上限"""
+        if getattr(exc, "code", None) not in CHANNEL_LIMIT_CODES:
+            return False
+        opened = self.active[slot]  # 包含本次失败的通道
+        if opened <= 1:
+            return False  # 单个通道也打不开，不是会话数问题
+        limit = opened - 1
+        if limit < self.limit:
+            learned_session_limits[self.key] = limit
+            logger.info(f"Learned SSH session limit {limit}", extra={"connection_key": self.key})
+        return True
+
+
+class RowChannels:
+    """单行命令的通道调度：命令在空闲通道上排队执行，通道不足时为该行追加连接"""
+
+    def __init__(self, row, pool_key: str, leases: list, max_connections: Optional[int] = None):
+        self.row = row
+        self.pool_key = pool_key
+        self.leases = leases
+        self.max_connections = MAX_CONNECTIONS_PER_TARGET if max_connections is None else max_connections
+        self.conns: Dict[int, Any] = {}  # 连接序号 -> 连接
+        self.opening = False
+        self.scheduler = ChannelScheduler.attach(pool_key)
+
+    def slot_key(self, slot: int) -> str:
+        return connection_slot_key(self.pool_key, slot)
+
+    async def acquire(self):
+        """等待任一连接上出现空闲通道，返回 ``(slot, conn)``"""
+        scheduler = self.scheduler
+        async with scheduler.cond:
+            while True:
+                for slot, conn in self.conns.items():
+                    if scheduler.active[slot] < scheduler.limit:
+                        scheduler.active[slot] += 1
+                        return slot, conn
+                if self.conns and not self.opening and len(self.conns) < self.max_connections:
+                    await self._open_extra()
+                    continue
+                await scheduler.cond.wait()
+
+    async def _open_extra(self):
+        # 建连期间释放锁，避免阻塞其他行在已有连接上获取通道。
+        # 追加连接不在连接池上限处排队：本行已占用的第一条连接同样计入上限，排队可能永远等不到名额
+        slot = len(self.conns)
+        self.opening = True
+        self.scheduler.cond.release()
+        try:
+            conn, _ = await open_row_connection(self.row, self.leases, slot, wait=False)
+        except PoolExhausted as e:
+            logger.debug(f"No pool capacity for extra SSH connection, queueing on existing channels: {e}",
+                         extra={"connection_key": self.slot_key(slot)})
+            conn = None
+        except Exception as e:
+            logger.warning(f"Could not open extra SSH connection: {e}", extra={"connection_key": self.slot_key(slot)})
+            conn = None
+        finally:
+            await self.scheduler.cond.acquire()
+            self.opening = False
+        if conn is None:
+            self.max_connections = len(self.conns)  # 追加连接失败，不再尝试
+        else:
+            self.conns[slot] = conn
+            logger.info(f"Opened extra SSH connection for channel capacity", extra={"connection_key": self.slot_key(slot)})
+
+    async def release(self, slot: int):
+        async with self.scheduler.cond:
+            self.scheduler.active[slot] -= 1
+            self.scheduler.cond.notify_all()
+
+    async def reopen(self, slot: int, discard: bool = True):
+        """重新从连接池获取指定序号的连接；``discard`` 时先移除已断开的旧连接"""
+        if discard:
+            ssh_connections.discard_conn(self.slot_key(slot), self.conns.get(slot))
+        conn, _ = await open_row_connection(self.row, self.leases, slot)
+        self.conns[slot] = conn
+        return conn
+
+    def close(self):
+        self.scheduler.detach()
+
+
+async def get_jump_server_connection(jump_host, jump_username, jump_port=22):
+    """获取跳板机SSH连接或创建新连接"""
+    jump_host = jump_host.replace(" ", "")
+    key = jump_connection_key(jump_host, jump_port, jump_username)
+
+    async def dial():
         # 使用密钥认证连接跳板机
-        conn = await asyncssh.connect(
-            jump_host, 
-            username=jump_username, 
-            port=jump_port, 
+        return await adaptive_concurrency.observe(jump_host, lambda: asyncssh.create_connection(
+            PoolClient,
+            jump_host,
+            username=jump_username,
+            port=jump_port,
             known_hosts=None,
             connect_timeout=30,
             keepalive_interval=60,
@@ -263,13 +1043,10 @@ async def get_jump_server_connection(jump_host, jump_username, jump_port=22):
             # 跳板机使用密钥认证，不提供密码
             client_keys='~/.ssh/id_ed25519',  # 使用默认密钥位置 (~/.ssh/id_rsa, ~/.ssh/id_ed25519, etc.)
             passphrase=None
-        )
-        jump_server_connections[key] = {
-            "conn": conn,
-            "last_used": time.time()
-        }
-        logger.info(f"Created new jump server SSH connection to {jump_host}:{jump_port}")
-        return conn
+        ))
+
+    try:
+        conn = await jump_server_connections.get(key, dial, host=jump_host)
     except asyncssh.misc.DisconnectError as e:
         logger.error(f"Jump server SSH disconnection error: {e}", exc_info=True)
         raise
@@ -278,52 +1055,22 @@ async def get_jump_server_connection(jump_host, jump_username, jump_port=22):
         raise
     except asyncssh.misc.PermissionDenied as e:
         logger.error(f"Jump server SSH permission denied (check SSH key setup): {e}", exc_info=True)
-        raise Exception(f"Jump server authentication failed. Please ensure SSH key authentication is configured: {e}")
+        raise Exception(f"Jump server authentication failed. Please ensure SSH key authentication is configured: {e}") from e
     except Exception as e:
         logger.error(f"Error creating jump server SSH connection to {jump_host}:{jump_port}: {e}", exc_info=True)
         raise
+    return conn
 
-async def get_ssh_connection_via_jump(host, username, password, port, jump_conn):
-    """通过跳板机连接到目标服务器"""
+async def get_ssh_connection_via_jump(host, username, password, port, jump_conn, jump_host=None, slot=0, wait=True):
+    """通过跳板机连接到目标服务器；``jump_host`` 用于统计单个跳板机后的连接数上限"""
     host = host.replace(" ", "")
-    key = f"via_jump_{host}:{port}:{username}"
-    
-    # 检查是否有可用的缓存连接
-    if key in ssh_connections:
-        try:
-            conn = ssh_connections[key]["conn"]
-            
-            # 测试连接是否有效
-            try:
-                test_proc = await asyncio.wait_for(
-                    conn.create_process("echo connection_test"),
-                    timeout=10
-                )
-                test_result = await test_proc.wait()
-                
-                ssh_connections[key]["last_used"] = time.time()
-                logger.debug(f"Reusing SSH connection via jump server to {host}:{port}")
-                return conn
-            except Exception as e:
-                logger.warning(f"SSH connection via jump server test failed: {e}")
-                raise
-                
-        except Exception as e:
-            logger.warning(f"Cached SSH connection via jump server to {host}:{port} is invalid, creating new one: {e}")
-            try:
-                if key in ssh_connections:
-                    try:
-                        ssh_connections[key]["conn"].close()
-                    except:
-                        pass
-                    del ssh_connections[key]
-            except Exception:
-                pass
-    
-    # 通过跳板机创建新连接
-    try:
+    key = connection_slot_key(via_jump_connection_key(host, port, username), slot)
+    jump_host = jump_host.replace(" ", "") if jump_host else None
+
+    async def dial():
         # 使用跳板机连接创建到目标服务器的连接
-        conn = await asyncssh.connect(
+        return await adaptive_concurrency.observe(jump_host, lambda: asyncssh.create_connection(
+            PoolClient,
             host,
             username=username,
             password=password,
@@ -333,79 +1080,40 @@ async def get_ssh_connection_via_jump(host, username, password, port, jump_conn)
             keepalive_interval=60,
             login_timeout=30,
             tunnel=jump_conn  # 使用跳板机连接作为隧道
-        )
-        ssh_connections[key] = {
-            "conn": conn,
-            "last_used": time.time()
-        }
-        logger.info(f"Created new SSH connection via jump server to {host}:{port}")
-        return conn
+        ))
+
+    try:
+        conn = await ssh_connections.get(key, dial, host=host, jump=jump_host, wait=wait)
+    except PoolExhausted:
+        raise
     except Exception as e:
         logger.error(f"Error creating SSH connection via jump server to {host}:{port}: {e}", exc_info=True)
         raise
+    return conn
 
-async def get_ssh_connection(host, username, password, port=22):
-    """从连接池获取SSH连接或创建新连接，带有增强的健康检查"""
+async def get_ssh_connection(host, username, password, port=22, slot=0, wait=True):
+    """从连接池获取SSH连接或创建新连接；存活状态由连接池被动跟踪"""
     host = host.replace(" ","")
-    key = f"{host}:{port}:{username}"
-    
-    # 检查是否有可用的缓存连接
-    if key in ssh_connections:
-        try:
-            # 尝试执行一个简单的命令来验证连接是否活跃
-            conn = ssh_connections[key]["conn"]
-            
-            # 实际测试连接是否有效
-            try:
-                # 使用较短的超时时间来测试连接
-                test_proc = await asyncio.wait_for(
-                    conn.create_process("echo connection_test"),
-                    timeout=20
-                )
-                test_result = await test_proc.wait()
-                
-                # 连接有效，更新最后使用时间
-                ssh_connections[key]["last_used"] = time.time()
-                logger.debug(f"Reusing SSH connection to {host}:{port}", extra={"connection_key": key})
-                return conn
-            except Exception as e:
-                # 测试命令失败，连接可能已断开
-                logger.warning(f"SSH connection test failed: {e}", extra={"connection_key": key})
-                raise  # 继续处理异常
-                
-        except Exception as e:
-            # 连接可能已关闭或失效，记录日志并从池中移除
-            logger.warning(f"Cached SSH connection to {host}:{port} is invalid, creating new one: {e}")
-            try:
-                # 尝试安全关闭连接
-                if key in ssh_connections:
-                    try:
-                        ssh_connections[key]["conn"].close()
-                    except:
-                        pass  # 忽略关闭错误
-                    del ssh_connections[key]
-            except Exception:
-                pass  # 忽略任何异常
-    
-    # 创建新连接
-    try:
+    key = connection_slot_key(direct_connection_key(host, port, username), slot)
+
+    async def dial():
         # 增加连接超时和身份验证超时
-        conn = await asyncssh.connect(
-            host, 
-            username=username, 
-            password=password, 
-            port=port, 
+        return await adaptive_concurrency.observe(None, lambda: asyncssh.create_connection(
+            PoolClient,
+            host,
+            username=username,
+            password=password,
+            port=port,
             known_hosts=None,
             connect_timeout=30,  # 30秒连接超时
             keepalive_interval=60,  # 每60秒发送一次keepalive包
             login_timeout=30     # 30秒登录超时
-        )
-        ssh_connections[key] = {
-            "conn": conn,
-            "last_used": time.time()
-        }
-        logger.info(f"Created new SSH connection to {host}:{port}", extra={"connection_key": key})
-        return conn
+        ))
+
+    try:
+        conn = await ssh_connections.get(key, dial, host=host, wait=wait)
+    except PoolExhausted:
+        raise
     except asyncssh.misc.DisconnectError as e:
         logger.error(f"SSH disconnection error: {e}", exc_info=True,
                    extra={"host": host, "port": port, "username": username})
@@ -415,130 +1123,519 @@ async def get_ssh_connection(host, username, password, port=22):
                    extra={"host": host, "port": port, "username": username})
         raise
     except Exception as e:
-        logger.error(f"Error creating SSH connection to {host}:{port}: {e}", exc_info=True, 
+        logger.error(f"Error creating SSH connection to {host}:{port}: {e}", exc_info=True,
                    extra={"host": host, "port": port, "username": username})
         raise
+    return conn
 
-# 修改连接清理函数以更积极地检查连接健康状态
 async def cleanup_connections():
-    """清理5分钟未使用的SSH连接并执行健康检查"""
-    while True:
-        await asyncio.sleep(300)  # 5分钟检查一次
-        current_time = time.time()
-        cleaned = 0
-        checked = 0
-        
-        # 清理普通SSH连接
-        for key, data in list(ssh_connections.items()):
-            try:
-                # 提取连接信息用于日志
-                host_info = key.split(":")
-                host = host_info[0] if len(host_info) > 0 else "unknown"
-                
-                # 连接超过5分钟未使用，直接清理
-                if current_time - data["last_used"] > 300:  # 5分钟未使用
-                    try:
-                        data["conn"].close()
-                    except Exception as e:
-                        logger.error(f"Error closing SSH connection: {e}", extra={"connection_key": key})
-                    
-                    del ssh_connections[key]
-                    cleaned += 1
-                    logger.debug(f"Cleaned idle SSH connection to {host}", extra={"connection_key": key})
-                
-                # 连接使用超过30分钟，执行健康检查
-                elif current_time - data["last_used"] > 1800:  # 30分钟
-                    checked += 1
-                    try:
-                        # 异步测试连接是否健康
-                        conn = data["conn"]
-                        test_proc = await asyncio.wait_for(
-                            conn.create_process("echo health_check"),
-                            timeout=5  # 较短的健康检查超时
-                        )
-                        await test_proc.wait()
-                        logger.debug(f"SSH connection to {host} is healthy", extra={"connection_key": key})
-                    except Exception as e:
-                        # 健康检查失败，关闭并移除连接
-                        logger.warning(f"Health check failed for SSH connection to {host}: {e}", 
-                                     extra={"connection_key": key})
-                        try:
-                            data["conn"].close()
-                        except:
-                            pass
-                        
-                        del ssh_connections[key]
-                        cleaned += 1
-            except Exception as e:
-                logger.error(f"Error during connection cleanup/health check: {e}", 
-                           extra={"connection_key": key})
-        
-        # 清理跳板机连接
-        for key, data in list(jump_server_connections.items()):
-            try:
-                host_info = key.split(":")
-                host = host_info[0].replace("jump_", "") if len(host_info) > 0 else "unknown"
-                
-                if current_time - data["last_used"] > 300:  # 5分钟未使用
-                    try:
-                        data["conn"].close()
-                    except Exception as e:
-                        logger.error(f"Error closing jump server connection: {e}")
-                    
-                    del jump_server_connections[key]
-                    cleaned += 1
-                    logger.debug(f"Cleaned idle jump server connection to {host}")
-                
-                elif current_time - data["last_used"] > 1800:  # 30分钟健康检查
-                    checked += 1
-                    try:
-                        conn = data["conn"]
-                        test_proc = await asyncio.wait_for(
-                            conn.create_process("echo jump_health_check"),
-                            timeout=5
-                        )
-                        await test_proc.wait()
-                        logger.debug(f"Jump server connection to {host} is healthy")
-                    except Exception as e:
-                        logger.warning(f"Health check failed for jump server connection to {host}: {e}")
-                        try:
-                            data["conn"].close()
-                        except:
-                            pass
-                        
-                        del jump_server_connections[key]
-                        cleaned += 1
-            except Exception as e:
-                logger.error(f"Error during jump server connection cleanup: {e}")
-        
-        if cleaned > 0 or checked > 0:
-            logger.info(f"Connection pool maintenance: cleaned {cleaned} connections, checked {checked} connections")
+    """运行各连接池的维护循环：按空闲期限关闭连接，分散执行健康检查"""
+    await asyncio.gather(
+        ssh_connections.run_maintenance(),
+        jump_server_connections.run_maintenance(),
+    )
 
-# WebSocket连接注册表
-websockets = {}
-active_rooms = {}  # 存储房间信息，包括请求ID
+# 触发并发回退的错误码：超时、拒绝和断连通常意味着网络或跳板机过载，认证失败等则与负载无关
+CONGESTION_ERROR_CODES = {"SSH_CONNECTION_TIMEOUT", "SSH_CONNECTION_REFUSED", "SSH_CONNECTION_LOST", "SSH_CHANNEL_ERROR"}
 
-# 数据模型定义
-NonEmptyStr = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
-CommandStr = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
-PortNumber = Annotated[int, Field(ge=1, le=65535)]
 
+class AdaptiveLimit:
+    """单个链路（某台跳板机或直连）的并发上限，按 AIMD 调整"""
 
-class JumpServerConfig(BaseModel):
-    enabled: bool = False
-    ip: Optional[IPvAnyAddress] = None
-    user: Optional[NonEmptyStr] = None
-    port: PortNumber = 22
+    def __init__(self, group: Optional[str], initial: int):
+        self.group = group
+        self.limit = float(initial)
+        self.slow_start = True  # 首次回退前每次成功加1，之后每轮（limit 次成功）加1
+        self.latency_ewma = None
+        self.latency_baseline = None
+        self.successes = 0
+        self.failures = 0
+        self.last_decrease = float("-inf")
+        self.last_reason = "initial"
+        self.changes: deque = deque(maxlen=20)
 
-    @model_validator(mode="after")
-    def require_jump_fields_when_enabled(self):
-        if self.enabled and (self.ip is None or self.user is None):
-            raise ValueError("Jump server IP and username are required when jump server is enabled")
-        return self
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "slow_start": self.slow_start,
+            "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "latency_baseline": round(self.latency_baseline, 4) if self.latency_baseline is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "last_reason": self.last_reason,
+            "changes": list(self.changes),
+        }
 
-    @field_validator("ip")
-    @classmethod
-    def stringify_ip(cls, value):
+
+class AdaptiveConcurrency:
+    """按链路自适应调整并发：建连延迟和错误率正常时加性增加，超时、拒绝、
+    通道错误或延迟明显升高时乘性减少。每台跳板机单独跟踪，直连目标共用一个链路。
+
+    为避免同一波失败被重复计算，两次回退之间至少间隔 ``cooldown`` 秒。
+    """
+
+    def __init__(self, initial: int = 20, min_limit: int = 2, max_limit: int = 128,
+                 decrease_factor: float = 0.5, latency_factor: float = 3.0, latency_floor: float = 0.2,
+                 cooldown: float = 2.0):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor  # 延迟低于该值时不视为拥塞
+        self.cooldown = cooldown
+        self.on_change = None  # 上限变化时的回调，执行调度器用它唤醒排队的行
+        self._limits: Dict[Optional[str], AdaptiveLimit] = {}
+
+    def _get(self, group: Optional[str]) -> AdaptiveLimit:
+        state = self._limits.get(group)
+        if state is None:
+            state = self._limits[group] = AdaptiveLimit(group, min(max(self.initial, self.min_limit), self.max_limit))
+        return state
+
+    def limit(self, group: Optional[str]) -> int:
+        return int(self._get(group).limit)
+
+    def _set(self, state: AdaptiveLimit, value: float, reason: str):
+        old = int(state.limit)
+        state.limit = min(max(value, self.min_limit), self.max_limit)
+        new = int(state.limit)
+        if new != old:
+            state.last_reason = reason
+            state.changes.append({"at": round(time.time(), 3), "from": old, "to": new, "reason": reason})
+            if new < old:
+                logger.info(f"Concurrency limit decreased to {new}: {reason}", extra={"jump_host": state.group})
+            if self.on_change is not None:
+                self.on_change()
+
+    def record_success(self, group: Optional[str], latency: float):
+        state = self._get(group)
+        state.successes += 1
+        state.latency_ewma = latency if state.latency_ewma is None else state.latency_ewma * 0.8 + latency * 0.2
+        if state.latency_baseline is None or latency < state.latency_baseline:
+            state.latency_baseline = latency
+        else:
+            # 基线缓慢上浮，避免一次偶然的低延迟永久拉低基线
+            state.latency_baseline += (latency - state.latency_baseline) * 0.01
+
+        if state.latency_ewma > max(state.latency_baseline * self.latency_factor, self.latency_floor):
+            self._decrease(state, f"connect latency {state.latency_ewma:.2f}s above baseline {state.latency_baseline:.2f}s")
+        elif state.slow_start:
+            self._set(state, state.limit + 1, "healthy (slow start)")
+        else:
+            self._set(state, state.limit + 1 / state.limit, "healthy")
+
+    def record_failure(self, group: Optional[str], code: str):
+        state = self._get(group)
+        state.failures += 1
+        if code in CONGESTION_ERROR_CODES:
+            self._decrease(state, code)
+
+    def _decrease(self, state: AdaptiveLimit, reason: str):
+        now = time.monotonic()
+        if now - state.last_decrease < self.cooldown:
+            return
+        state.last_decrease = now
+        state.slow_start = False
+        self._set(state, state.limit * self.decrease_factor, reason)
+
+    async def observe(self, group: Optional[str], connect):
+        """执行一次建连并记录耗时或失败原因"""
+        started = time.monotonic()
+        try:
+            result = await connect()
+        except Exception as e:
+            self.record_failure(group, classify_ssh_error(e)["code"])
+            raise
+        self.record_success(group, time.monotonic() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "initial": self.initial,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "groups": {group or "direct": state.stats() for group, state in self._limits.items()},
+        }
+
+
+class Deadline:
+    """截止时间上下文：作业、行、命令逐级收紧，建连、重试退避和命令执行只使用剩余时间
+
+    ``at`` 为 ``time.monotonic()`` 时间点，None 表示不限时。
+    """
+
+    def __init__(self, at: Optional[float] = None):
+        self.at = at
+
+    @classmethod
+    def after(cls, seconds: Optional[float]) -> "Deadline":
+        return cls(None if seconds is None else time.monotonic() + seconds)
+
+    def child(self, seconds: Optional[float]) -> "Deadline":
+        """返回不晚于当前截止时间、且最多 ``seconds`` 秒后到期的子截止时间"""
+        if seconds is None:
+            return Deadline(self.at)
+        at = time.monotonic() + seconds
+        return Deadline(at if self.at is None else min(at, self.at))
+
+    def remaining(self) -> Optional[float]:
+        if self.at is None:
+            return None
+        return max(0.0, self.at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.at is not None and time.monotonic() >= self.at
+
+    def timeout(self, cap: Optional[float] = None) -> Optional[float]:
+        """用于 ``asyncio.wait_for`` 的超时：剩余时间与 ``cap`` 取较小值"""
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        return remaining if cap is None else min(cap, remaining)
+
+
+# 重试也不会成功的错误：认证失败、主机密钥校验失败、端口拒绝连接，直接失败。按异常类型判断而不是按错误码：
+# 连接被重置、管道断开与拒绝连接共用 SSH_CONNECTION_REFUSED 错误码，但它们通常是瞬时故障，应当重试
+NON_RETRYABLE_ERRORS = (asyncssh.misc.PermissionDenied, asyncssh.misc.HostKeyNotVerifiable, ConnectionRefusedError)
+
+
+class RetryBudget:
+    """重试令牌桶：每次首次尝试存入 ``ratio`` 个令牌，每次重试消耗1个，
+    使重试次数不超过首次尝试的固定比例；``initial`` 保证少量请求时也能重试"""
+
+    def __init__(self, ratio: float, initial: float, capacity: float):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = min(initial, capacity)
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+
+class RetryStats:
+    def __init__(self):
+        self.operations = 0  # 首次尝试次数
+        self.retries = 0
+        self.fast_failed = 0
+        self.budget_exhausted = 0
+        self.gave_up = 0
+        self.wasted_time = 0.0  # 失败尝试和退避等待的总耗时
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "operations": self.operations,
+            "retries": self.retries,
+            "fast_failed": self.fast_failed,
+            "budget_exhausted": self.budget_exhausted,
+            "gave_up": self.gave_up,
+            "wasted_time": round(self.wasted_time, 3),
+        }
+
+
+class RetryPolicy:
+    """建连和命令执行共用的重试策略
+
+    - 退避时间使用去相关抖动（decorrelated jitter），避免同一波失败的行同时重试；
+    - 重试受进程级和房间级两个令牌桶约束，任一耗尽即不再重试；
+    - 认证失败、拒绝连接等重试无效的错误直接失败。
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 10.0,
+                 budget_ratio: float = 0.2, room_initial: float = 10, process_initial: float = 50):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.room_initial = room_initial
+        self.budget = RetryBudget(budget_ratio, process_initial, max(process_initial, 1000))
+        self.stats_total = RetryStats()
+        self._room_budgets: Dict[str, RetryBudget] = {}
+        self._room_stats: Dict[str, RetryStats] = {}
+
+    def begin(self, room: Optional[str] = None) -> "RetryTracker":
+        """开始一次新的操作（首次尝试），返回跟踪其重试的对象"""
+        budgets = [self.budget]
+        stats = [self.stats_total]
+        if room is not None:
+            if room not in self._room_budgets:
+                self._room_budgets[room] = RetryBudget(self.budget_ratio, self.room_initial, max(self.room_initial, 500))
+                self._room_stats[room] = RetryStats()
+            budgets.append(self._room_budgets[room])
+            stats.append(self._room_stats[room])
+        for budget in budgets:
+            budget.deposit()
+        return RetryTracker(self, budgets, stats)
+
+    @staticmethod
+    def retryable(exc: BaseException) -> bool:
+        while exc is not None:
+            if isinstance(exc, NON_RETRYABLE_ERRORS):
+                return False
+            exc = exc.__cause__
+        return True
+
+    def forget_room(self, room: str):
+        self._room_budgets.pop(room, None)
+        self._room_stats.pop(room, None)
+
+    def room_stats(self, room: str) -> Optional[Dict[str, Any]]:
+        stats = self._room_stats.get(room)
+        return stats.as_dict() if stats is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_attempts": self.max_attempts,
+            "budget_tokens": round(self.budget.tokens, 2),
+            "total": self.stats_total.as_dict(),
+            "rooms": {room: stats.as_dict() for room, stats in self._room_stats.items()},
+        }
+
+
+class RetryTracker:
+    """单次操作的重试状态"""
+
+    def __init__(self, policy: RetryPolicy, budgets: List[RetryBudget], stats: List[RetryStats]):
+        self.policy = policy
+        self.budgets = budgets
+        self.stats = stats
+        self.attempts = 0
+        self.delay = policy.base_delay
+        self.stop_reason = None
+        self._record("operations")
+
+    def _record(self, field: str, amount: float = 1):
+        for stats in self.stats:
+            setattr(stats, field, getattr(stats, field) + amount)
+
+    def next_delay(self, exc: BaseException, elapsed: float = 0.0, deadline: Optional[Deadline] = None) -> Optional[float]:
+        """记录一次失败；返回重试前应等待的秒数，不应重试时返回 None 并设置 ``stop_reason``
+
+        退避后已没有剩余时间（超过 ``deadline``）时同样不再重试。
+        """
+        self.attempts += 1
+        self._record("wasted_time", elapsed)
+        if not self.policy.retryable(exc):
+            self.stop_reason = "non_retryable"
+            self._record("fast_failed")
+            return None
+        if self.attempts >= self.policy.max_attempts:
+            self.stop_reason = "max_attempts"
+            self._record("gave_up")
+            return None
+        if any(budget.tokens < 1 for budget in self.budgets):
+            self.stop_reason = "budget_exhausted"
+            self._record("budget_exhausted")
+            return None
+        delay = min(self.policy.max_delay, random.uniform(self.policy.base_delay, self.delay * 3))
+        remaining = deadline.remaining() if deadline is not None else None
+        if remaining is not None and delay >= remaining:
+            self.stop_reason = "deadline"
+            self._record("gave_up")
+            return None
+        for budget in self.budgets:
+            budget.tokens -= 1
+        self.delay = delay
+        self._record("retries")
+        self._record("wasted_time", self.delay)
+        return self.delay
+
+
+class RoomShare:
+    """执行调度器中单个房间的排队和统计状态"""
+
+    def __init__(self, room: str, priority: int = 0):
+        self.room = room
+        self.priority = priority
+        self.waiters: deque = deque()
+        self.running = 0
+        self.admitted = 0
+        self.last_admitted = 0  # 最近一次获得执行额度的全局序号，用于同优先级之间轮转
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "priority": self.priority,
+            "queued": len(self.waiters),
+            "running": self.running,
+            "admitted": self.admitted,
+            "wait_avg": round(self.wait_total / self.admitted, 4) if self.admitted else None,
+            "wait_max": round(self.wait_max, 4),
+        }
+
+
+# 全局行执行额度（所有房间共享）：同时执行的行数、同一目标主机和同一跳板机后方同时执行的行数
+EXEC_MAX_CONCURRENT_ROWS = env_int("EXEC_MAX_CONCURRENT_ROWS", 100)
+EXEC_MAX_ROWS_PER_HOST = env_int("EXEC_MAX_ROWS_PER_HOST", 4)
+EXEC_MAX_ROWS_PER_JUMP = env_int("EXEC_MAX_ROWS_PER_JUMP", 128)
+
+
+class ExecutionScheduler:
+    """进程级的行执行调度器，所有房间共享
+
+    - 全局额度 ``max_slots`` 限制同时执行的行数；
+    - 同一目标主机、同一跳板机后方的并发行数跨房间受 ``max_per_host`` / ``max_per_jump`` 限制；
+    - 提供 ``concurrency`` 时，每台跳板机（以及直连目标整体）的并发行数还受其自适应上限约束；
+    - 有空闲额度时优先调度优先级高的房间，同优先级下调度正在执行行数最少的房间，
+      避免小批量任务排在大批量任务后面饿死。
+    """
+
+    def __init__(self, max_slots: int = EXEC_MAX_CONCURRENT_ROWS, max_per_host: int = EXEC_MAX_ROWS_PER_HOST,
+                 max_per_jump: int = EXEC_MAX_ROWS_PER_JUMP, concurrency: Optional[AdaptiveConcurrency] = None):
+        self.max_slots = max_slots
+        self.max_per_host = max_per_host
+        self.max_per_jump = max_per_jump
+        self.concurrency = concurrency
+        if concurrency is not None:
+            concurrency.on_change = self._dispatch
+        self.running = 0
+        self._host_running: Dict[str, int] = defaultdict(int)
+        self._jump_running: Dict[Optional[str], int] = defaultdict(int)  # None 表示直连
+        self._rooms: Dict[str, RoomShare] = {}
+        self._admissions = itertools.count(1)
+
+    def register_room(self, room: str, priority: int = 0) -> RoomShare:
+        share = self._rooms.get(room)
+        if share is None:
+            share = self._rooms[room] = RoomShare(room, priority)
+        else:
+            share.priority = priority
+        return share
+
+    def unregister_room(self, room: str):
+        share = self._rooms.get(room)
+        if share is not None and not share.waiters and not share.running:
+            del self._rooms[room]
+
+    def _can_run(self, host: str, jump: Optional[str]) -> bool:
+        if self.running >= self.max_slots or self._host_running[host] >= self.max_per_host:
+            return False
+        limit = self.concurrency.limit(jump) if self.concurrency is not None else None
+        if jump is not None:
+            limit = self.max_per_jump if limit is None else min(limit, self.max_per_jump)
+        return limit is None or self._jump_running[jump] < limit
+
+    def _admit(self, share: RoomShare, host: str, jump: Optional[str], waited: float):
+        self.running += 1
+        self._host_running[host] += 1
+        self._jump_running[jump] += 1
+        share.running += 1
+        share.admitted += 1
+        share.last_admitted = next(self._admissions)
+        share.wait_total += waited
+        share.wait_max = max(share.wait_max, waited)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, room: str, host: str, jump: Optional[str] = None):
+        await self.acquire(room, host, jump)
+        try:
+            yield
+        finally:
+            self.release(room, host, jump)
+
+    async def acquire(self, room: str, host: str, jump: Optional[str] = None):
+        share = self._rooms.get(room) or self.register_room(room)
+        # 有额度说明排队中的行都被主机/跳板机上限挡住，新请求可以直接执行
+        if self._can_run(host, jump):
+            self._admit(share, host, jump, 0.0)
+            return
+        ticket = (asyncio.get_running_loop().create_future(), host, jump, time.monotonic())
+        share.waiters.append(ticket)
+        try:
+            await ticket[0]
+        except asyncio.CancelledError:
+            if ticket[0].done() and not ticket[0].cancelled():
+                self.release(room, host, jump)  # 已获得额度但调用方被取消
+            elif ticket in share.waiters:
+                share.waiters.remove(ticket)
+            raise
+
+    def release(self, room: str, host: str, jump: Optional[str] = None):
+        self.running -= 1
+        self._host_running[host] -= 1
+        if self._host_running[host] <= 0:
+            del self._host_running[host]
+        self._jump_running[jump] -= 1
+        if self._jump_running[jump] <= 0:
+            del self._jump_running[jump]
+        share = self._rooms.get(room)
+        if share is not None:
+            share.running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.running < self.max_slots:
+            best = None
+            for share in self._rooms.values():
+                ticket = next((t for t in share.waiters if not t[0].done() and self._can_run(t[1], t[2])), None)
+                if ticket is None:
+                    continue
+                rank = (-share.priority, share.running, share.last_admitted)
+                if best is None or rank < best[0]:
+                    best = (rank, share, ticket)
+            if best is None:
+                return
+            _, share, ticket = best
+            share.waiters.remove(ticket)
+            future, host, jump, enqueued_at = ticket
+            self._admit(share, host, jump, now - enqueued_at)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_slots": self.max_slots,
+            "max_per_host": self.max_per_host,
+            "max_per_jump": self.max_per_jump,
+            "running": self.running,
+            "queued": sum(len(share.waiters) for share in self._rooms.values()),
+            "rooms": {room: share.stats() for room, share in self._rooms.items()},
+            "concurrency": self.concurrency.stats() if self.concurrency is not None else None,
+        }
+
+
+# 按跳板机自适应调整的并发上限，由建连延迟和错误驱动
+adaptive_concurrency = AdaptiveConcurrency(
+    initial=env_int("ADAPTIVE_INITIAL_LIMIT", 20),
+    min_limit=env_int("ADAPTIVE_MIN_LIMIT", 2),
+    max_limit=env_int("ADAPTIVE_MAX_LIMIT", 128),
+)
+
+# 建连和命令执行的重试策略；重试次数不超过首次尝试的 RETRY_BUDGET_PERCENT%
+retry_policy = RetryPolicy(
+    max_attempts=env_int("RETRY_MAX_ATTEMPTS", 3),
+    budget_ratio=env_int("RETRY_BUDGET_PERCENT", 20) / 100,
+)
+
+# 全局行执行调度器；所有房间共享执行额度
+execution_scheduler = ExecutionScheduler(concurrency=adaptive_concurrency)
+
+# WebSocket连接注册表
+active_rooms = {}  # 存储房间信息，包括请求ID
+
+# 数据模型定义
+NonEmptyStr = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
+CommandStr = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
+PortNumber = Annotated[int, Field(ge=1, le=65535)]
+
+
+class JumpServerConfig(BaseModel):
+    enabled: bool = False
+    ip: Optional[IPvAnyAddress] = None
+    user: Optional[NonEmptyStr] = None
+    port: PortNumber = 22
+
+    @model_validator(mode="after")
+    def require_jump_fields_when_enabled(self):
+        if self.enabled and (self.ip is None or self.user is None):
+            raise ValueError("Jump server IP and username are required when jump server is enabled")
+        return self
+
+    @field_validator("ip")
+    @classmethod
+    def stringify_ip(cls, value):
         return str(value) if value is not None else value
 
 
@@ -550,6 +1647,14 @@ class Row(BaseModel):
     commands: Annotated[List[CommandStr], Field(min_length=1)]
     rowId: NonEmptyStr
     jumpServer: Optional[JumpServerConfig] = None
+    # exec: 每条命令单独打开一个通道；session: 整行命令在同一个远程shell会话中依次执行
+    executionMode: Literal["exec", "session"] = "exec"
+    # 整行（含建连和重试）的时间预算，秒；不设置时只受作业截止时间约束
+    timeout: Optional[float] = Field(default=None, gt=0)
+    # 单条命令（含重试）的时间预算，秒；默认 COMMAND_TIMEOUT
+    commandTimeout: Optional[float] = Field(default=None, gt=0)
+    # 按顺序逐条执行，遇到第一条失败（退出码非0、超时或出错）的命令后跳过其余命令
+    stopOnFailure: bool = False
 
     @field_validator("ip")
     @classmethod
@@ -561,6 +1666,32 @@ class ConfigData(BaseModel):
     name: NonEmptyStr
     data: Dict[str, Any]
 
+
+class PrewarmRequest(BaseModel):
+    config_id: int
+
+
+def rows_from_config(data: Dict[str, Any]) -> List[Row]:
+    """把前端保存的配置（servers/commands/jumpServer）转换为可执行的行，跳过无效行"""
+    commands = [str(cmd).strip() for cmd in data.get("commands") or [] if str(cmd).strip()]
+    jump = data.get("jumpServer") or {}
+    jump_server = dict(jump.get("config") or {}, enabled=bool(jump.get("enabled")))
+    rows = []
+    for idx, server in enumerate(data.get("servers") or []):
+        try:
+            rows.append(Row(
+                ip=server.get("ip"),
+                user=server.get("user") or "root",
+                password=server.get("password"),
+                port=server.get("port") or 22,
+                commands=commands,
+                rowId=f"row-{idx}",
+                jumpServer=jump_server if jump_server["enabled"] else None,
+            ))
+        except Exception as e:
+            logger.debug(f"Skipping invalid server in config: {e}", extra={"row_id": f"row-{idx}"})
+    return rows
+
 def get_db():
     db = SessionLocal()
     try:
@@ -568,342 +1699,1166 @@ def get_db():
     finally:
         db.close()
 
+def insert_ignoring_conflicts(conn, model, index_elements: List[str]):
+    """``INSERT ... ON CONFLICT DO NOTHING``：内容寻址的行可能已由其他写入者（如启动时的迁移线程）写入"""
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing(index_elements=index_elements)
+
+
+def store_output_blobs(conn, outputs: List[str]) -> List[str]:
+    """把输出按内容哈希写入 ``output_blobs``（已存在的跳过），返回与 ``outputs`` 对应的哈希
+
+    先查询已有的哈希以免重复压缩；查询后由其他连接写入的同一输出由 ``ON CONFLICT DO NOTHING`` 跳过，
+    只有本次实际写入的输出块才加入全文检索索引。
+    """
+    hashes = []
+    pending: Dict[str, bytes] = {}
+    for output in outputs:
+        raw = (output or "").encode("utf-8", "replace")
+        digest = hashlib.sha256(raw).hexdigest()
+        hashes.append(digest)
+        pending.setdefault(digest, raw)
+    if pending:
+        existing = set(conn.execute(select(OutputBlob.hash).where(OutputBlob.hash.in_(list(pending)))).scalars())
+        new_blobs = [
+            {"hash": digest, "size": len(raw), "data": zlib.compress(raw, OUTPUT_BLOB_COMPRESSION_LEVEL),
+             "created_at": datetime.datetime.utcnow()}
+            for digest, raw in pending.items() if digest not in existing
+        ]
+        if new_blobs:
+            inserted = conn.execute(
+                insert_ignoring_conflicts(conn, OutputBlob, ["hash"]).returning(OutputBlob.hash), new_blobs
+            ).scalars().all()
+            if inserted and OUTPUT_SEARCH_ENABLED:
+                index_output_blobs(conn, {digest: pending[digest] for digest in inserted})
+    return hashes
+
+
+def index_output_blobs(conn, outputs: Dict[str, bytes]):
+    """把输出块（哈希 -> 未压缩内容）加入全文检索索引，与写入输出块在同一事务中执行"""
+    entries = conn.execute(
+        insert_ignoring_conflicts(conn, OutputSearchEntry, ["hash"]).returning(OutputSearchEntry.id, OutputSearchEntry.hash),
+        [{"hash": digest} for digest in outputs],
+    ).all()
+    if not entries:
+        return
+    conn.execute(
+        text("INSERT INTO output_fts (rowid, body) VALUES (:entry_id, :body)"),
+        [{"entry_id": entry.id, "body": outputs[entry.hash].decode("utf-8", "replace")} for entry in entries],
+    )
+
+
 # 批量保存结果到数据库
-async def save_results_batch(results, db=None):
-    """批量保存命令执行结果到数据库"""
+def save_results_batch(results):
+    """批量保存命令执行结果到数据库；同步执行，由 ``result_writer`` 的写入线程调用
+
+    输出按内容去重压缩后保存在 ``output_blobs``，结果行只引用其哈希。
+    通过 SQLAlchemy Core 以 executemany 批量插入，不经过 ORM 的 unit of work。
+    失败时整批回滚并抛出异常，由调用方重试或记录。
+    """
     if not results:
         return
-        
-    close_db = False
-    if db is None:
-        db = SessionLocal()
-        close_db = True
-        
+
+    # 每个执行新增的结果数和失败数，与结果在同一事务中累加到 runs
+    run_counts: Dict[int, List[int]] = {}
+    for result in results:
+        if result.get("run_id") is not None:
+            counts = run_counts.setdefault(result["run_id"], [0, 0])
+            counts[0] += 1
+            if result.get("exit_status") != 0:
+                counts[1] += 1
+
+    with engine.begin() as conn:
+        hashes = store_output_blobs(conn, [result.get("output") for result in results])
+        rows = [
+            {**result, "output": None, "output_hash": digest, "run_id": result.get("run_id")}
+            for result, digest in zip(results, hashes)
+        ]
+        conn.execute(insert(ServerCommandResult), rows)
+        if run_counts:
+            conn.execute(
+                update(ExecutionRun).where(ExecutionRun.id == bindparam("run_ref")).values(
+                    result_count=ExecutionRun.result_count + bindparam("added"),
+                    failed_result_count=ExecutionRun.failed_result_count + bindparam("added_failed"),
+                ),
+                [{"run_ref": run_id, "added": added, "added_failed": failed} for run_id, (added, failed) in run_counts.items()],
+            )
+    logger.debug(f"Saved {len(results)} results to database")
+
+
+def create_run_record(request_id: str, room: str, rows: List[Row], options: Dict[str, Any]) -> int:
+    """在 ``runs`` 中登记一次执行，返回其 id；保存的配置不含各行密码"""
+    config = {
+        "options": options,
+        "rows": [row.model_dump(mode="json", exclude={"password"}) for row in rows],
+    }
+    with engine.begin() as conn:
+        return conn.execute(insert(ExecutionRun).values(
+            request_id=request_id,
+            room=room,
+            status="running",
+            started_at=datetime.datetime.utcnow(),
+            server_count=len(rows),
+            command_count=sum(len(row.commands) for row in rows),
+            result_count=0,
+            failed_result_count=0,
+            config=json.dumps(config),
+        )).inserted_primary_key[0]
+
+
+def finish_run_record(run_id: int, status: str, summary: Dict[str, Any]):
+    """记录执行的结束状态和行汇总；结果计数由写入线程维护，不在这里覆盖"""
+    with engine.begin() as conn:
+        conn.execute(update(ExecutionRun).where(ExecutionRun.id == run_id).values(
+            status=status,
+            finished_at=datetime.datetime.utcnow(),
+            rows_completed=summary["rowsCompleted"],
+            rows_failed=summary["rowsFailed"],
+            rows_cancelled=summary["rowsCancelled"],
+            rows_skipped=summary["rowsSkipped"],
+            errors=summary["errors"],
+        ))
+
+
+def migrate_inline_outputs(chunk_size: int = 1000) -> int:
+    """把旧版本直接保存在 ``server_command_results.output`` 的输出迁移到 ``output_blobs``
+
+    分批处理，每批一个事务；迁移了数据时最后执行 VACUUM 回收空间。返回迁移的行数。
+    """
+    migrated = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(ServerCommandResult.id, ServerCommandResult.output)
+                .where(ServerCommandResult.output.is_not(None), ServerCommandResult.output_hash.is_(None))
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            hashes = store_output_blobs(conn, [row.output for row in rows])
+            conn.execute(
+                update(ServerCommandResult).where(ServerCommandResult.id == bindparam("row_id")).values(output=None, output_hash=bindparam("digest")),
+                [{"row_id": row.id, "digest": digest} for row, digest in zip(rows, hashes)],
+            )
+        migrated += len(rows)
+    if migrated and engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    if migrated:
+        logger.info(f"Migrated inline command outputs to output_blobs", extra={"rows": migrated})
+    return migrated
+
+
+def index_unsearchable_outputs(chunk_size: int = 500) -> int:
+    """为启用全文检索之前写入的输出块补建索引，返回补建的数量"""
+    if not OUTPUT_SEARCH_ENABLED:
+        return 0
+    indexed = 0
+    while True:
+        with engine.begin() as conn:
+            blobs = conn.execute(
+                select(OutputBlob.hash, OutputBlob.data)
+                .outerjoin(OutputSearchEntry, OutputSearchEntry.hash == OutputBlob.hash)
+                .where(OutputSearchEntry.id.is_(None))
+                .limit(chunk_size)
+            ).all()
+            if not blobs:
+                break
+            index_output_blobs(conn, {blob.hash: zlib.decompress(blob.data) for blob in blobs})
+        indexed += len(blobs)
+    if indexed:
+        logger.info(f"Indexed command outputs for full-text search", extra={"blobs": indexed})
+    return indexed
+
+
+def upgrade_stored_outputs():
+    """启动后在后台执行：迁移旧版本内联保存的输出，再为尚未索引的输出块建全文检索索引"""
     try:
-        db.add_all(results)
-        db.commit()
-        logger.debug(f"Saved {len(results)} results to database")
+        migrate_inline_outputs()
+        index_unsearchable_outputs()
     except Exception as e:
-        db.rollback()
-        logger.error(f"Error saving batch results to database: {e}", exc_info=True)
+        logger.error(f"Error upgrading stored command outputs: {e}", exc_info=True)
+
+
+def output_search_query(q: str) -> str:
+    """把检索词转成 FTS5 查询：按空白切分，每个词作为短语匹配（转义引号），所有词都要出现"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+
+def search_results(db, ip: Optional[str] = None, command: Optional[str] = None, exit_status: Optional[int] = None,
+                   run_id: Optional[int] = None, since: Optional[datetime.datetime] = None,
+                   until: Optional[datetime.datetime] = None, q: Optional[str] = None,
+                   before: Optional[int] = None, limit: int = 100) -> List[ServerCommandResult]:
+    """按条件查询命令结果，按 id 倒序，``before`` 为上一页最后一条的 id（游标分页）
+
+    ``q`` 先在 ``output_fts`` 中找到匹配的输出块，再按 ``output_hash`` 索引找到引用它们的结果。
+    时间为 UTC。
+    """
+    query = db.query(ServerCommandResult).options(joinedload(ServerCommandResult.blob))
+    if ip is not None:
+        query = query.filter(ServerCommandResult.ip == ip)
+    if command is not None:
+        query = query.filter(ServerCommandResult.command == command)
+    if exit_status is not None:
+        query = query.filter(ServerCommandResult.exit_status == exit_status)
+    if run_id is not None:
+        query = query.filter(ServerCommandResult.run_id == run_id)
+    if since is not None:
+        query = query.filter(ServerCommandResult.timestamp >= since)
+    if until is not None:
+        query = query.filter(ServerCommandResult.timestamp < until)
+    if q is not None:
+        matched = text(
+            "SELECT output_search.hash FROM output_fts JOIN output_search ON output_search.id = output_fts.rowid "
+            "WHERE output_fts MATCH :match"
+        ).bindparams(match=output_search_query(q)).columns(hash=String)
+        query = query.filter(ServerCommandResult.output_hash.in_(matched))
+    if before is not None:
+        query = query.filter(ServerCommandResult.id < before)
+    return query.order_by(ServerCommandResult.id.desc()).limit(limit).all()
+
+
+class ResultWriter:
+    """结果写入线程：事件循环只把结果放入有界队列，由独立线程合并提交（group commit）
+
+    SQLite 的提交要等待 fsync，在事件循环中执行会卡住所有行的 SSH 读写和 WebSocket 发送。
+    写入线程每次取出队列中已有的所有批次（最多 ``group_rows`` 行）在一个事务中提交；
+    队列满时 ``submit`` 等待，形成反压。服务关闭时 ``close`` 写完队列中的剩余结果。
+    合并提交失败时逐个批次重试（最多 ``retries`` 次，指数退避），一个批次的错误不影响同组的其他批次；
+    重试后仍失败的批次记录错误日志并计入 ``rowsFailed``。
+    """
+
+    def __init__(self, max_batches: int = 1000, group_rows: int = 2000, retries: int = 3):
+        self.queue: queue.Queue = queue.Queue(maxsize=max_batches)
+        self.group_rows = group_rows
+        self.retries = retries
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.commits = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.commit_failures = 0
+        self.backpressure_waits = 0
+        self.commit_time = 0.0
+        self.commit_time_max = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+                self.thread.start()
+
+    async def submit(self, results: List[Dict[str, Any]]):
+        """放入写入队列；队列满时让出事件循环等待写入线程追上"""
+        if not results:
+            return
+        self.start()
+        batch = list(results)
+        while True:
+            try:
+                self.queue.put_nowait(batch)
+                return
+            except queue.Full:
+                self.backpressure_waits += 1
+                await asyncio.sleep(0.01)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = self.queue.get()
+            taken = 1
+            if batch is None:
+                self.queue.task_done()
+                return
+            batches = [batch]
+            rows = len(batch)
+            while rows < self.group_rows:
+                try:
+                    batch = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if batch is None:
+                    stopping = True
+                    break
+                batches.append(batch)
+                rows += len(batch)
+            started = time.monotonic()
+            try:
+                save_results_batch([result for batch in batches for result in batch])
+                self.rows_written += rows
+            except Exception as e:
+                self.commit_failures += 1
+                logger.warning(f"Group commit of {rows} results failed, retrying per batch: {e}")
+                for batch in batches:
+                    self._save_with_retries(batch)
+            elapsed = time.monotonic() - started
+            self.commits += 1
+            self.commit_time += elapsed
+            self.commit_time_max = max(self.commit_time_max, elapsed)
+            for _ in range(taken):
+                self.queue.task_done()
+
+    def _save_with_retries(self, batch: List[Dict[str, Any]]):
+        for attempt in range(1, self.retries + 1):
+            try:
+                save_results_batch(batch)
+                self.rows_written += len(batch)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.rows_failed += len(batch)
+                    logger.error(f"Failed to save {len(batch)} results after {attempt} attempts: {e}", exc_info=True,
+                                 extra={"rows_failed": self.rows_failed})
+                    return
+                time.sleep(0.05 * 2 ** attempt)
+
+    def flush(self):
+        """阻塞直到队列中的结果全部提交"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def close(self, timeout: float = 30):
+        """写完剩余结果后停止写入线程"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "commits": self.commits,
+            "rowsWritten": self.rows_written,
+            "rowsFailed": self.rows_failed,
+            "commitFailures": self.commit_failures,
+            "backpressureWaits": self.backpressure_waits,
+            "commitTimeAvg": round(self.commit_time / self.commits, 6) if self.commits else 0,
+            "commitTimeMax": round(self.commit_time_max, 6),
+        }
+
+
+result_writer = ResultWriter(
+    max_batches=env_int("RESULT_QUEUE_SIZE", 1000),
+    group_rows=env_int("RESULT_GROUP_COMMIT_ROWS", 2000),
+)
+
+# 单条命令（含重试）的默认时间预算，以及每次创建远程进程的超时，单位秒
+COMMAND_TIMEOUT = env_int("COMMAND_TIMEOUT", 300)
+PROCESS_START_TIMEOUT = 60
+# 会话模式使用的远程shell
+SESSION_SHELL = "sh"
+# 每次从远程进程读取的最大长度
+OUTPUT_READ_SIZE = 65536
+# 单条命令在内存中保留的输出开头和末尾长度（字符），超出部分写入临时文件
+OUTPUT_HEAD_SIZE = env_int("OUTPUT_HEAD_SIZE", 131072)
+OUTPUT_TAIL_SIZE = env_int("OUTPUT_TAIL_SIZE", 393216)
+# 完整输出的临时目录及保留时间（秒）；OUTPUT_SPILL_DIR 设为空字符串时不落盘
+OUTPUT_SPILL_DIR = os.getenv("OUTPUT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "cyclops-outputs"))
+OUTPUT_SPILL_TTL = env_int("OUTPUT_SPILL_TTL", 86400)
+OUTPUT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class OutputBuffer:
+    """按块收集单条命令的输出，只在结束时拼接一次
+
+    总长度不超过 ``head_size + tail_size`` 时完整保留；超出后内存中只保留开头和
+    末尾（末尾为环形缓冲），中间以截断标记代替，完整输出写入临时文件，
+    可通过 ``/api/v1/outputs/{output_id}`` 获取。
+    """
+
+    def __init__(self, head_size: Optional[int] = None, tail_size: Optional[int] = None, spill_dir: Optional[str] = None):
+        self.head_size = OUTPUT_HEAD_SIZE if head_size is None else head_size
+        self.tail_size = OUTPUT_TAIL_SIZE if tail_size is None else tail_size
+        self.spill_dir = OUTPUT_SPILL_DIR if spill_dir is None else spill_dir
+        self.size = 0
+        self.truncated = False
+        self.output_id = None
+        self._chunks: List[str] = []  # 截断前为全部输出，截断后只剩开头
+        self._tail: deque = deque()
+        self._tail_length = 0
+        self._spill = None
+
+    def append(self, data: str):
+        if not data:
+            return
+        self.size += len(data)
+        if self._spill is not None:
+            self._spill.write(data)
+        if self.truncated:
+            self._push_tail(data)
+            return
+        self._chunks.append(data)
+        if self.size > self.head_size + self.tail_size:
+            self._truncate()
+
+    def _truncate(self):
+        data = "".join(self._chunks)
+        self.truncated = True
+        self._open_spill(data)
+        self._chunks = [data[:self.head_size]]
+        self._push_tail(data[self.head_size:])
+
+    def _push_tail(self, data: str):
+        if self.tail_size <= 0:
+            return
+        if len(data) >= self.tail_size:
+            self._tail.clear()
+            self._tail.append(data[-self.tail_size:])
+            self._tail_length = self.tail_size
+            return
+        self._tail.append(data)
+        self._tail_length += len(data)
+        while self._tail_length > self.tail_size:
+            excess = self._tail_length - self.tail_size
+            first = self._tail[0]
+            if len(first) <= excess:
+                self._tail.popleft()
+                self._tail_length -= len(first)
+            else:
+                self._tail[0] = first[excess:]
+                self._tail_length -= excess
+
+    def _open_spill(self, data: str):
+        if not self.spill_dir:
+            return
+        output_id = uuid.uuid4().hex
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._spill = open(os.path.join(self.spill_dir, f"{output_id}.log"), "w", encoding="utf-8", errors="replace")
+            self._spill.write(data)
+        except OSError as e:
+            logger.warning(f"Failed to spill command output to disk: {e}", extra={"spill_dir": self.spill_dir})
+            self.close()
+            return
+        self.output_id = output_id
+
+    def getvalue(self) -> str:
+        if not self.truncated:
+            return "".join(self._chunks).rstrip('\n\r')
+        omitted = self.size - len(self._chunks[0]) - self._tail_length
+        marker = f"\n[... {omitted} characters truncated"
+        if self.output_id:
+            marker += f", full output: /api/v1/outputs/{self.output_id}"
+        marker += " ...]\n"
+        return (self._chunks[0] + marker + "".join(self._tail)).rstrip('\n\r')
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+def spilled_output_path(output_id: str) -> Optional[str]:
+    if not OUTPUT_SPILL_DIR or not OUTPUT_ID_PATTERN.match(output_id):
+        return None
+    path = os.path.join(OUTPUT_SPILL_DIR, f"{output_id}.log")
+    return path if os.path.isfile(path) else None
+
+
+def prune_spilled_outputs(now: Optional[float] = None) -> int:
+    """删除超过保留时间的完整输出文件"""
+    if not OUTPUT_SPILL_DIR or not os.path.isdir(OUTPUT_SPILL_DIR):
+        return 0
+    cutoff = (time.time() if now is None else now) - OUTPUT_SPILL_TTL
+    removed = 0
+    for entry in os.scandir(OUTPUT_SPILL_DIR):
+        try:
+            if entry.name.endswith(".log") and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+async def prune_spilled_outputs_periodically(interval: int = 3600):
+    while True:
+        try:
+            removed = prune_spilled_outputs()
+            if removed:
+                logger.info(f"Removed {removed} expired spilled outputs")
+        except Exception as e:
+            logger.error(f"Error pruning spilled outputs: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+def session_stream_safe_length(buffer: str, start: int, marker: str) -> int:
+    """返回 buffer 中可以安全推送的长度：末尾可能是尚未读完整的分隔行，需暂时保留"""
+    tail = buffer.rfind("\n", start)
+    if tail == -1:
+        return len(buffer)
+    pending = buffer[tail + 1:]
+    if pending.startswith(marker) or marker.startswith(pending):
+        return tail
+    return len(buffer)
+
+
+def build_session_script(commands: List[str], marker: str) -> str:
+    """生成会话脚本：每条命令在子shell中执行（与逐条执行一样不共享cd/变量），
+    stdin 重定向到 /dev/null 以免命令读走后续脚本，结束后输出带退出码的分隔行"""
+    lines = [
+        f"( {cmd}\n) < /dev/null; printf '\\n{marker}:{index}:%d\\n' \"$?\"\n"
+        for index, cmd in enumerate(commands)
+    ]
+    lines.append("exit 0\n")
+    return "".join(lines)
+
+
+class OutputStreamer:
+    """把单条命令的输出分块推送给客户端
+
+    数据按 ``flush_interval`` 时间窗口或 ``flush_bytes`` 字节数合并后再发送，
+    避免每行一条消息。消息类型为 ``output``，与原有的完整结果消息并存。
+    """
+
+    def __init__(self, send, row_id: str, command: str, flush_interval: float = 0.05, flush_bytes: int = 16384):
+        self.send = send
+        self.row_id = row_id
+        self.command = command
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.seq = 0
+        self._buffers: Dict[str, List[str]] = {"stdout": [], "stderr": []}
+        self._sizes: Dict[str, int] = {"stdout": 0, "stderr": 0}
+        self._timer = None
+        self._flush_task: Optional[asyncio.Task] = None  # 计时器触发的发送任务；持有引用直到 close/discard
+        self._lock = asyncio.Lock()
+
+    async def feed(self, stream: str, data: str):
+        if not data:
+            return
+        self._buffers[stream].append(data)
+        self._sizes[stream] += len(data)
+        if self._sizes[stream] >= self.flush_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_later)
+
+    def _flush_later(self):
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def close(self):
+        """命令结束时调用：等待进行中的定时发送，再发送剩余数据"""
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            await task
+        await self.flush()
+
+    def discard(self):
+        """命令未正常结束（出错或行被取消）时调用：取消计时器和定时发送，丢弃剩余数据"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task, self._flush_task = self._flush_task, None
+        if task is not None and not task.done():
+            task.cancel()
+        for stream, chunks in self._buffers.items():
+            chunks.clear()
+            self._sizes[stream] = 0
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:  # 保证分块按顺序发送
+            for stream, chunks in self._buffers.items():
+                if not chunks:
+                    continue
+                data = "".join(chunks)
+                chunks.clear()
+                self._sizes[stream] = 0
+                self.seq += 1
+                try:
+                    await self.send({
+                        "type": "output",
+                        "rowId": self.row_id,
+                        "command": self.command,
+                        "stream": stream,
+                        "seq": self.seq,
+                        "data": data,
+                    })
+                except Exception as e:
+                    logger.debug(f"Failed to stream command output: {e}", extra={"row_id": self.row_id, "command": self.command})
+
+
+def terminate_process(proc):
+    """截止时间到达时结束远程进程：先发送 KILL 信号（部分服务器不支持），再关闭通道"""
+    try:
+        proc.kill()
+    except Exception as e:
+        logger.debug(f"Failed to send KILL signal to remote process: {e}")
+    proc.close()
+
+
+def row_uses_jump_server(row: Row) -> bool:
+    return bool(row.jumpServer and row.jumpServer.enabled and row.jumpServer.ip and row.jumpServer.user)
+
+
+async def open_row_connection(row: Row, leases: list, slot: int = 0, wait: bool = True):
+    """按行配置从连接池获取目标连接（必要时经跳板机），并把占用登记到 ``leases``
+
+    ``slot`` 大于0时获取同一目标的额外连接，用于会话通道不足的情况。``wait`` 为 False 时
+    目标连接达到连接池上限不排队，抛出 :class:`PoolExhausted`。
+    """
+    if row_uses_jump_server(row):
+        jump_conn = await get_jump_server_connection(
+            row.jumpServer.ip,
+            row.jumpServer.user,
+            row.jumpServer.port
+        )
+        leases.append((jump_server_connections, jump_connection_key(row.jumpServer.ip, row.jumpServer.port, row.jumpServer.user), jump_conn))
+
+        # 通过跳板机连接到目标服务器
+        conn = await get_ssh_connection_via_jump(
+            row.ip, row.user, row.password, row.port, jump_conn, row.jumpServer.ip, slot, wait
+        )
+        leases.append((ssh_connections, connection_slot_key(via_jump_connection_key(row.ip, row.port, row.user), slot), conn))
+        return conn, jump_conn
+
+    conn = await get_ssh_connection(row.ip, row.user, row.password, row.port, slot, wait)
+    leases.append((ssh_connections, connection_slot_key(direct_connection_key(row.ip, row.port, row.user), slot), conn))
+    return conn, None
+
+
+def release_leases(leases: list):
+    for pool, key, leased_conn in leases:
+        pool.release(key, leased_conn)
+    leases.clear()
+
+
+# ``/api/v1/pool/prewarm`` 启动的预热任务；持有引用以免任务被回收，服务关闭时取消
+prewarm_tasks: set = set()
+
+
+async def prewarm_rows(rows: List[Row], room: str, request_id: str, priority: int = 0,
+                       skip: Optional[Callable[[Row], bool]] = None):
+    """提前为各行建立连接并放回连接池，后续执行时直接复用
+
+    每次建连都经过全局调度器 ``execution_scheduler``（以 ``room`` 的名义、按 ``priority`` 排队），与正式执行
+    共用全局额度、单主机/单跳板机上限和按跳板机的自适应并发上限；只在建连期间占用额度。拿到额度时
+    ``skip(row)`` 为真的行不再建连，例如正式执行已经开始的行。``room`` 在预热结束后注销。
+    """
+    async def warm(row: Row):
+        leases = []
+        jump = str(row.jumpServer.ip) if row_uses_jump_server(row) else None
+        async with execution_scheduler.slot(room, row.ip, jump):
+            if skip is not None and skip(row):
+                return False
+            try:
+                await open_row_connection(row, leases)
+            except Exception as e:
+                # 预热失败不向客户端报告，正式执行时会按重试逻辑重新建连并报告错误
+                logger.debug(f"Prewarm connection failed: {e}", extra={"request_id": request_id, "row_id": row.rowId, "ip": row.ip})
+                return False
+            finally:
+                release_leases(leases)
+        return True
+
+    execution_scheduler.register_room(room, priority)
+    try:
+        results = await asyncio.gather(*(warm(row) for row in rows))
     finally:
-        if close_db:
-            db.close()
+        execution_scheduler.unregister_room(room)
+    warmed = sum(1 for ok in results if ok)
+    logger.info(f"Prewarmed {warmed}/{len(rows)} connections", extra={"request_id": request_id})
+    return warmed
+
 
-async def exec_row(row: Row, ws: WebSocket, request_id: str):
-    """执行单个服务器上的所有命令，支持跳板机连接"""
+async def exec_row(row: Row, ws: WebSocket, request_id: str, stream: bool = False, room: Optional[str] = None,
+                   deadline: Optional[Deadline] = None, progress: Optional["RoomProgress"] = None,
+                   run_id: Optional[int] = None):
+    """执行单个服务器上的所有命令，支持跳板机连接
+
+    建连和命令执行的重试由 ``retry_policy`` 决定，``room`` 用于按房间统计重试和约束重试预算。
+    ``deadline`` 为作业截止时间，行和命令的超时在其基础上逐级收紧，超时的远程进程会被结束。
+    ``row.stopOnFailure`` 时按顺序逐条执行，遇到第一条失败的命令后跳过其余命令。
+
+    ``stream`` 为 True 时在命令执行过程中推送 ``output`` 分块消息，并在每条命令结束时
+    推送带退出码和耗时的 ``commandCompleted`` 消息。
+    ``progress`` 为房间的聚合进度，在建连、命令完成和出错时增量更新。
+    ``run_id`` 为 ``runs`` 中对应的执行，保存的结果通过它关联。
+
+    返回该行是否全部成功（连接成功且所有命令退出码为0）。
+    """
     results_batch = []
     conn = None
     jump_conn = None
-    max_retries = 3  # 最大重试次数
+    leases = []  # 本行从连接池获取的连接，结束时统一归还
+    channels = None
+    streamers: List[OutputStreamer] = []  # 尚未随结果发送完毕的输出分块，行结束时丢弃
     
+    row_deadline = (deadline or Deadline()).child(row.timeout)
+    command_timeout = row.commandTimeout or COMMAND_TIMEOUT
+    row_failed = False  # 是否有命令失败（退出码非0、超时或执行出错）
+
+    async def report_error(message):
+        if progress is not None:
+            progress.error(message["error"]["code"])
+        await ws.send_json(message)
+
     try:
+        if row_deadline.expired:
+            await report_error(websocket_error(row.rowId, "DEADLINE_EXCEEDED"))
+            return False
+
         # 检查是否需要使用跳板机
-        use_jump_server = (
-            row.jumpServer and 
-            row.jumpServer.enabled and 
-            row.jumpServer.ip and 
-            row.jumpServer.user
-        )
+        use_jump_server = row_uses_jump_server(row)
+        jump_group = str(row.jumpServer.ip) if use_jump_server else None  # 自适应并发按跳板机统计
+        if use_jump_server:
+            pool_key = via_jump_connection_key(row.ip, row.port, row.user)
+        else:
+            pool_key = direct_connection_key(row.ip, row.port, row.user)
         
         start_connect = time.time()
-        retry_count = 0
         last_error = None
+        retries = retry_policy.begin(room)
         
         # 带重试逻辑的连接尝试
-        while retry_count < max_retries:
+        while True:
+            attempt_started = time.monotonic()
             try:
                 if use_jump_server:
-                    # 首先连接到跳板机
                     logger.info(f"Connecting via jump server {row.jumpServer.ip}:{row.jumpServer.port}",
                                extra={"request_id": request_id, "row_id": row.rowId})
-                    
-                    jump_conn = await get_jump_server_connection(
-                        row.jumpServer.ip, 
-                        row.jumpServer.user, 
-                        row.jumpServer.port
-                    )
-                    
-                    # 通过跳板机连接到目标服务器
-                    conn = await get_ssh_connection_via_jump(
-                        row.ip, row.user, row.password, row.port, jump_conn
-                    )
-                    
+
+                conn, jump_conn = await asyncio.wait_for(open_row_connection(row, leases), timeout=row_deadline.timeout())
+
+                if use_jump_server:
                     logger.info(f"Connected to {row.ip}:{row.port} via jump server",
                                extra={"request_id": request_id, "row_id": row.rowId})
-                else:
-                    # 直接连接到目标服务器
-                    conn = await get_ssh_connection(row.ip, row.user, row.password, row.port)
                 
                 connect_time = time.time() - start_connect
                 logger.info(f"SSH connection established in {connect_time:.2f}s", 
                            extra={"request_id": request_id, "row_id": row.rowId, "ip": row.ip})
+                if progress is not None:
+                    progress.connected(connect_time)
                 break  # 连接成功，跳出循环
                 
             except Exception as e:
                 last_error = e
-                retry_count += 1
+                delay = retries.next_delay(e, time.monotonic() - attempt_started, row_deadline)
                 
                 if use_jump_server:
-                    logger.warning(f"Jump server connection attempt {retry_count} failed: {e}", 
+                    logger.warning(f"Jump server connection attempt {retries.attempts} failed: {e}", 
                                  extra={"request_id": request_id, "row_id": row.rowId, "ip": row.ip})
                 else:
-                    logger.warning(f"SSH connection attempt {retry_count} failed: {e}", 
+                    logger.warning(f"SSH connection attempt {retries.attempts} failed: {e}", 
                                  extra={"request_id": request_id, "row_id": row.rowId, "ip": row.ip})
                 
-                if retry_count < max_retries:
-                    # 指数退避重试
-                    await asyncio.sleep(2 ** retry_count)
+                if delay is not None:
+                    # 抖动退避重试
+                    await asyncio.sleep(delay)
                 else:
-                    # 重试次数用尽，向客户端报告错误
-                    error_msg = f"SSH connection failed after {max_retries} attempts: {last_error}"
+                    # 不再重试（次数用尽、预算耗尽或错误不可重试），向客户端报告错误
+                    error_msg = f"SSH connection failed after {retries.attempts} attempts ({retries.stop_reason}): {last_error}"
                     if use_jump_server:
-                        error_msg = f"Jump server connection failed after {max_retries} attempts: {last_error}"
+                        error_msg = f"Jump server connection failed after {retries.attempts} attempts ({retries.stop_reason}): {last_error}"
                     
                     logger.error(error_msg, extra={"request_id": request_id, "row_id": row.rowId, "ip": row.ip})
                     ssh_error = classify_ssh_error(last_error)
                     if use_jump_server:
                         ssh_error["message"] = f"跳板机连接失败：{ssh_error['message']}"
 
-                    await ws.send_json(websocket_error(
+                    await report_error(websocket_error(
                         row.rowId,
                         ssh_error["code"],
                         ssh_error["message"],
-                        details={"attempts": max_retries},
+                        details={"attempts": retries.attempts, "retryStop": retries.stop_reason},
                     ))
-                    return  # 结束函数执行
+                    return False  # 结束函数执行
         
         if conn is None:
             # 如果依然没有连接，返回
-            return
+            return False
+            
+        # 为每个命令设置信号量，防止单个服务器执行过多命令
+        # 通道调度：该行的并发命令数由服务器的会话数上限（学习得到）和可追加的连接数决定
+        channels = RowChannels(row, pool_key, leases)
+        channels.conns[0] = conn
+        
+        # 发送命令结果到客户端并加入数据库批量保存
+        def open_streamer(cmd):
+            if not stream:
+                return None
+            streamer = OutputStreamer(ws.send_json, row.rowId, cmd)
+            streamers.append(streamer)
+            return streamer
+
+        async def report_result(cmd, output, exit_status, execution_time, streamer=None, buffer=None):
+            nonlocal row_failed
+            if streamer is not None:
+                await streamer.close()
+                streamers.remove(streamer)
+
+            # 发送命令输出到客户端
+            if hasattr(exit_status, 'exit_status'):
+                # 如果exit_status是SSHCompletedProcess对象
+                json_exit_status = exit_status.exit_status
+            elif hasattr(exit_status, '__dict__'):
+                # 尝试获取字典表示
+                json_exit_status = exit_status.__dict__.get('exit_status', None)
+            else:
+                # 否则直接使用值，可能是None或整数
+                json_exit_status = exit_status
+            if json_exit_status != 0:
+                row_failed = True
+            if progress is not None:
+                progress.command_finished(json_exit_status, execution_time)
+
+            message = {
+                "rowId": row.rowId,
+                "command": cmd,
+                "output": output,
+                "exitStatus": json_exit_status,
+            }
+            if buffer is not None and buffer.truncated:
+                # 输出过长时只回传开头和末尾，完整输出通过 outputId 获取
+                message.update({"truncated": True, "outputSize": buffer.size, "outputId": buffer.output_id})
+            await ws.send_json(message)
+            if stream:
+                finished_at = time.time()
+                await ws.send_json({
+                    "type": "commandCompleted",
+                    "rowId": row.rowId,
+                    "command": cmd,
+                    "exitStatus": json_exit_status,
+                    "startedAt": finished_at - execution_time,
+                    "finishedAt": finished_at,
+                    "durationMs": round(execution_time * 1000, 1),
+                    "outputChunks": streamer.seq if streamer is not None else 0,
+                })
+            
+            logger.info(f"Command executed in {execution_time:.2f}s", 
+                        extra={
+                            "request_id": request_id,
+                            "row_id": row.rowId,
+                            "command": cmd,
+                            "execution_time": execution_time,
+                            "exit_status": json_exit_status
+                        })
             
-        # 为每个命令设置信号量，防止单个服务器执行过多命令
-        cmd_semaphore = asyncio.Semaphore(5)  # 最多同时执行5个命令，降低了并发度
-        
+            # 准备数据库记录，由结果写入线程保存
+            result = dict(
+                ip=row.ip,
+                user=row.user,
+                password="*****",  # 不存储明文密码
+                port=row.port,
+                command=cmd,
+                output=output,
+                exit_status=json_exit_status,
+                timestamp=datetime.datetime.utcnow(),
+                run_id=run_id,
+            )
+            results_batch.append(result)
+            
+            # 每20条记录放入写入队列一次
+            if len(results_batch) >= 20:
+                await result_writer.submit(results_batch)
+                results_batch.clear()
+
+        # 在同一个远程shell会话中依次执行命令，用随机分隔符切分每条命令的输出和退出码
+        async def run_session(commands):
+            """返回未能在会话中完成的命令，由调用方逐条回退执行"""
+            marker = f"__CYCLOPS_{uuid.uuid4().hex}__"
+            delimiter = re.compile(rf"\n{marker}:(\d+):(\d+)\n")
+            index = 0
+            slot, session_conn = await channels.acquire()
+            proc = None
+            output = None
+            try:
+                proc = await asyncio.wait_for(
+                    session_conn.create_process(SESSION_SHELL, stderr=asyncssh.DEVNULL),
+                    timeout=row_deadline.timeout(PROCESS_START_TIMEOUT)
+                )
+                ssh_connections.mark_ok(channels.slot_key(slot))
+                proc.stdin.write(build_session_script(commands, marker))
+                proc.stdin.write_eof()
+
+                # pending 只保存尚未确认不属于分隔行的少量数据，其余直接移入当前命令的输出
+                pending = ""
+                output = OutputBuffer()
+                streamer = open_streamer(commands[0])
+                start_time = time.time()
+                command_deadline = row_deadline.child(command_timeout)
+                while index < len(commands):
+                    match = delimiter.search(pending)
+                    if match is None:
+                        safe = session_stream_safe_length(pending, 0, marker)
+                        output.append(pending[:safe])
+                        if streamer is not None:
+                            await streamer.feed("stdout", pending[:safe])
+                        pending = pending[safe:]
+                        try:
+                            chunk = await asyncio.wait_for(proc.stdout.read(OUTPUT_READ_SIZE), timeout=command_deadline.timeout())
+                        except asyncio.TimeoutError:
+                            logger.warning(f"Command output reading timed out: {commands[index]}", 
+                                         extra={"request_id": request_id, "row_id": row.rowId, "command": commands[index]})
+                            # 结束会话中仍在运行的命令，剩余命令回退为逐条执行
+                            terminate_process(proc)
+                            output.append(pending)
+                            output.close()
+                            if streamer is not None:
+                                await streamer.feed("stdout", pending)
+                            execution_time = time.time() - start_time
+                            await report_result(commands[index], output.getvalue() + f"\n[Command timed out after {execution_time:.0f} seconds]", None, execution_time, streamer, output)
+                            index += 1
+                            break
+                        if not chunk:
+                            break  # 会话提前结束，剩余命令回退为逐条执行
+                        pending += chunk
+                        continue
+
+                    output.append(pending[:match.start()])
+                    output.close()
+                    if streamer is not None:
+                        await streamer.feed("stdout", pending[:match.start()])
+                    pending = pending[match.end():]
+                    if int(match.group(1)) == index:
+                        await report_result(commands[index], output.getvalue(), int(match.group(2)), time.time() - start_time, streamer, output)
+                        index += 1
+                        if row_failed and row.stopOnFailure:
+                            break  # 其余命令由调用方报告为已跳过
+                        if index < len(commands):
+                            streamer = open_streamer(commands[index])
+                        start_time = time.time()
+                        command_deadline = row_deadline.child(command_timeout)
+                    output = OutputBuffer()
+            except asyncio.CancelledError:
+                if proc is not None:
+                    terminate_process(proc)
+                raise
+            except Exception as e:
+                logger.warning(f"Shell session failed after {index} commands, falling back to per-command execution: {e}", 
+                             extra={"request_id": request_id, "row_id": row.rowId})
+            finally:
+                if output is not None:
+                    output.close()
+                if proc is not None:
+                    proc.close()
+                await channels.release(slot)
+            return commands[index:]
+
         # 定义单个命令执行函数
         async def execute_command(cmd):
-            nonlocal conn, jump_conn  # 引用外部连接变量，以便可以重置
-            async with cmd_semaphore:
-                start_time = time.time()
-                retry_count = 0
-                
-                while retry_count < max_retries:
+            nonlocal row_failed
+            # 先在通道上排队，命令的时间预算从拿到通道时开始计算
+            held = await channels.acquire()
+            start_time = time.time()
+            deadline = row_deadline.child(command_timeout)
+            retries = retry_policy.begin(room)
+            requeue_count = 0
+            if deadline.expired:
+                await channels.release(held[0])
+                row_failed = True
+                await report_error(websocket_error(row.rowId, "DEADLINE_EXCEEDED", command=cmd))
+                return
+            reported = False
+            
+            while True:
+                attempt_started = time.monotonic()
+                try:
+                    slot, channel_conn = held if held is not None else await channels.acquire()
+                    held = None
                     try:
                         # 创建进程并设置超时
                         proc = await asyncio.wait_for(
-                            conn.create_process(cmd),
-                            timeout=60  # 调整为60秒创建进程超时
+                            channel_conn.create_process(cmd),
+                            timeout=deadline.timeout(PROCESS_START_TIMEOUT)
                         )
+                        ssh_connections.mark_ok(channels.slot_key(slot))
                         
-                        # 读取输出
-                        output = ""
+                        # 读取输出：按块读取，结束时只拼接一次
+                        buffer = OutputBuffer()
                         exit_status = None
+                        timed_out = False
+                        streamer = open_streamer(cmd)
                         
                         try:
-                            # 设置读取输出的总超时时间
+                            # 输出读取和等待退出共用命令的剩余时间
                             async def read_output():
-                                nonlocal output
-                                async for line in proc.stdout:
-                                    output += line
-                                output = output.rstrip('\n\r')
-                            
-                            await asyncio.wait_for(read_output(), timeout=300)  # 5分钟输出读取超时
+                                while True:
+                                    chunk = await proc.stdout.read(OUTPUT_READ_SIZE)
+                                    if not chunk:
+                                        break
+                                    buffer.append(chunk)
+                                    if streamer is not None:
+                                        await streamer.feed("stdout", chunk)
+
+                            async def stream_stderr():
+                                while True:
+                                    chunk = await proc.stderr.read(OUTPUT_READ_SIZE)
+                                    if not chunk:
+                                        break
+                                    await streamer.feed("stderr", chunk)
+
+                            readers = [read_output()]
+                            if streamer is not None:
+                                readers.append(stream_stderr())
+                            await asyncio.wait_for(asyncio.gather(*readers), timeout=deadline.timeout())
                                     
                             # 等待进程完成并获取退出状态
-                            exit_status = await proc.wait()
+                            exit_status = await asyncio.wait_for(proc.wait(), timeout=deadline.timeout())
                         except asyncio.TimeoutError:
-                            output += "\n[Command timed out after 300 seconds]"
+                            timed_out = True
                             logger.warning(f"Command output reading timed out: {cmd}", 
                                          extra={"request_id": request_id, "row_id": row.rowId, "command": cmd})
+                            # 结束仍在运行的远程进程并释放通道
+                            terminate_process(proc)
+                        except asyncio.CancelledError:
+                            # 房间被取消：同样结束远程进程
+                            terminate_process(proc)
+                            raise
+                        finally:
+                            buffer.close()
+                        output = buffer.getvalue()
+                        if timed_out:
+                            output += f"\n[Command timed out after {time.time() - start_time:.0f} seconds]"
+                    except asyncssh.misc.ChannelOpenError as e:
+                        if channels.scheduler.limit_reached(slot, e):
+                            raise ChannelLimitReached(str(e)) from e
+                        # 非会话上限导致的通道错误视为链路拥塞信号
+                        adaptive_concurrency.record_failure(jump_group, "SSH_CHANNEL_ERROR")
+                        raise
+                    finally:
+                        await channels.release(slot)
+                    
+                    # 计算执行时间
+                    execution_time = time.time() - start_time
+                    await report_result(cmd, output, exit_status, execution_time, streamer, buffer)
+                    reported = True
+                    
+                    # 命令执行成功，跳出重试循环
+                    break
+                    
+                except ChannelLimitReached as e:
+                    # 会话数已满：连接本身是健康的，重新排队等待空闲通道，不计入重试
+                    requeue_count += 1
+                    if requeue_count <= MAX_CHANNEL_REQUEUES:
+                        logger.debug(f"Channel limit reached, requeueing command", 
+                                     extra={"request_id": request_id, "row_id": row.rowId, "command": cmd})
+                        continue
+                    await report_error(websocket_error(
+                        row.rowId,
+                        "SSH_CHANNEL_ERROR",
+                        command=cmd,
+                        details={"requeues": MAX_CHANNEL_REQUEUES},
+                    ))
+                    break
+
+                except (asyncssh.misc.ChannelOpenError, asyncssh.misc.ConnectionLost) as e:
+                    # 处理连接关闭错误 - 需要重新连接
+                    delay = retries.next_delay(e, time.monotonic() - attempt_started, deadline)
+                    
+                    logger.warning(f"SSH connection closed during command execution (attempt {retries.attempts}): {e}", 
+                                 extra={"request_id": request_id, "row_id": row.rowId, "command": cmd})
+                    
+                    if delay is not None:
+                        # 尝试重新建立连接
+                        try:
+                            # 通道打开失败时先标记为可疑，下次复用前主动探测；连接断开则重建该连接
+                            # 跳板机连接的存活状态由连接池跟踪，失效时会自动重建
+                            if isinstance(e, asyncssh.misc.ChannelOpenError):
+                                ssh_connections.mark_suspect(channels.slot_key(slot))
+                                await asyncio.wait_for(channels.reopen(slot, discard=False), timeout=deadline.timeout())
+                            else:
+                                await asyncio.wait_for(channels.reopen(slot), timeout=deadline.timeout())
+                            
+                            logger.info(f"SSH connection re-established for retry", 
+                                      extra={"request_id": request_id, "row_id": row.rowId})
+                            
+                            # 抖动退避
+                            await asyncio.sleep(delay)
+                        except Exception as conn_error:
+                            logger.error(f"Failed to re-establish SSH connection: {conn_error}", 
+                                       extra={"request_id": request_id, "row_id": row.rowId})
+                            raise  # 重新连接失败，向上抛出异常
+                    else:
+                        # 不再重试
+                        logger.error(f"Giving up command execution due to connection issues ({retries.stop_reason})", 
+                                   extra={"request_id": request_id, "row_id": row.rowId, "command": cmd})
                         
-                        # 计算执行时间
-                        execution_time = time.time() - start_time
-                        
-                        # 发送命令输出到客户端
-                        if hasattr(exit_status, 'exit_status'):
-                            # 如果exit_status是SSHCompletedProcess对象
-                            json_exit_status = exit_status.exit_status
-                        elif hasattr(exit_status, '__dict__'):
-                            # 尝试获取字典表示
-                            json_exit_status = exit_status.__dict__.get('exit_status', None)
-                        else:
-                            # 否则直接使用值，可能是None或整数
-                            json_exit_status = exit_status
-
-                        await ws.send_json({
-                            "rowId": row.rowId,
-                            "command": cmd,
-                            "output": output,
-                            "exitStatus": json_exit_status,
-                        })
-                        
-                        logger.info(f"Command executed in {execution_time:.2f}s", 
-                                    extra={
-                                        "request_id": request_id,
-                                        "row_id": row.rowId,
-                                        "command": cmd,
-                                        "execution_time": execution_time,
-                                        "exit_status": exit_status
-                                    })
-                        
-                        # 准备数据库记录
-                        result = ServerCommandResult(
-                            ip=row.ip,
-                            user=row.user,
-                            password="*****",  # 不存储明文密码
-                            port=row.port,
+                        ssh_error = classify_ssh_error(e)
+                        await report_error(websocket_error(
+                            row.rowId,
+                            ssh_error["code"],
+                            ssh_error["message"],
                             command=cmd,
-                            output=output,
-                            exit_status=json_exit_status,
-                            timestamp=datetime.datetime.utcnow()
-                        )
-                        results_batch.append(result)
-                        
-                        # 每20条记录批量保存一次
-                        if len(results_batch) >= 20:
-                            await save_results_batch(results_batch)
-                            results_batch.clear()
-                        
-                        # 命令执行成功，跳出重试循环
+                            details={"attempts": retries.attempts, "retryStop": retries.stop_reason},
+                        ))
                         break
-                        
-                    except (asyncssh.misc.ChannelOpenError, asyncssh.misc.ConnectionLost) as e:
-                        # 处理连接关闭错误 - 需要重新连接
-                        retry_count += 1
-                        execution_time = time.time() - start_time
-                        
-                        logger.warning(f"SSH connection closed during command execution (attempt {retry_count}): {e}", 
-                                     extra={"request_id": request_id, "row_id": row.rowId, "command": cmd})
-                        
-                        if retry_count < max_retries:
-                            # 尝试重新建立连接
-                            try:
-                                # 将旧连接从连接池中移除
-                                if use_jump_server:
-                                    key = f"via_jump_{row.ip}:{row.port}:{row.user}"
-                                else:
-                                    key = f"{row.ip}:{row.port}:{row.user}"
-                                
-                                if key in ssh_connections:
-                                    del ssh_connections[key]
-                                
-                                # 重新连接
-                                if use_jump_server:
-                                    # 如果是跳板机连接，可能需要重新连接跳板机
-                                    if jump_conn:
-                                        try:
-                                            # 测试跳板机连接是否还有效
-                                            test_proc = await asyncio.wait_for(
-                                                jump_conn.create_process("echo test"),
-                                                timeout=5
-                                            )
-                                            await test_proc.wait()
-                                        except:
-                                            # 跳板机连接也失效了，重新连接
-                                            jump_conn = await get_jump_server_connection(
-                                                row.jumpServer.ip, 
-                                                row.jumpServer.user, 
-                                                row.jumpServer.port
-                                            )
-                                    
-                                    conn = await get_ssh_connection_via_jump(
-                                        row.ip, row.user, row.password, row.port, jump_conn
-                                    )
-                                else:
-                                    conn = await get_ssh_connection(row.ip, row.user, row.password, row.port)
-                                
-                                logger.info(f"SSH connection re-established for retry", 
-                                          extra={"request_id": request_id, "row_id": row.rowId})
-                                
-                                # 指数退避策略
-                                await asyncio.sleep(2 ** retry_count)
-                            except Exception as conn_error:
-                                logger.error(f"Failed to re-establish SSH connection: {conn_error}", 
-                                           extra={"request_id": request_id, "row_id": row.rowId})
-                                raise  # 重新连接失败，向上抛出异常
-                        else:
-                            # 重试次数用尽
-                            logger.error(f"Max retries reached for command execution due to connection issues", 
-                                       extra={"request_id": request_id, "row_id": row.rowId, "command": cmd})
-                            
-                            ssh_error = classify_ssh_error(e)
-                            await ws.send_json(websocket_error(
-                                row.rowId,
-                                ssh_error["code"],
-                                ssh_error["message"],
-                                command=cmd,
-                                details={"attempts": max_retries},
-                            ))
-                            break
+                
+                except asyncio.TimeoutError as e:
+                    execution_time = time.time() - start_time
+                    delay = retries.next_delay(e, time.monotonic() - attempt_started, deadline)
                     
-                    except asyncio.TimeoutError:
-                        execution_time = time.time() - start_time
-                        retry_count += 1
-                        
-                        logger.warning(f"Command timed out (attempt {retry_count}): {cmd}", 
-                                     extra={"request_id": request_id, "row_id": row.rowId})
-                        
-                        if retry_count < max_retries:
-                            # 指数退避策略
-                            await asyncio.sleep(2 ** retry_count)
-                        else:
-                            # 重试次数用尽
-                            logger.error(f"Command execution timed out after {execution_time:.2f}s and {max_retries} attempts", 
-                                       extra={"request_id": request_id, "row_id": row.rowId, "command": cmd})
-                            
-                            await ws.send_json(websocket_error(
-                                row.rowId,
-                                "COMMAND_TIMEOUT",
-                                details={"attempts": max_retries},
-                                command=cmd,
-                            ))
-                            break
+                    logger.warning(f"Command timed out (attempt {retries.attempts}): {cmd}", 
+                                 extra={"request_id": request_id, "row_id": row.rowId})
                     
-                    except Exception as e:
-                        execution_time = time.time() - start_time
-                        retry_count += 1
-                        
-                        logger.error(f"Error executing command (attempt {retry_count}): {e}", 
-                                   exc_info=True,
-                                   extra={
-                                       "request_id": request_id,
-                                       "row_id": row.rowId,
-                                       "command": cmd,
-                                       "execution_time": execution_time
-                                   })
+                    if delay is not None:
+                        # 抖动退避
+                        await asyncio.sleep(delay)
+                    else:
+                        # 不再重试
+                        logger.error(f"Command execution timed out after {execution_time:.2f}s and {retries.attempts} attempts ({retries.stop_reason})", 
+                                   extra={"request_id": request_id, "row_id": row.rowId, "command": cmd})
                         
-                        if retry_count < max_retries:
-                            # 指数退避策略
-                            await asyncio.sleep(2 ** retry_count)
-                        else:
-                            # 重试次数用尽
-                            command_error = classify_command_error(e)
-                            await ws.send_json(websocket_error(
-                                row.rowId,
-                                command_error["code"],
-                                command_error["message"],
-                                command=cmd,
-                            ))
-                            break
-        
-        # 使用有限的并发度执行命令，防止过载
-        # 这里我们将并发命令数从无限制改为最多20个
-        tasks = []
-        for cmd in row.commands:
-            tasks.append(execute_command(cmd))
-            
-            # 每20个命令一批，避免创建过多任务
-            if len(tasks) >= 20:
-                await asyncio.gather(*tasks)
-                tasks = []
+                        await report_error(websocket_error(
+                            row.rowId,
+                            "COMMAND_TIMEOUT",
+                            details={"attempts": retries.attempts, "retryStop": retries.stop_reason},
+                            command=cmd,
+                        ))
+                        break
                 
-        # 执行剩余的命令
-        if tasks:
-            await asyncio.gather(*tasks)
-        
-        # 保存剩余结果
-        if results_batch:
-            await save_results_batch(results_batch)
+                except Exception as e:
+                    execution_time = time.time() - start_time
+                    delay = retries.next_delay(e, time.monotonic() - attempt_started, deadline)
+                    
+                    logger.error(f"Error executing command (attempt {retries.attempts}): {e}", 
+                               exc_info=True,
+                               extra={
+                                   "request_id": request_id,
+                                   "row_id": row.rowId,
+                                   "command": cmd,
+                                   "execution_time": execution_time
+                               })
+                    
+                    if delay is not None:
+                        # 抖动退避
+                        await asyncio.sleep(delay)
+                    else:
+                        # 不再重试
+                        command_error = classify_command_error(e)
+                        await report_error(websocket_error(
+                            row.rowId,
+                            command_error["code"],
+                            command_error["message"],
+                            command=cmd,
+                        ))
+                        break
+
+            if not reported:
+                row_failed = True  # 命令因错误未能执行完成
+    
+        commands = row.commands
+        if row.executionMode == "session":
+            commands = await run_session(commands)
+
+        if row.stopOnFailure:
+            # 按顺序逐条执行，遇到第一条失败的命令即停止，其余命令报告为已跳过
+            for index, cmd in enumerate(commands):
+                if row_failed:
+                    for skipped in commands[index:]:
+                        await report_error(websocket_error(row.rowId, "COMMAND_SKIPPED", command=skipped))
+                    break
+                await execute_command(cmd)
+            return not row_failed
+
+        # 所有命令同时在 RowChannels 上排队，有空闲通道即开始执行，不按批次等待
+        await asyncio.gather(*(execute_command(cmd) for cmd in commands))
+        return not row_failed
             
     except Exception as exc:
         logger.error(f"Error in SSH session: {exc}", 
@@ -911,19 +2866,34 @@ async def exec_row(row: Row, ws: WebSocket, request_id: str):
                    extra={"request_id": request_id, "row_id": row.rowId, "ip": row.ip})
         
         session_error = classify_command_error(exc)
-        await ws.send_json(websocket_error(
+        await report_error(websocket_error(
             row.rowId,
             session_error["code"],
             session_error["message"],
         ))
+        return False
+    finally:
+        # 保存剩余结果（行被取消时也保留已完成命令的结果）
+        if results_batch:
+            await result_writer.submit(results_batch)
+        if channels is not None:
+            channels.close()
+        for streamer in streamers:
+            streamer.discard()
+        release_leases(leases)
 
 from sqlalchemy import text
 from sqlalchemy import inspect
+
+# startup_event 创建的后台任务，shutdown_event 中取消并等待结束
+background_tasks: List[asyncio.Task] = []
+
 # 在应用启动时检查数据库并添加缺失的列
 @app.on_event("startup")
 async def startup_event():
-    # 启动连接清理任务
-    asyncio.create_task(cleanup_connections())
+    # 启动连接清理任务；保存任务引用，关闭时取消
+    background_tasks.append(asyncio.create_task(cleanup_connections()))
+    background_tasks.append(asyncio.create_task(prune_spilled_outputs_periodically()))
     logger.info("Application started, connection cleanup task running")
     
     # 检查并更新数据库结构
@@ -939,13 +2909,76 @@ async def startup_event():
                 # 使用 text() 函数将 SQL 字符串转化为可执行对象
                 conn.execute(text('ALTER TABLE server_command_results ADD COLUMN exit_status INTEGER'))
                 logger.info("'exit_status' column added successfully.")
+
+        # 检查是否缺少 output_hash 列（输出改为按内容寻址保存）
+        if 'output_hash' not in columns:
+            logger.info("Missing 'output_hash' column, adding it.")
+            with engine.begin() as conn:
+                conn.execute(text('ALTER TABLE server_command_results ADD COLUMN output_hash VARCHAR REFERENCES output_blobs(hash)'))
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_server_command_results_output_hash ON server_command_results (output_hash)'))
+                logger.info("'output_hash' column added successfully.")
+
+        # 检查是否缺少 run_id 列（结果关联到 runs 表）
+        if 'run_id' not in columns:
+            logger.info("Missing 'run_id' column, adding it.")
+            with engine.begin() as conn:
+                conn.execute(text('ALTER TABLE server_command_results ADD COLUMN run_id INTEGER REFERENCES runs(id)'))
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_server_command_results_run_id ON server_command_results (run_id)'))
+                logger.info("'run_id' column added successfully.")
+
+        # 已有数据库上补建结果查询的索引（create_all 不会为已存在的表创建新索引）
+        for index in ServerCommandResult.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+        # 上次服务退出时仍在执行的记录不会再结束
+        with engine.begin() as conn:
+            conn.execute(update(ExecutionRun).where(ExecutionRun.status == "running").values(status="interrupted"))
     except Exception as e:
         logger.error(f"Error checking or adding columns: {e}", exc_info=True)
 
+    # 在后台把旧结果的输出迁移到 output_blobs 并补建全文检索索引，不阻塞启动
+    asyncio.get_running_loop().run_in_executor(None, upgrade_stored_outputs)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 先取消仍在执行的房间并等待其结束：各行结束远程进程、结果进入写入队列、执行记录标记为已取消
+    runs = [room_data["run"] for room_data in active_rooms.values() if room_data.get("run") is not None]
+    for run in runs:
+        run.cancel("shutdown")
+    await asyncio.gather(*(run.task for run in runs if run.task is not None), return_exceptions=True)
+
+    # 再停止后台维护、预热和房间清理任务，然后关闭连接池（目标主机连接先于其所经过的跳板机连接）
+    tasks = background_tasks + list(prewarm_tasks) + list(room_cleanup_tasks) + [
+        room_data["prewarm_task"] for room_data in active_rooms.values() if room_data.get("prewarm_task") is not None
+    ]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    background_tasks.clear()
+    await ssh_connections.close()
+    await jump_server_connections.close()
+
+    # 写完队列中剩余的结果再退出
+    await asyncio.get_running_loop().run_in_executor(None, result_writer.close)
+    logger.info("Result writer flushed", extra=result_writer.stats())
+
 # API端点：执行命令
 @app.post("/api/v1/execute")
-async def execute(rows: List[Row]):
-    """创建房间ID；前端应立即打开WebSocket。"""
+async def execute(rows: List[Row], prewarm: bool = False, stream: bool = False, priority: int = 0, deadline: Optional[float] = None,
+                  cancel_on_disconnect: bool = False, stop_on_failure: bool = False,
+                  max_failures: Optional[int] = None, max_failure_rate: Optional[float] = None,
+                  failure_window: Optional[int] = None, canary: int = 0):
+    """创建房间并在后台开始执行；客户端通过 ``/ws/{room}`` 订阅执行消息。
+
+    ``prewarm=true`` 时以低于本房间各行的优先级为尚未开始的行预先建连，只使用行暂时用不上的执行额度。
+    ``stream=true`` 时执行过程中产生输出分块，供 ``stream=true`` 的订阅者接收。
+    ``priority`` 越大，全局执行额度紧张时越优先调度该房间的行。
+    ``deadline`` 为整个作业的时间预算（秒，从提交时开始计算），到期后未完成的命令会被结束。
+    ``cancel_on_disconnect=true`` 时最后一个 WebSocket 断开后自动取消执行。
+    ``stop_on_failure``、``max_failures``、``max_failure_rate``、``failure_window``、``canary``
+    为提前终止策略，见 ``AbortPolicy``。
+    """
     # 生成唯一请求ID和房间ID
     request_id = f"req-{uuid.uuid4().hex[:8]}"
     room = uuid.uuid4().hex
@@ -954,6 +2987,15 @@ async def execute(rows: List[Row]):
     if not rows:
         logger.warning(f"Empty request received", extra={"request_id": request_id})
         raise HTTPException(status_code=400, detail=error_payload("VALIDATION_ERROR", "No server data provided"))
+    if deadline is not None and deadline <= 0:
+        raise HTTPException(status_code=400, detail=error_payload("VALIDATION_ERROR", "Deadline must be positive"))
+    if (max_failures is not None and max_failures < 1) or (failure_window is not None and failure_window < 1) or canary < 0:
+        raise HTTPException(status_code=400, detail=error_payload("VALIDATION_ERROR", "max_failures and failure_window must be positive and canary non-negative"))
+    if max_failure_rate is not None and not 0 <= max_failure_rate < 1:
+        raise HTTPException(status_code=400, detail=error_payload("VALIDATION_ERROR", "max_failure_rate must be in [0, 1)"))
+    if stop_on_failure:
+        for row in rows:
+            row.stopOnFailure = True
     
     # 验证跳板机配置
     for row in rows:
@@ -969,11 +3011,37 @@ async def execute(rows: List[Row]):
         "request_id": request_id,
         "created_at": datetime.datetime.utcnow().isoformat(),
         "server_count": len(rows),
-        "command_count": sum(len(row.commands) for row in rows)
+        "command_count": sum(len(row.commands) for row in rows),
+        "priority": priority,
+        "deadline": Deadline.after(deadline),
+        "cancel_on_disconnect": cancel_on_disconnect,
+        "stream": stream,
+        "abort_policy": AbortPolicy(len(rows), max_failures, max_failure_rate, failure_window, canary),
     }
+    # 登记到 runs 表；失败时仍然执行，只是结果不关联到执行
+    try:
+        active_rooms[room]["run_id"] = await asyncio.get_running_loop().run_in_executor(None, create_run_record, request_id, room, rows, {
+            "prewarm": prewarm, "stream": stream, "priority": priority, "deadline": deadline,
+            "cancel_on_disconnect": cancel_on_disconnect, "stop_on_failure": stop_on_failure,
+            "max_failures": max_failures, "max_failure_rate": max_failure_rate,
+            "failure_window": failure_window, "canary": canary,
+        })
+    except Exception:
+        active_rooms[room]["run_id"] = None
+        logger.error(f"Error recording run", exc_info=True, extra={"request_id": request_id, "room": room})
+    execution_scheduler.register_room(room, priority)
+    run = active_rooms[room]["run"] = RoomRun(room, rows)
+    run.task = asyncio.create_task(run_room(room, run, active_rooms[room]))
+    if prewarm:
+        # 执行已经开始：预热以低于本房间各行的优先级排队，只使用行暂时用不上的额度（例如金丝雀阶段），
+        # 并跳过已轮到执行的行，避免预热抢在正式执行之前占满额度
+        active_rooms[room]["prewarm_task"] = asyncio.create_task(prewarm_rows(
+            rows, f"{room}:prewarm", request_id, priority - 1,
+            skip=lambda row: not run.running or row.rowId in run.started_rows,
+        ))
     
-    # 设置自动清理任务
-    asyncio.create_task(cleanup_room(room, 3600))  # 1小时后清理房间数据
+    # 执行结束（完成、取消或终止）后再开始计时清理房间数据，执行中的房间不会被清理
+    run.task.add_done_callback(lambda _: schedule_room_cleanup(room))
     
     logger.info(f"Execution request received", 
                extra={
@@ -983,69 +3051,900 @@ async def execute(rows: List[Row]):
                    "command_count": sum(len(row.commands) for row in rows)
                })
     
-    return {"room": room, "request_id": request_id}
+    return {"room": room, "request_id": request_id, "run_id": active_rooms[room]["run_id"]}
+
+# 执行结束后保留房间数据的秒数，期间可以重连补发事件、查询汇总
+ROOM_RETENTION = 3600
+room_cleanup_tasks: set = set()  # 等待中的房间清理任务；持有引用以免任务被回收，服务关闭时取消
+
+
+def schedule_room_cleanup(room_id: str, delay: Optional[float] = None):
+    task = asyncio.create_task(cleanup_room(room_id, ROOM_RETENTION if delay is None else delay))
+    room_cleanup_tasks.add(task)
+    task.add_done_callback(room_cleanup_tasks.discard)
+
 
 # 房间数据清理函数
-async def cleanup_room(room_id: str, delay: int):
-    """延迟清理房间数据"""
+async def cleanup_room(room_id: str, delay: float):
+    """延迟清理房间数据；到期时执行仍在进行则重新计时"""
     await asyncio.sleep(delay)
+    run = active_rooms.get(room_id, {}).get("run")
+    if run is not None and run.running:
+        schedule_room_cleanup(room_id, delay)
+        return
     if room_id in active_rooms:
         logger.info(f"Cleaning up expired room", extra={"room": room_id})
-        del active_rooms[room_id]
+        prewarm_task = active_rooms.pop(room_id).get("prewarm_task")
+        if prewarm_task is not None and not prewarm_task.done():
+            prewarm_task.cancel()
+    execution_scheduler.unregister_room(room_id)
+    retry_policy.forget_room(room_id)
+
+# 按失败比例终止前至少需要完成的行数，避免最初几行失败就终止
+ABORT_MIN_SAMPLE = env_int("ABORT_MIN_SAMPLE", 20)
+
+
+class AbortPolicy:
+    """房间级提前终止策略，按行的成败判断
+
+    - ``max_failures``：失败行数达到该值时终止；
+    - ``max_failure_rate``：已完成的行中失败的比例超过该值时终止，至少完成 ``min_sample`` 行
+      （不超过 ``window`` 和总行数）后才检查；
+    - ``window``：只在前 N 个完成的行内检查上述两个阈值，之后不再终止；
+    - ``canary``：先执行前 K 行，任一失败即终止，全部成功后才执行其余行。
+    """
+
+    def __init__(self, total_rows: int, max_failures: Optional[int] = None, max_failure_rate: Optional[float] = None,
+                 window: Optional[int] = None, canary: int = 0, min_sample: Optional[int] = None):
+        self.total_rows = total_rows
+        self.max_failures = max_failures
+        self.max_failure_rate = max_failure_rate
+        self.window = window
+        self.canary = min(canary, total_rows)
+        self.min_sample = max(1, min(ABORT_MIN_SAMPLE if min_sample is None else min_sample,
+                                     window if window is not None else total_rows, total_rows))
+        self.completions = 0
+        self.failures = 0
+
+    def record(self, ok: bool, canary: bool = False) -> Optional[str]:
+        """记录一行的结果，需要终止时返回原因"""
+        self.completions += 1
+        if not ok:
+            self.failures += 1
+            if canary:
+                return "canary_failed"
+        if self.window is not None and self.completions > self.window:
+            return None
+        if not ok and self.max_failures is not None and self.failures >= self.max_failures:
+            return "max_failures"
+        if (self.max_failure_rate is not None and self.completions >= self.min_sample
+                and self.failures / self.completions > self.max_failure_rate):
+            return "max_failure_rate"
+        return None
+
+
+# 只推送给 ``stream=true`` 订阅者的消息类型；这类消息只实时推送，不写入事件日志
+STREAM_EVENT_TYPES = {"output", "commandCompleted"}
+
+# 每个房间事件日志保留的事件数和大致字节数，超出后最早的事件压缩为汇总
+ROOM_EVENT_LOG_SIZE = env_int("ROOM_EVENT_LOG_SIZE", 10000)
+ROOM_EVENT_LOG_BYTES = env_int("ROOM_EVENT_LOG_BYTES", 64 * 1024 * 1024)
+
+# 每个订阅者的发送队列长度、合并发送的时间窗口（毫秒）和每帧最多合并的消息数
+SUBSCRIBER_QUEUE_SIZE = env_int("WS_SUBSCRIBER_QUEUE_SIZE", 1000)
+WS_BATCH_WINDOW = env_int("WS_BATCH_WINDOW_MS", 20) / 1000
+WS_BATCH_MAX = env_int("WS_BATCH_MAX", 500)
+
+# ``mode=summary`` 订阅者接收聚合进度的间隔（毫秒）和列出的最慢主机数
+PROGRESS_INTERVAL = env_int("PROGRESS_INTERVAL_MS", 1000) / 1000
+PROGRESS_SLOWEST = env_int("PROGRESS_SLOWEST_HOSTS", 10)
+
+
+class LatencyHistogram:
+    """按几何分桶（每桶放大20%）累计耗时，O(1) 内存地估算百分位"""
+
+    BOUNDS = [0.001 * 1.2 ** i for i in range(90)]  # 1ms 到约 3.4 小时
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.total += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.total:
+            return None
+        rank = p * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.BOUNDS[index] if index < len(self.BOUNDS) else self.max, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+
+        return {
+            "count": self.total,
+            "p50": ms(self.percentile(0.5)),
+            "p90": ms(self.percentile(0.9)),
+            "p99": ms(self.percentile(0.99)),
+            "max": ms(self.max if self.total else None),
+        }
+
+
+class RoomProgress:
+    """房间的聚合进度：在行开始/结束和 ``exec_row`` 的建连、命令完成、出错处增量更新，不从结果重新统计"""
+
+    def __init__(self, total_rows: int):
+        self.total_rows = total_rows
+        self.rows_succeeded = 0
+        self.rows_failed = 0
+        self.commands_succeeded = 0
+        self.commands_failed = 0
+        self.command_errors = 0
+        self.error_codes: Dict[str, int] = defaultdict(int)
+        self.connect_times = LatencyHistogram()
+        self.exec_times = LatencyHistogram()
+        self.outstanding: Dict[str, Any] = {}  # rowId -> (开始时间, ip)
+        self.started_at = time.time()
+
+    def row_started(self, row: Row):
+        self.outstanding[row.rowId] = (time.monotonic(), row.ip)
+
+    def row_finished(self, row: Row, ok: bool):
+        self.outstanding.pop(row.rowId, None)
+        if ok:
+            self.rows_succeeded += 1
+        else:
+            self.rows_failed += 1
+
+    def connected(self, seconds: float):
+        self.connect_times.record(seconds)
+
+    def command_finished(self, exit_status: Optional[int], seconds: float):
+        self.exec_times.record(seconds)
+        if exit_status == 0:
+            self.commands_succeeded += 1
+        else:
+            self.commands_failed += 1
+
+    def error(self, code: str):
+        self.command_errors += 1
+        self.error_codes[code] += 1
+
+    def snapshot(self, slowest: int = PROGRESS_SLOWEST) -> Dict[str, Any]:
+        now = time.monotonic()
+        finished = self.rows_succeeded + self.rows_failed
+        oldest = heapq.nsmallest(slowest, self.outstanding.items(), key=lambda item: item[1][0])
+        return {
+            "type": "progress",
+            "rows": {
+                "total": self.total_rows,
+                "pending": self.total_rows - finished - len(self.outstanding),
+                "running": len(self.outstanding),
+                "succeeded": self.rows_succeeded,
+                "failed": self.rows_failed,
+            },
+            "commands": {"succeeded": self.commands_succeeded, "failed": self.commands_failed, "errors": self.command_errors},
+            "errorCodes": dict(self.error_codes),
+            "connectMs": self.connect_times.snapshot(),
+            "execMs": self.exec_times.snapshot(),
+            "slowest": [
+                {"rowId": row_id, "ip": str(ip), "elapsed": round(now - started, 3)}
+                for row_id, (started, ip) in oldest
+            ],
+            "elapsed": round(time.time() - self.started_at, 3),
+        }
+
+
+# ``protocol=msgpack`` 时用序号代替的字段名，随握手消息发给客户端
+WIRE_KEYS = [
+    "rowId", "command", "output", "exitStatus", "eventSeq", "type", "stream", "seq", "data", "status",
+    "error", "truncated", "outputSize", "outputId", "startedAt", "finishedAt", "durationMs", "summary",
+    "retries", "rows", "errors",
+]
+# 取值重复出现、按连接编号的字段
+WIRE_INTERNED_KEYS = {"rowId", "command"}
+# 与 ``error`` 重复的旧字段，客户端解码时自行补全
+WIRE_LEGACY_KEYS = {"errorCode", "errorMessage"}
+
+
+class MsgpackEncoder:
+    """``protocol=msgpack`` 的编码：每帧是一个 MessagePack 数组，每条消息是一个 map
+
+    - ``WIRE_KEYS`` 中的字段名替换为序号，其余字段名保持字符串；
+    - ``rowId`` 和 ``command`` 的取值按连接编号，首次出现发送 ``[编号, 字符串]``，之后只发送编号；
+    - 省略旧字段 ``errorCode``/``errorMessage``。
+
+    大输出的压缩由 WebSocket 的 permessage-deflate 扩展完成（uvicorn 默认协商）。
+    """
+
+    KEY_INDEX = {key: index for index, key in enumerate(WIRE_KEYS)}
+
+    def __init__(self):
+        self.interned: Dict[str, Dict[str, int]] = {key: {} for key in WIRE_INTERNED_KEYS}
+
+    @staticmethod
+    def hello() -> Dict[str, Any]:
+        return {"type": "hello", "protocol": "msgpack", "keys": WIRE_KEYS}
+
+    def _intern(self, key: str, value: Any) -> Any:
+        if not isinstance(value, str):
+            return value
+        table = self.interned[key]
+        if value in table:
+            return table[value]
+        table[value] = len(table)
+        return [table[value], value]
+
+    def encode_message(self, message: Dict[str, Any]) -> Dict[Any, Any]:
+        encoded = {}
+        for key, value in message.items():
+            if key in WIRE_LEGACY_KEYS:
+                continue
+            if key in WIRE_INTERNED_KEYS:
+                value = self._intern(key, value)
+            encoded[self.KEY_INDEX.get(key, key)] = value
+        return encoded
+
+    def encode(self, frame: List[Dict[str, Any]]) -> bytes:
+        return msgpack.packb([self.encode_message(message) for message in frame], use_bin_type=True)
+
+
+class RoomEventLog:
+    """房间的事件日志：每个事件带递增的 ``eventSeq``，供断线重连的订阅者补发
+
+    超出容量时最早的事件被合并进 ``compacted`` 汇总（按行统计命令数、失败数和错误数），
+    内存占用与房间的行数相关，而与事件总数无关。被压缩事件的完整结果仍保存在结果数据库中。
+    """
+
+    def __init__(self, max_events: int = ROOM_EVENT_LOG_SIZE, max_bytes: int = ROOM_EVENT_LOG_BYTES):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.events: deque = deque()
+        self.sizes: deque = deque()
+        self.bytes = 0
+        self.last_seq = 0
+        self.compacted_seq = 0  # 已压缩的最后一个事件序号
+        self.compacted_rows: Dict[str, Dict[str, int]] = {}
+        self.compacted_errors = 0
+
+    def append(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        self.last_seq += 1
+        event = {**message, "eventSeq": self.last_seq}
+        size = len(event.get("output") or "") + 256
+        self.events.append(event)
+        self.sizes.append(size)
+        self.bytes += size
+        while len(self.events) > 1 and (len(self.events) > self.max_events or self.bytes > self.max_bytes):
+            self._compact(self.events.popleft())
+            self.bytes -= self.sizes.popleft()
+        return event
+
+    def _compact(self, event: Dict[str, Any]):
+        self.compacted_seq = event["eventSeq"]
+        row_id = event.get("rowId")
+        if row_id is None:
+            if "error" in event:
+                self.compacted_errors += 1
+            return
+        row = self.compacted_rows.setdefault(row_id, {"commands": 0, "failed": 0, "errors": 0})
+        if "exitStatus" in event:
+            row["commands"] += 1
+            if event["exitStatus"] != 0:
+                row["failed"] += 1
+        elif "error" in event:
+            row["errors"] += 1
+
+    def compacted_summary(self) -> Dict[str, Any]:
+        return {
+            "type": "compacted",
+            "eventSeq": self.compacted_seq,
+            "rows": self.compacted_rows,
+            "errors": self.compacted_errors,
+        }
+
+    def since(self, seq: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """返回序号大于 ``seq`` 的事件（最多 ``limit`` 条）；其中已被压缩的部分以一条汇总代替"""
+        replay = []
+        if seq < self.compacted_seq:
+            replay.append(self.compacted_summary())
+            seq = self.compacted_seq
+        if self.events:
+            start = max(0, seq - self.events[0]["eventSeq"] + 1)
+            stop = None if limit is None else start + max(limit - len(replay), 0)
+            replay.extend(itertools.islice(self.events, start, stop))
+        return replay
+
+    def stats(self) -> Dict[str, Any]:
+        return {"lastSeq": self.last_seq, "compactedSeq": self.compacted_seq, "retained": len(self.events), "bytes": self.bytes}
+
+
+class RoomSubscriber:
+    """房间的一个 WebSocket 订阅者，由独立的发送任务从有界队列取消息发送
+
+    行任务只把消息放入队列（``offer``），不等待网络，浏览器慢不会拖慢 SSH 执行。
+    ``batch=true`` 时在 ``WS_BATCH_WINDOW`` 内合并排队的消息，以 JSON 数组一帧发送。
+    队列满时先丢弃排队中的进度消息（输出分块等）；仍然满时清空队列并标记为落后（``behind``），
+    之后从事件日志按 ``last_seq`` 补发，结果消息不会丢失。新连接的订阅者也从落后状态开始补发历史事件。
+    """
+
+    def __init__(self, ws: WebSocket, events: RoomEventLog, stream: bool = False, since: int = 0, batch: bool = False,
+                 encoder: Optional[MsgpackEncoder] = None, summary: bool = False):
+        self.ws = ws
+        self.events = events
+        self.stream = stream
+        self.batch = batch
+        self.encoder = encoder
+        self.summary = summary  # 只接收聚合进度和结束状态
+        self.open = True
+        self.behind = not summary
+        self.closing = False  # 执行已结束：发完剩余消息后退出
+        self.last_seq = events.last_seq if summary else since
+        self.queue: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        self.frames = 0
+        self.messages = 0
+        self.dropped = 0
+        self.fell_behind = 0
+        self.queue_peak = 0
+        self.send_time = 0.0
+        self.send_time_max = 0.0
+        self.bytes_sent = 0
+
+    def wants(self, message: Dict[str, Any]) -> bool:
+        if self.summary:
+            return message.get("type") == "progress" or "status" in message
+        return self.stream or message.get("type") not in STREAM_EVENT_TYPES
+
+    def offer(self, message: Dict[str, Any]):
+        """放入发送队列，不等待；落后期间结果消息之后从事件日志补发，进度消息直接丢弃"""
+        if not self.open or not self.wants(message):
+            return
+        durable = "eventSeq" in message
+        if self.behind:
+            if not durable:
+                self.dropped += 1
+            return
+        if len(self.queue) >= SUBSCRIBER_QUEUE_SIZE:
+            kept = deque(queued for queued in self.queue if "eventSeq" in queued)
+            self.dropped += len(self.queue) - len(kept)
+            self.queue = kept
+            if not durable:
+                self.dropped += 1
+                return
+            if len(self.queue) >= SUBSCRIBER_QUEUE_SIZE:
+                self.queue.clear()
+                self.behind = True
+                self.fell_behind += 1
+                self.wakeup.set()
+                return
+        self.queue.append(message)
+        self.queue_peak = max(self.queue_peak, len(self.queue))
+        self.wakeup.set()
+
+    def close(self):
+        """执行结束：发送任务发完剩余消息后退出"""
+        self.closing = True
+        self.wakeup.set()
+
+    async def run_sender(self):
+        while self.open:
+            if self.behind:
+                pending = self.events.since(self.last_seq, WS_BATCH_MAX)
+                if pending:
+                    frame = [event for event in pending if self.wants(event)]
+                    if frame:
+                        await self._send(frame)
+                    self.last_seq = pending[-1]["eventSeq"]
+                else:
+                    self.behind = False  # 已追上事件日志，之后接收实时消息
+                continue
+            if not self.queue:
+                if self.closing:
+                    return
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            if self.batch and len(self.queue) < WS_BATCH_MAX and not self.closing:
+                await asyncio.sleep(WS_BATCH_WINDOW)
+                if self.behind:
+                    continue
+            count = min(len(self.queue), WS_BATCH_MAX if self.batch else 1)
+            await self._send([self.queue.popleft() for _ in range(count)])
+
+    async def _send(self, frame: List[Dict[str, Any]]):
+        started = time.monotonic()
+        try:
+            if self.encoder is not None:
+                data = self.encoder.encode(frame)
+                self.bytes_sent += len(data)
+                await self.ws.send_bytes(data)
+            elif self.batch:
+                text = json.dumps(frame, separators=(",", ":"), ensure_ascii=False)
+                self.bytes_sent += len(text)
+                await self.ws.send_text(text)
+            else:
+                for message in frame:
+                    text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+                    self.bytes_sent += len(text)
+                    await self.ws.send_text(text)
+        except Exception as e:
+            self.open = False
+            logger.debug(f"WebSocket send failed, dropping subscriber: {e}")
+            return
+        elapsed = time.monotonic() - started
+        self.send_time += elapsed
+        self.send_time_max = max(self.send_time_max, elapsed)
+        self.frames += 1
+        self.messages += len(frame)
+        for message in frame:
+            if "eventSeq" in message:
+                self.last_seq = message["eventSeq"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stream": self.stream,
+            "batch": self.batch,
+            "summary": self.summary,
+            "protocol": "msgpack" if self.encoder is not None else "json",
+            "behind": self.behind,
+            "lastSeq": self.last_seq,
+            "queueDepth": len(self.queue),
+            "queuePeak": self.queue_peak,
+            "frames": self.frames,
+            "messages": self.messages,
+            "bytes": self.bytes_sent,
+            "dropped": self.dropped,
+            "fellBehind": self.fell_behind,
+            "sendLatencyAvg": round(self.send_time / self.frames, 6) if self.frames else 0,
+            "sendLatencyMax": round(self.send_time_max, 6),
+        }
+
+
+class RoomRun:
+    """房间的一次执行：由 ``/api/v1/execute`` 在后台启动，与 WebSocket 的生命周期无关
+
+    执行过程中产生的消息经 ``send_json`` 写入事件日志并放入各订阅者的发送队列，
+    订阅者可随时连接或断开，重连时从事件日志补发错过的事件；同时记录进度，取消时据此生成汇总。
+    """
+
+    def __init__(self, room: str, rows: List[Row]):
+        self.room = room
+        self.subscribers: List[RoomSubscriber] = []
+        self.total_rows = len(rows)
+        self.rows_started = 0
+        self.started_rows: set = set()  # 已分配到执行额度的 rowId，预热据此跳过
+        self.rows_finished = 0
+        self.rows_failed = 0
+        self.commands_completed = 0
+        self.errors = 0
+        self.started_at = time.time()
+        self.task: Optional[asyncio.Future] = None
+        self.cancel_reason: Optional[str] = None
+        self.aborted = False  # 由提前终止策略触发，而不是用户取消
+        self.events = RoomEventLog()
+        self.progress = RoomProgress(len(rows))
+        self.progress_task: Optional[asyncio.Task] = None
+
+    def attach(self, ws: WebSocket, stream: bool = False, since: int = 0, batch: bool = False,
+               encoder: Optional[MsgpackEncoder] = None, summary: bool = False) -> RoomSubscriber:
+        subscriber = RoomSubscriber(ws, self.events, stream, since, batch, encoder, summary)
+        self.subscribers.append(subscriber)
+        if summary:
+            subscriber.offer(self.progress.snapshot())
+            if not self.running and self.events.events:
+                subscriber.offer(self.events.events[-1])  # 执行已结束：补发结束状态
+            elif self.progress_task is None or self.progress_task.done():
+                self.progress_task = asyncio.create_task(self.publish_progress_periodically())
+        return subscriber
+
+    def publish_progress(self):
+        """向 summary 订阅者推送一次聚合进度；进度消息不写入事件日志"""
+        subscribers = [subscriber for subscriber in self.subscribers if subscriber.summary]
+        if subscribers:
+            snapshot = self.progress.snapshot()
+            for subscriber in subscribers:
+                subscriber.offer(snapshot)
+
+    async def publish_progress_periodically(self):
+        while self.running and any(subscriber.summary for subscriber in self.subscribers):
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            self.publish_progress()
+
+    def detach(self, subscriber: RoomSubscriber) -> bool:
+        """移除订阅者，返回是否已没有订阅者"""
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        return not self.subscribers
+
+    async def send_json(self, message: Dict[str, Any]):
+        if "exitStatus" in message and "type" not in message:
+            self.commands_completed += 1
+        elif "error" in message:
+            self.errors += 1
+        if "status" in message:
+            self.publish_progress()  # 结束前推送最终的聚合进度
+        if message.get("type") not in STREAM_EVENT_TYPES:
+            message = self.events.append(message)
+        for subscriber in self.subscribers:
+            subscriber.offer(message)
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def cancel(self, reason: str) -> bool:
+        """取消执行：排队的行不再开始，执行中的行结束远程进程并归还连接"""
+        if not self.running:
+            return False
+        self.cancel_reason = self.cancel_reason or reason
+        self.task.cancel()
+        logger.info(f"Cancelling room execution", extra={"room": self.room, "reason": reason})
+        return True
+
+    def abort(self, reason: str) -> bool:
+        """按提前终止策略停止执行；排队中的行在开始前检查 ``aborted``，不会再建连"""
+        if self.aborted or self.cancel_reason is not None:
+            return False
+        self.aborted = True
+        return self.cancel(reason)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "rows": self.total_rows,
+            "rowsCompleted": self.rows_finished,
+            "rowsFailed": self.rows_failed,
+            "rowsCancelled": self.rows_started - self.rows_finished,
+            "rowsSkipped": self.total_rows - self.rows_started,
+            "commandsCompleted": self.commands_completed,
+            "errors": self.errors,
+            "elapsed": round(time.time() - self.started_at, 3),
+            "reason": self.cancel_reason,
+        }
+
+
+async def run_room(room: str, run: RoomRun, room_data: Dict[str, Any]):
+    """在后台执行房间的所有行，结果广播给订阅者"""
+    request_id = room_data["request_id"]
+    rows = room_data["rows"]
+    stream = room_data.get("stream", False)
+    policy = room_data.get("abort_policy") or AbortPolicy(len(rows))
+
+    # 由全局调度器分配执行额度：跨房间公平分配，并限制同一主机/跳板机的并发
+    async def exec_row_with_limit(row, canary=False):
+        jump = str(row.jumpServer.ip) if row_uses_jump_server(row) else None
+        async with execution_scheduler.slot(room, row.ip, jump):
+            run.started_rows.add(row.rowId)
+            if run.aborted:
+                return  # 已决定终止，排队中的行不再建连
+            run.rows_started += 1
+            run.progress.row_started(row)
+            ok = await exec_row(row, run, request_id, stream, room, room_data.get("deadline"), run.progress,
+                                room_data.get("run_id"))
+            run.progress.row_finished(row, ok)
+            run.rows_finished += 1
+            if not ok:
+                run.rows_failed += 1
+            reason = policy.record(ok, canary)
+            if reason is not None:
+                run.abort(reason)
+
+    try:
+        # 金丝雀：先执行前 K 行，全部成功后再执行其余行
+        if policy.canary:
+            await asyncio.gather(*(exec_row_with_limit(row, canary=True) for row in rows[:policy.canary]))
+        await asyncio.gather(*(exec_row_with_limit(row) for row in rows[policy.canary:]))
+    except asyncio.CancelledError:
+        if run.cancel_reason is None:
+            raise  # 不是房间取消（例如服务关闭），继续向上传播
+        status = "aborted" if run.aborted else "cancelled"
+        await run.send_json({"status": status, "summary": run.summary()})
+        logger.info(f"Room execution {status}", extra={"request_id": request_id, "room": room, **run.summary()})
+    except Exception:
+        status = "failed"
+        logger.error(f"Error in room execution", exc_info=True, extra={"request_id": request_id, "room": room})
+        await run.send_json({**websocket_error(None, "INTERNAL_ERROR"), "status": "failed"})
+    else:
+        # 发送完成消息，通知前端所有命令已执行完毕，并附带本房间的重试统计
+        status = "completed"
+        await run.send_json({"status": "completed", "retries": retry_policy.room_stats(room)})
+        logger.info(f"All commands completed", extra={"request_id": request_id, "room": room})
+
+    if room_data.get("run_id") is not None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, finish_run_record, room_data["run_id"], status, run.summary())
+        except Exception:
+            logger.error(f"Error recording run result", exc_info=True, extra={"request_id": request_id, "room": room})
+
+
+# 取消房间执行
+@app.post("/api/v1/rooms/{room}/cancel")
+async def cancel_room(room: str):
+    """取消正在执行的房间，等待各行结束远程进程、归还连接后返回执行汇总"""
+    room_data = active_rooms.get(room)
+    if room_data is None:
+        raise HTTPException(status_code=404, detail=error_payload("ROOM_NOT_FOUND"))
+    prewarm_task = room_data.get("prewarm_task")
+    if prewarm_task is not None and not prewarm_task.done():
+        prewarm_task.cancel()
+    run = room_data.get("run")
+    if run is None or not run.cancel("api"):
+        return {"success": False, "error": "Room is not running"}
+    await asyncio.wait({run.task}, timeout=10)
+    return {"success": True, "summary": run.summary()}
+
+
+# 执行记录列表，按 id 倒序的游标分页
+@app.get("/api/v1/runs")
+async def list_runs(before: Optional[int] = None, limit: int = 50, status: Optional[str] = None):
+    """返回 id 小于 ``before`` 的最近 ``limit`` 条执行；下一页用返回的 ``nextBefore``"""
+    limit = max(1, min(limit, 500))
+    db = SessionLocal()
+    try:
+        query = db.query(ExecutionRun)
+        if before is not None:
+            query = query.filter(ExecutionRun.id < before)
+        if status is not None:
+            query = query.filter(ExecutionRun.status == status)
+        runs = query.order_by(ExecutionRun.id.desc()).limit(limit).all()
+        return {
+            "runs": [run.to_dict() for run in runs],
+            "nextBefore": runs[-1].id if len(runs) == limit else None,
+        }
+    finally:
+        db.close()
+
+
+def get_run_or_404(db, run_id: int) -> ExecutionRun:
+    run = db.get(ExecutionRun, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=error_payload("RUN_NOT_FOUND"))
+    return run
+
+
+# 单次执行的汇总和配置
+@app.get("/api/v1/runs/{run_id}")
+async def get_run(run_id: int):
+    db = SessionLocal()
+    try:
+        run = get_run_or_404(db, run_id)
+        return {**run.to_dict(), "config": json.loads(run.config) if run.config else None}
+    finally:
+        db.close()
+
+
+def result_to_dict(result: ServerCommandResult) -> Dict[str, Any]:
+    return {
+        "id": result.id,
+        "runId": result.run_id,
+        "ip": result.ip,
+        "user": result.user,
+        "port": result.port,
+        "command": result.command,
+        "output": result.output_text,
+        "exitStatus": result.exit_status,
+        "timestamp": result.timestamp.isoformat() if result.timestamp else None,
+    }
+
+
+# 单次执行的命令结果，按 run_id 索引查找，按 id 游标分页
+@app.get("/api/v1/runs/{run_id}/results")
+async def get_run_results(run_id: int, after: int = 0, limit: int = 500):
+    """返回 id 大于 ``after`` 的结果；下一页用返回的 ``nextAfter``"""
+    limit = max(1, min(limit, 5000))
+    db = SessionLocal()
+    try:
+        get_run_or_404(db, run_id)
+        results = (
+            db.query(ServerCommandResult)
+            .options(joinedload(ServerCommandResult.blob))
+            .filter(ServerCommandResult.run_id == run_id, ServerCommandResult.id > after)
+            .order_by(ServerCommandResult.id)
+            .limit(limit)
+            .all()
+        )
+        return {
+            "results": [result_to_dict(result) for result in results],
+            "nextAfter": results[-1].id if len(results) == limit else None,
+        }
+    finally:
+        db.close()
+
+
+def utc_naive(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    """带时区的时间转换为 UTC；数据库中的时间为不带时区的 UTC"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+# 命令结果历史查询：按条件过滤，按 id 倒序的游标分页，``q`` 为输出全文检索
+@app.get("/api/v1/results")
+async def list_results(ip: Optional[str] = None, command: Optional[str] = None, exit_status: Optional[int] = None,
+                       run_id: Optional[int] = None, since: Optional[datetime.datetime] = None,
+                       until: Optional[datetime.datetime] = None, q: Optional[str] = None,
+                       before: Optional[int] = None, limit: int = 100):
+    """返回符合条件的结果，下一页用返回的 ``nextBefore``；``q`` 中的每个词都要出现在输出中"""
+    if q is not None and not q.strip():
+        raise HTTPException(status_code=400, detail=error_payload("VALIDATION_ERROR", "Search query must not be empty"))
+    if q is not None and not OUTPUT_SEARCH_ENABLED:
+        raise HTTPException(status_code=400, detail=error_payload("VALIDATION_ERROR", "Full-text search is not available"))
+    limit = max(1, min(limit, 1000))
+    db = SessionLocal()
+    try:
+        results = search_results(db, ip, command, exit_status, run_id, utc_naive(since), utc_naive(until), q, before, limit)
+        return {
+            "results": [result_to_dict(result) for result in results],
+            "nextBefore": results[-1].id if len(results) == limit else None,
+        }
+    finally:
+        db.close()
+
+
+# 结果写入线程的队列深度和提交指标
+@app.get("/api/v1/storage/stats")
+async def storage_stats():
+    return {"writer": result_writer.stats()}
+
+
+# 房间执行状态和订阅者发送指标
+@app.get("/api/v1/rooms/{room}/stats")
+async def room_stats(room: str):
+    room_data = active_rooms.get(room)
+    if room_data is None:
+        raise HTTPException(status_code=404, detail=error_payload("ROOM_NOT_FOUND"))
+    run = room_data["run"]
+    return {
+        "running": run.running,
+        "summary": run.summary(),
+        "events": run.events.stats(),
+        "subscribers": [subscriber.stats() for subscriber in run.subscribers],
+    }
+
+
+# 按需查询房间的事件，例如 summary 订阅者查看单台主机的结果
+@app.get("/api/v1/rooms/{room}/events")
+async def room_events(room: str, since: int = 0, row_id: Optional[str] = None, limit: int = 500):
+    """返回 ``eventSeq`` 大于 ``since`` 的事件，可按 ``row_id`` 过滤；已被压缩的事件不再返回明细"""
+    room_data = active_rooms.get(room)
+    if room_data is None:
+        raise HTTPException(status_code=404, detail=error_payload("ROOM_NOT_FOUND"))
+    events = room_data["run"].events
+    matched = []
+    for event in events.since(since):
+        if event.get("type") == "compacted" or (row_id is not None and event.get("rowId") != row_id):
+            continue
+        matched.append(event)
+        if len(matched) >= limit:
+            break
+    return {"events": matched, "lastSeq": events.last_seq, "compactedSeq": events.compacted_seq}
+
 
 # WebSocket处理
 @app.websocket("/ws/{room}")
-async def websocket_endpoint(ws: WebSocket, room: str):
+async def websocket_endpoint(ws: WebSocket, room: str, stream: bool = False, since: int = 0, batch: bool = False,
+                             protocol: str = "json", mode: str = "full"):
+    """订阅房间的执行消息；任意数量的订阅者可随时连接或断开，不影响执行
+
+    连接后先补发 ``eventSeq`` 大于 ``since`` 的事件（默认从头开始），再推送实时事件；
+    断线重连时带上最后收到的 ``eventSeq`` 即可只收到错过的部分。
+    ``stream=true`` 时额外推送命令输出分块（``output``）和完成消息（``commandCompleted``），
+    需要在 ``/api/v1/execute`` 时同样带上 ``stream=true``；这两类消息不补发。
+    ``batch=true`` 时多条消息合并为一个 JSON 数组帧发送，见 ``RoomSubscriber``。
+    ``protocol=msgpack`` 时先发送一条 JSON 握手消息（``{"type": "hello", ...}``），之后以二进制帧发送，
+    见 ``MsgpackEncoder``。
+    ``mode=summary`` 时不接收逐条结果，只每隔 ``PROGRESS_INTERVAL`` 接收一条聚合进度（``{"type": "progress"}``）
+    和结束状态，单台主机的结果通过 ``/api/v1/rooms/{room}/events?row_id=`` 按需获取。
+    """
     await ws.accept()
     
     # 获取房间数据和请求ID
     room_data = active_rooms.get(room, {})
     request_id = room_data.get("request_id", f"unknown-{uuid.uuid4().hex[:8]}")
-    rows = room_data.get("rows", [])
+    run = room_data.get("run")
     
-    if not rows:
+    if run is None:
         logger.error(f"No data found for room", extra={"request_id": request_id, "room": room})
         await ws.send_json(websocket_error(None, "VALIDATION_ERROR", "No data available for this room."))
         await ws.close()
         return
-    
-    # 如果已存在 WebSocket 连接，关闭上一个连接
-    if room in websockets:
-        logger.warning(f"Existing WebSocket connection detected - closing previous", 
-                     extra={"request_id": request_id, "room": room})
-        await websockets[room].close()
+    if protocol not in ("json", "msgpack") or mode not in ("full", "summary"):
+        await ws.send_json(websocket_error(None, "VALIDATION_ERROR", f"Unsupported protocol or mode: {protocol}, {mode}"))
+        await ws.close()
+        return
 
-    websockets[room] = ws
+    encoder = None
+    if protocol == "msgpack":
+        encoder = MsgpackEncoder()
+        await ws.send_json(encoder.hello())
+    subscriber = run.attach(ws, stream, since, batch, encoder, summary=mode == "summary")
+    logger.info(f"WebSocket subscriber attached",
+              extra={"request_id": request_id, "room": room, "subscribers": len(run.subscribers), "since": since})
+
+    # 接收客户端的取消消息，直到客户端断开
+    async def receive_commands():
+        try:
+            while True:
+                try:
+                    message = json.loads(await ws.receive_text())
+                except ValueError:
+                    continue
+                if isinstance(message, dict) and message.get("type") == "cancel":
+                    run.cancel("client")
+        except WebSocketDisconnect:
+            subscriber.open = False
 
+    sender = asyncio.create_task(subscriber.run_sender())
+    receiver = asyncio.create_task(receive_commands())
     try:
-        logger.info(f"WebSocket connection established", 
-                  extra={"request_id": request_id, "room": room})
+        await asyncio.wait({receiver, run.task}, return_when=asyncio.FIRST_COMPLETED)
+        if not receiver.done():
+            # 执行已结束：发完剩余消息（包括结束状态）后关闭
+            subscriber.close()
+            await asyncio.wait({receiver, sender}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        receiver.cancel()
+        sender.cancel()
+        # 最后一个订阅者断开时，按房间设置决定是否取消执行
+        if run.detach(subscriber) and run.running and room_data.get("cancel_on_disconnect"):
+            run.cancel("disconnect")
+        logger.info(f"WebSocket subscriber detached", 
+                  extra={"request_id": request_id, "room": room, "subscribers": len(run.subscribers)})
 
-        # 创建并发控制信号量
-        semaphore = asyncio.Semaphore(20)  # 最多20个并发SSH连接
-        
-        # 使用信号量限制并发
-        async def exec_row_with_limit(row):
-            async with semaphore:
-                await exec_row(row, ws, request_id)
-        
-        # 并发执行所有行的命令
-        await asyncio.gather(*(exec_row_with_limit(row) for row in rows))
-        
-        # 发送完成消息，通知前端所有命令已执行完毕
-        await ws.send_json({"status": "completed"})
-        logger.info(f"All commands completed", extra={"request_id": request_id, "room": room})
-        
-    except Exception as e:
-        logger.error(f"Error in WebSocket processing", 
-                   exc_info=True,
-                   extra={"request_id": request_id, "room": room})
-        await ws.send_json(websocket_error(None, "INTERNAL_ERROR"))
+# 连接池统计API
+@app.get("/api/v1/pool/stats")
+async def pool_stats():
+    """返回SSH连接池和跳板机连接池的命中、淘汰、建连等统计"""
+    return {
+        "ssh": ssh_connections.stats(),
+        "jump": jump_server_connections.stats(),
+    }
+
+# 截断命令的完整输出
+@app.get("/api/v1/outputs/{output_id}")
+async def get_spilled_output(output_id: str):
+    """返回因过长被截断的命令的完整输出（纯文本），保留时间由 OUTPUT_SPILL_TTL 控制"""
+    path = spilled_output_path(output_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=error_payload("OUTPUT_NOT_FOUND"))
+    return FileResponse(path, media_type="text/plain; charset=utf-8")
+
+# 执行调度统计API
+@app.get("/api/v1/scheduler/stats")
+async def scheduler_stats():
+    """返回全局执行额度的占用情况、各房间的排队深度和等待时间、各跳板机的自适应并发上限，
+    以及进程和各房间的重试次数与重试浪费的时间"""
+    return dict(execution_scheduler.stats(), retries=retry_policy.stats())
+
+@app.post("/api/v1/pool/prewarm")
+async def prewarm_pool(request: PrewarmRequest):
+    """按已保存的配置在后台预先建立连接，例如在维护窗口开始前预热整批服务器"""
+    request_id = f"prewarm-{uuid.uuid4().hex[:8]}"
+    db = SessionLocal()
+    try:
+        config = db.query(ServerConfig).filter(ServerConfig.id == request.config_id).first()
     finally:
-        # 清理 WebSocket 连接
-        websockets.pop(room, None)
-        logger.info(f"WebSocket connection closed", 
-                  extra={"request_id": request_id, "room": room})
+        db.close()
+    if not config:
+        logger.warning(f"Config not found for prewarm", extra={"request_id": request_id, "config_id": request.config_id})
+        return {"success": False, "error": "Config not found"}
+
+    rows = rows_from_config(json.loads(config.config_data))
+    task = asyncio.create_task(prewarm_rows(rows, request_id, request_id))
+    prewarm_tasks.add(task)
+    task.add_done_callback(prewarm_tasks.discard)
+    logger.info(f"Prewarming connections for config", 
+               extra={"request_id": request_id, "config_id": config.id, "server_count": len(rows)})
+    return {"success": True, "request_id": request_id, "server_count": len(rows)}
 
 # 配置管理API
 @app.post("/api/v1/configs")
@@ -0,0 +1,85 @@
+"""Database size for fleet-style results: inline output column vs content-addressed blobs.
+
+Usage: python backend/benchmarks/bench_output_blobs.py [hosts] [commands]
+
+Stores one audit run of ``hosts`` hosts (default 5,000) x ``commands``
+commands (default 10). Most hosts return identical output for a command (same
+OS image), a few percent differ. "before" inserts the output inline into
+``server_command_results.output`` like the previous ``save_results_batch``;
+"after" goes through ``save_results_batch`` with zlib-compressed
+``output_blobs``. Reports the file size after a checkpoint and the write time.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.chdir(tempfile.mkdtemp(prefix="cyclops-bench-"))
+
+from sqlalchemy import insert, text  # noqa: E402
+
+import app  # noqa: E402
+
+BATCH = 200
+
+
+def make_results(hosts, commands):
+    rng = random.Random(0)
+    now = datetime.datetime.utcnow()
+    variants = [
+        [f"cmd-{command} variant {variant}\n" + "".join(f"line {i}: setting_{command}_{i} = enabled\n" for i in range(60)) for variant in range(3)]
+        for command in range(commands)
+    ]
+    results = []
+    for host in range(hosts):
+        ip = f"10.0.{host // 256 % 256}.{host % 256}"
+        for command in range(commands):
+            if rng.random() < 0.03:
+                output = f"{ip}: unexpected output {rng.random()}\n" * 20
+            else:
+                output = variants[command][0 if rng.random() < 0.9 else rng.randint(1, 2)]
+            results.append(dict(ip=ip, user="root", password="*****", port=22, command=f"cmd-{command}",
+                                output=output, exit_status=0, timestamp=now))
+    return results
+
+
+def write(path, results, save):
+    app.engine = app.create_database_engine(f"sqlite:///./{path}")
+    app.Base.metadata.create_all(bind=app.engine)
+    app.OUTPUT_SEARCH_ENABLED = app.create_output_search_index()
+    started = time.perf_counter()
+    for i in range(0, len(results), BATCH):
+        save(results[i:i + BATCH])
+    elapsed = time.perf_counter() - started
+    with app.engine.connect() as conn:
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    app.engine.dispose()
+    return os.path.getsize(path), elapsed
+
+
+def save_inline(batch):
+    with app.engine.begin() as conn:
+        conn.execute(insert(app.ServerCommandResult), batch)
+
+
+def report(label, size, elapsed):
+    print(f"{label:<26} db={size / 2**20:8.1f} MiB  write={elapsed:6.2f}s")
+
+
+def main(hosts, commands):
+    results = make_results(hosts, commands)
+    raw = sum(len(result["output"]) for result in results)
+    print(f"{len(results)} results, {raw / 2**20:.1f} MiB of output")
+    before = write("before.db", results, save_inline)
+    after = write("after.db", results, app.save_results_batch)
+    report("before (inline output)", *before)
+    report("after (deduped blobs)", *after)
+    print(f"{before[0] / after[0]:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,53 @@
+"""Checkout latency of a pooled SSH connection: ``echo`` probe vs passive liveness.
+
+Usage: python backend/benchmarks/bench_pool_checkout.py [iterations]
+
+"before" replays the old reuse path, which ran ``echo connection_test`` on
+every checkout; "after" goes through ``get_ssh_connection`` and the pool.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.chdir(tempfile.mkdtemp(prefix="cyclops-bench-"))
+
+import app  # noqa: E402
+from local_sshd import local_sshd  # noqa: E402
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1e6
+    p99 = samples[int(len(samples) * 0.99) - 1] * 1e6
+    print(f"{label:<28} p50={p50:10.1f}us  p99={p99:10.1f}us  n={len(samples)}")
+
+
+async def main(iterations):
+    async with local_sshd() as port:
+        conn = await app.get_ssh_connection("127.0.0.1", "bench", "bench", port)
+
+        before = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            proc = await asyncio.wait_for(conn.create_process("echo connection_test"), timeout=20)
+            await proc.wait()
+            before.append(time.perf_counter() - start)
+
+        after = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await app.get_ssh_connection("127.0.0.1", "bench", "bench", port)
+            after.append(time.perf_counter() - start)
+
+        report("before (echo probe)", before)
+        report("after (passive liveness)", after)
+        conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
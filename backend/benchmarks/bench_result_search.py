@@ -0,0 +1,114 @@
+"""Result history queries: inline output + ip index only vs composite indexes + FTS5.
+
+Usage: python backend/benchmarks/bench_result_search.py [hosts] [days]
+
+Stores one daily audit of ``hosts`` hosts (default 3,000) x 10 commands for
+``days`` days (default 10), where a few hosts print an OOM killer message.
+"before" is the previous schema: output inline in ``server_command_results``,
+no composite indexes, so "which hosts printed OOM in the last week" is a
+``LIKE`` scan. "after" uses ``save_results_batch`` (deduped blobs, FTS5
+index maintained by the writer) and ``search_results``. Each query is the
+first page of 100 results, best of 5 runs.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.chdir(tempfile.mkdtemp(prefix="cyclops-bench-"))
+
+from sqlalchemy import insert, text  # noqa: E402
+
+import app  # noqa: E402
+
+BATCH = 2000
+COMMANDS = ["uname -r", "uptime", "df -h /", "free -m", "dmesg | tail -5",
+            "systemctl is-active sshd", "getenforce", "rpm -q openssl", "ss -lnt | wc -l", "id"]
+NOW = datetime.datetime(2026, 10, 17)
+
+
+def make_results(hosts, days):
+    rng = random.Random(0)
+    results = []
+    for day in range(days):
+        timestamp = NOW - datetime.timedelta(days=days - day)
+        for host in range(hosts):
+            ip = f"10.{host // 65536}.{host // 256 % 256}.{host % 256}"
+            for command in COMMANDS:
+                if command.startswith("dmesg") and rng.random() < 0.002:
+                    output = f"[{rng.randint(1, 10**6)}.000] Out of memory: Killed process {rng.randint(100, 99999)} (java)"
+                elif command == "uptime":
+                    output = f" {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}  up {rng.randint(1, 400)} days,  load average: 0.{rng.randint(0, 99)}"
+                else:
+                    output = f"{command}: ok\n" * 10
+                exit_status = 3 if command.startswith("systemctl") and rng.random() < 0.01 else 0
+                results.append(dict(ip=ip, user="root", password="*****", port=22, command=command,
+                                    output=output, exit_status=exit_status, timestamp=timestamp))
+    return results
+
+
+def use_database(path):
+    app.engine = app.create_database_engine(f"sqlite:///./{path}")
+    app.Base.metadata.create_all(bind=app.engine)
+    app.OUTPUT_SEARCH_ENABLED = app.create_output_search_index()
+    app.SessionLocal.configure(bind=app.engine)
+
+
+def build_before(results):
+    use_database("before.db")
+    with app.engine.begin() as conn:
+        for index in app.ServerCommandResult.__table_args__:
+            index.drop(bind=conn)
+        for i in range(0, len(results), BATCH):
+            conn.execute(insert(app.ServerCommandResult), results[i:i + BATCH])
+
+
+def build_after(results):
+    use_database("after.db")
+    for i in range(0, len(results), BATCH):
+        app.save_results_batch(results[i:i + BATCH])
+
+
+def timed(query, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = query()
+        best = min(best, time.perf_counter() - started)
+    return best, len(rows)
+
+
+def report(label, elapsed, rows):
+    print(f"{label:<44} {elapsed * 1e3:9.2f}ms  ({rows} rows)")
+
+
+def main(hosts, days):
+    results = make_results(hosts, days)
+    week_ago = NOW - datetime.timedelta(days=7)
+    print(f"{len(results):,} results")
+
+    build_before(results)
+    with app.engine.connect() as conn:
+        report("before: OOM in last week (LIKE scan)", *timed(lambda: conn.execute(text(
+            "SELECT id, ip FROM server_command_results WHERE output LIKE '%Out of memory%' AND timestamp >= :since "
+            "ORDER BY id DESC LIMIT 100"), {"since": week_ago}).all()))
+        report("before: failed 'systemctl is-active sshd'", *timed(lambda: conn.execute(text(
+            "SELECT id, ip FROM server_command_results WHERE command = :command AND exit_status = 3 "
+            "ORDER BY id DESC LIMIT 100"), {"command": "systemctl is-active sshd"}).all()))
+    app.engine.dispose()
+
+    build_after(results)
+    db = app.SessionLocal()
+    report("after: OOM in last week (FTS5)", *timed(lambda: app.search_results(db, q="out of memory", since=week_ago)))
+    report("after: failed 'systemctl is-active sshd'", *timed(
+        lambda: app.search_results(db, command="systemctl is-active sshd", exit_status=3)))
+    db.close()
+    app.engine.dispose()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000, int(sys.argv[2]) if len(sys.argv) > 2 else 10)
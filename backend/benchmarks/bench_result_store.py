@@ -0,0 +1,80 @@
+"""Result insert throughput: default SQLite + ORM vs WAL/tuned pragmas + Core executemany.
+
+Usage: python backend/benchmarks/bench_result_store.py [rows] [batch]
+
+Inserts ``rows`` results (default 50,000) in transactions of ``batch`` rows
+(default 200, roughly what the writer thread groups during a busy run) into a
+fresh database file. "before" uses a plain ``create_engine`` and
+``db.add_all`` of ``ServerCommandResult`` objects; "after" uses
+``create_database_engine`` and ``save_results_batch``.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.chdir(tempfile.mkdtemp(prefix="cyclops-bench-"))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import app  # noqa: E402
+
+
+def make_results(rows):
+    now = datetime.datetime.utcnow()
+    return [
+        dict(
+            ip=f"10.0.{i // 256 % 256}.{i % 256}", user="root", password="*****", port=22,
+            command=f"cmd-{i % 10}", output="ok " * 40, exit_status=0, timestamp=now,
+        )
+        for i in range(rows)
+    ]
+
+
+def batches(results, size):
+    return [results[i:i + size] for i in range(0, len(results), size)]
+
+
+def orm_default(results, size):
+    engine = create_engine("sqlite:///./before.db")
+    app.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    started = time.perf_counter()
+    for batch in batches(results, size):
+        db = Session()
+        db.add_all([app.ServerCommandResult(**result) for result in batch])
+        db.commit()
+        db.close()
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    return elapsed
+
+
+def core_tuned(results, size):
+    app.engine = app.create_database_engine("sqlite:///./after.db")
+    app.Base.metadata.create_all(bind=app.engine)
+    app.OUTPUT_SEARCH_ENABLED = app.create_output_search_index()
+    started = time.perf_counter()
+    for batch in batches(results, size):
+        app.save_results_batch(batch)
+    elapsed = time.perf_counter() - started
+    app.engine.dispose()
+    return elapsed
+
+
+def report(label, rows, elapsed):
+    print(f"{label:<34} {rows / elapsed:>10,.0f} rows/s  ({elapsed:6.2f}s)")
+
+
+def main(rows, size):
+    results = make_results(rows)
+    report("before (default journal, ORM)", rows, orm_default(results, size))
+    report("after (WAL + NORMAL, Core)", rows, core_tuned(results, size))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000, int(sys.argv[2]) if len(sys.argv) > 2 else 200)
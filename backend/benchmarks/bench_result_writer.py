@@ -0,0 +1,89 @@
+"""Event-loop lag while persisting results: inline commits vs the writer thread.
+
+Usage: python backend/benchmarks/bench_result_writer.py [rows] [commands]
+
+Simulates a run of ``rows`` hosts (default 1,000) that each finish
+``commands`` commands (default 10) after a few milliseconds of "SSH I/O" and
+persist their results in batches of 20, like ``exec_row``. "before" commits
+each batch on the event loop as the old ``save_results_batch`` did; "after"
+hands the batch to ``result_writer``. A ticker task that sleeps 1ms measures
+how late the loop wakes it up.
+"""
+import asyncio
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.chdir(tempfile.mkdtemp(prefix="cyclops-bench-"))
+
+import app  # noqa: E402
+
+EXEC_CONCURRENCY = 200
+
+
+def result(row, command):
+    return dict(
+        ip=f"10.0.{row // 256}.{row % 256}", user="root", password="*****", port=22,
+        command=f"cmd-{command}", output="ok " * 50, exit_status=0, timestamp=datetime.datetime.utcnow(),
+    )
+
+
+async def measure(persist, rows, commands):
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    semaphore = asyncio.Semaphore(EXEC_CONCURRENCY)
+    rng = random.Random(0)
+
+    async def run_row(row):
+        async with semaphore:
+            batch = []
+            for command in range(commands):
+                await asyncio.sleep(rng.uniform(0.001, 0.005))
+                batch.append(result(row, command))
+                if len(batch) >= 20:
+                    await persist(batch)
+                    batch = []
+            await persist(batch)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(run_row(row) for row in range(rows)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await tick
+    return lags, elapsed
+
+
+def report(label, lags, elapsed):
+    lags = sorted(lags)
+    p50 = statistics.median(lags) * 1e3
+    p99 = lags[int(len(lags) * 0.99) - 1] * 1e3
+    print(f"{label:<22} loop lag p50={p50:7.2f}ms  p99={p99:7.2f}ms  max={lags[-1] * 1e3:7.2f}ms  run={elapsed:6.2f}s")
+
+
+async def inline_commit(batch):
+    app.save_results_batch(batch)
+
+
+async def main(rows, commands):
+    report("before (inline commit)", *await measure(inline_commit, rows, commands))
+    report("after (writer thread)", *await measure(app.result_writer.submit, rows, commands))
+    app.result_writer.close()
+    print(f"writer: {app.result_writer.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, int(sys.argv[2]) if len(sys.argv) > 2 else 10))
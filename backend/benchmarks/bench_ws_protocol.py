@@ -0,0 +1,94 @@
+"""WebSocket payload size and decode time: per-message JSON vs batched MessagePack.
+
+Usage: python backend/benchmarks/bench_ws_protocol.py [hosts] [commands]
+
+Builds the result/error messages of a synthetic audit run (default 2,000 hosts
+x 10 commands) and encodes them the way each protocol sends them. "+deflate"
+compresses every frame with one shared zlib stream and a sync flush, which is
+what permessage-deflate with context takeover puts on the wire. Decode time is
+measured with the Python decoders as a stand-in for the browser's.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.chdir(tempfile.mkdtemp(prefix="cyclops-bench-"))
+
+import msgpack  # noqa: E402
+
+import app  # noqa: E402
+
+COMMANDS = [
+    "uname -a", "uptime", "df -h /", "free -m", "cat /etc/os-release | head -2",
+    "systemctl is-active sshd", "getenforce", "rpm -q openssl", "ss -lnt | wc -l", "id",
+]
+BATCH = 200
+
+
+def build_messages(hosts, commands):
+    rng = random.Random(0)
+    messages = []
+    for host in range(hosts):
+        row_id = f"row-{host}"
+        for command in COMMANDS[:commands]:
+            if rng.random() < 0.02:
+                messages.append(app.websocket_error(row_id, "SSH_CONNECTION_TIMEOUT", command=command))
+                continue
+            output = f"{command} on 10.{host // 65536}.{host // 256 % 256}.{host % 256}: " + "ok " * rng.randint(5, 40)
+            messages.append({"rowId": row_id, "command": command, "output": output.strip(), "exitStatus": 0})
+    for seq, message in enumerate(messages, 1):
+        message["eventSeq"] = seq
+    return messages
+
+
+def json_frames(messages):
+    return [json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode() for message in messages]
+
+
+def msgpack_frames(messages):
+    encoder = app.MsgpackEncoder()
+    return [encoder.encode(messages[i:i + BATCH]) for i in range(0, len(messages), BATCH)]
+
+
+def deflated(frames):
+    compressor = zlib.compressobj(wbits=-15)
+    return [compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH) for frame in frames]
+
+
+def timed(decode, frames, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            decode(frame)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(label, frames, decode_time, baseline):
+    size = sum(len(frame) for frame in frames)
+    print(f"{label:<26} frames={len(frames):>7}  bytes={size:>11,}  ({baseline / size:5.1f}x smaller)  decode={decode_time * 1e3:8.1f}ms")
+
+
+def main(hosts, commands):
+    messages = build_messages(hosts, commands)
+    plain_json = json_frames(messages)
+    packed = msgpack_frames(messages)
+    baseline = sum(len(frame) for frame in plain_json)
+
+    print(f"{len(messages)} messages ({hosts} hosts x {commands} commands)")
+    report("json per message", plain_json, timed(json.loads, plain_json), baseline)
+    report("json per message+deflate", deflated(plain_json), timed(json.loads, plain_json), baseline)
+    unpack = lambda frame: msgpack.unpackb(frame, strict_map_key=False)  # noqa: E731
+    report("msgpack batched", packed, timed(unpack, packed), baseline)
+    report("msgpack batched+deflate", deflated(packed), timed(unpack, packed), baseline)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,52 @@
+"""In-process asyncssh server used by the backend benchmarks.
+
+The server accepts any password and runs a tiny command emulator, so
+benchmarks measure the SSH protocol and the backend's own overhead rather
+than the cost of spawning real remote processes.
+"""
+import asyncio
+import contextlib
+
+import asyncssh
+
+
+class AcceptAllServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+async def handle_process(process):
+    command = process.command or ""
+    if command.startswith("echo "):
+        process.stdout.write(command[5:] + "\n")
+    elif command.startswith("yes | head -n "):
+        count = int(command.rsplit(" ", 1)[-1])
+        process.stdout.write("y\n" * count)
+    elif command.startswith("sleep "):
+        await asyncio.sleep(float(command.split()[1]))
+    process.exit(0)
+
+
+@contextlib.asynccontextmanager
+async def local_sshd(**server_options):
+    """Start a server on an ephemeral localhost port and yield the port."""
+    host_key = asyncssh.generate_private_key("ssh-ed25519")
+    server = await asyncssh.listen(
+        "127.0.0.1",
+        0,
+        server_host_keys=[host_key],
+        server_factory=AcceptAllServer,
+        process_factory=handle_process,
+        **server_options,
+    )
+    try:
+        yield server.sockets[0].getsockname()[1]
+    finally:
+        server.close()
+        await server.wait_closed()
@@ -0,0 +1,88 @@
+import asyncio
+import contextlib
+import importlib
+import subprocess
+import sys
+from pathlib import Path
+
+import asyncssh
+import pytest
+
+
+@pytest.fixture()
+def app_module(tmp_path, monkeypatch):
+    """Import a fresh copy of the backend module with a temporary SQLite database."""
+    backend_dir = Path(__file__).resolve().parents[1]
+
+    monkeypatch.chdir(tmp_path)
+    sys.path.insert(0, str(backend_dir))
+    try:
+        sys.modules.pop("app", None)
+        module = importlib.import_module("app")
+        yield module
+        module.result_writer.close()
+    finally:
+        sys.modules.pop("app", None)
+        try:
+            sys.path.remove(str(backend_dir))
+        except ValueError:
+            pass
+
+
+class AcceptAllServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+async def run_locally(process):
+    """Run the requested command with the local ``sh`` so tests exercise real shell semantics."""
+    local = subprocess.Popen(
+        process.command or "sh",
+        shell=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        await process.redirect(stdin=local.stdin, stdout=local.stdout, stderr=local.stderr)
+        await process.stdout.drain()
+        process.exit(await asyncio.get_running_loop().run_in_executor(None, local.wait))
+    finally:
+        # 客户端提前关闭通道（例如 stopOnFailure 结束会话）时结束本地进程，不留下仍在运行的子进程
+        if local.poll() is None:
+            local.kill()
+            local.wait()
+        process.close()
+        await process.wait_closed()  # 等待 asyncssh 的重定向清理任务，避免其协程未被执行
+
+
+@contextlib.asynccontextmanager
+async def local_sshd():
+    """Start an in-process SSH server on an ephemeral port and yield the port."""
+    handlers = set()
+
+    async def handle(process):
+        handlers.add(asyncio.current_task())
+        await run_locally(process)
+
+    server = await asyncssh.listen(
+        "127.0.0.1",
+        0,
+        server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+        server_factory=AcceptAllServer,
+        process_factory=handle,
+    )
+    try:
+        yield server.sockets[0].getsockname()[1]
+    finally:
+        server.close()
+        await server.wait_closed()
+        # 客户端断开后让服务端的进程处理完清理，再关闭事件循环
+        if handlers:
+            await asyncio.wait(handlers, timeout=5)
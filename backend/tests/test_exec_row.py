@@ -0,0 +1,390 @@
+import asyncio
+import time
+
+import asyncssh
+
+
+class FakeStdout:
+    def __init__(self, lines):
+        self.lines = list(lines)
+
+    async def read(self, n=-1):
+        await asyncio.sleep(0.005)
+        if not self.lines:
+            return ""
+        return self.lines.pop(0)
+
+
+class FakeProcess:
+    def __init__(self, conn, command):
+        self.conn = conn
+        self.stdout = FakeStdout([f"{command}\n"])
+
+    async def wait(self):
+        self.conn.open_sessions -= 1
+        return type("Completed", (), {"exit_status": 0})()
+
+
+class SessionLimitedConnection:
+    """Fake connection that refuses channels beyond ``max_sessions`` like OpenSSH's MaxSessions."""
+
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self.open_sessions = 0
+        self.peak_sessions = 0
+        self.refusals = 0
+        self.closed = False
+
+    async def create_process(self, command):
+        if self.open_sessions >= self.max_sessions:
+            self.refusals += 1
+            raise asyncssh.ChannelOpenError(asyncssh.OPEN_ADMINISTRATIVELY_PROHIBITED, "open failed")
+        self.open_sessions += 1
+        self.peak_sessions = max(self.peak_sessions, self.open_sessions)
+        return FakeProcess(self, command)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send_json(self, message):
+        self.messages.append(message)
+
+
+def make_row(app_module, commands):
+    return app_module.Row(
+        ip="10.0.0.5",
+        user="root",
+        password="example-password",
+        port=22,
+        commands=commands,
+        rowId="row-0",
+    )
+
+
+def install_fake_connections(app_module, monkeypatch, conns):
+    opened = []
+
+    async def fake_open_row_connection(row, leases, slot=0, wait=True):
+        opened.append(slot)
+        return conns[slot], None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    return opened
+
+
+def test_channel_limit_is_learned_without_reconnecting(app_module, monkeypatch):
+    conn = SessionLimitedConnection(max_sessions=2)
+    opened = install_fake_connections(app_module, monkeypatch, [conn])
+    monkeypatch.setattr(app_module, "MAX_CONNECTIONS_PER_TARGET", 1)
+    ws = RecordingWebSocket()
+    row = make_row(app_module, [f"echo {i}" for i in range(8)])
+
+    asyncio.run(app_module.exec_row(row, ws, "req-test"))
+
+    outputs = sorted(message["output"] for message in ws.messages if "output" in message)
+    assert outputs == sorted(f"echo {i}" for i in range(8))
+    assert not any("error" in message for message in ws.messages)
+    assert app_module.learned_session_limits["10.0.0.5:22:root"] == 2
+    assert conn.peak_sessions == 2
+    assert not conn.closed
+    assert opened == [0]
+
+
+def test_default_session_limit_fills_channels_and_opens_second_connection(app_module, monkeypatch):
+    conns = [SessionLimitedConnection(max_sessions=app_module.DEFAULT_SESSION_LIMIT) for _ in range(3)]
+    opened = install_fake_connections(app_module, monkeypatch, conns)
+    ws = RecordingWebSocket()
+    row = make_row(app_module, [f"echo {i}" for i in range(40)])
+
+    asyncio.run(app_module.exec_row(row, ws, "req-test"))
+
+    assert len([message for message in ws.messages if "output" in message]) == 40
+    # 不再有固定的命令并发上限：第一条连接的通道用满到 MaxSessions 后追加连接
+    assert conns[0].peak_sessions == app_module.DEFAULT_SESSION_LIMIT
+    assert 1 in opened
+    assert all(conn.refusals == 0 for conn in conns)
+
+
+def test_extra_connections_open_when_channels_run_out(app_module, monkeypatch):
+    conns = [SessionLimitedConnection(max_sessions=1) for _ in range(3)]
+    opened = install_fake_connections(app_module, monkeypatch, conns)
+    app_module.learned_session_limits["10.0.0.5:22:root"] = 1
+    ws = RecordingWebSocket()
+    row = make_row(app_module, [f"echo {i}" for i in range(6)])
+
+    asyncio.run(app_module.exec_row(row, ws, "req-test"))
+
+    assert len([message for message in ws.messages if "output" in message]) == 6
+    assert sorted(opened) == [0, 1, 2]
+    assert all(conn.refusals == 0 for conn in conns)
+    assert not app_module.channel_schedulers
+
+
+def test_extra_connections_do_not_wait_on_a_host_cap_held_by_the_rows(app_module, monkeypatch):
+    dialed = []
+
+    async def fake_create_connection(client_factory, host, port=22, **kwargs):
+        dialed.append(port)
+        return SessionLimitedConnection(max_sessions=app_module.DEFAULT_SESSION_LIMIT), client_factory()
+
+    monkeypatch.setattr(app_module.asyncssh, "create_connection", fake_create_connection)
+    pool = app_module.ssh_connections
+    rows = [
+        app_module.Row(ip="10.0.0.9", user="root", password="example-password", port=2200 + i,
+                       commands=[f"echo {i}-{n}" for n in range(11)], rowId=f"row-{i}")
+        for i in range(pool.max_per_host)
+    ]
+    ws = RecordingWebSocket()
+
+    async def main():
+        # 每行的第一条连接已占满单主机上限，追加连接拿不到名额时改为在已有通道上排队
+        await asyncio.wait_for(asyncio.gather(*(app_module.exec_row(row, ws, "req-test") for row in rows)), timeout=5)
+
+    asyncio.run(main())
+
+    assert len([message for message in ws.messages if "output" in message]) == 11 * len(rows)
+    assert sorted(dialed) == [2200 + i for i in range(len(rows))]
+    assert pool.stats()["waiting"] == 0 and pool.stats()["in_use"] == 0
+
+
+def run_against_local_sshd(app_module, commands, stream=False, **row_fields):
+    from conftest import local_sshd
+
+    ws = RecordingWebSocket()
+
+    async def scenario():
+        async with local_sshd() as port:
+            row = app_module.Row(
+                ip="127.0.0.1",
+                user="tester",
+                password="example-password",
+                port=port,
+                commands=commands,
+                rowId="row-0",
+                **row_fields,
+            )
+            await app_module.exec_row(row, ws, "req-test", stream)
+            conns = [entry.conn for _, entry in app_module.ssh_connections.items()]
+            await app_module.ssh_connections.close()
+            for conn in conns:
+                await conn.wait_closed()
+
+    asyncio.run(scenario())
+    return ws.messages
+
+
+def test_session_mode_matches_per_command_results(app_module):
+    commands = ["echo one", "false", "printf 'no newline'", "cd / && pwd", "pwd"]
+
+    per_command = run_against_local_sshd(app_module, commands)
+    session = run_against_local_sshd(app_module, commands, executionMode="session")
+
+    def by_command(messages):
+        return {message["command"]: (message["output"], message["exitStatus"]) for message in messages}
+
+    assert by_command(session) == by_command(per_command)
+    assert by_command(session)["false"] == ("", 1)
+    assert by_command(session)["printf 'no newline'"] == ("no newline", 0)
+    assert [message["command"] for message in session] == commands
+
+
+def test_streaming_sends_coalesced_chunks_before_final_result(app_module):
+    command = "for i in 1 2 3; do echo line$i; sleep 0.2; done; echo oops >&2"
+    for mode in ("exec", "session"):
+        messages = run_against_local_sshd(app_module, [command], executionMode=mode, stream=True)
+
+        chunks = [message for message in messages if message.get("type") == "output"]
+        final = [message for message in messages if "output" in message]
+        completed = [message for message in messages if message.get("type") == "commandCompleted"]
+
+        assert len(chunks) >= 3, mode
+        stdout = "".join(chunk["data"] for chunk in chunks if chunk["stream"] == "stdout")
+        assert stdout.strip() == "line1\nline2\nline3"
+        assert "__CYCLOPS_" not in stdout
+        assert final[0]["output"] == "line1\nline2\nline3"
+        assert messages.index(final[0]) > messages.index(chunks[-1])
+        assert completed[0]["exitStatus"] == 0
+        assert completed[0]["durationMs"] >= 400
+        if mode == "exec":
+            assert any(chunk["stream"] == "stderr" and "oops" in chunk["data"] for chunk in chunks)
+
+
+def test_streamer_keeps_its_timed_flush_and_settles_it_on_close(app_module):
+    ws = RecordingWebSocket()
+
+    async def scenario():
+        streamer = app_module.OutputStreamer(ws.send_json, "row-0", "cmd", flush_interval=0.01)
+        await streamer.feed("stdout", "a")
+        await asyncio.sleep(0.02)  # 计时器触发，定时发送任务由 streamer 持有
+        assert streamer._flush_task is not None
+        await streamer.feed("stdout", "b")
+        await streamer.close()
+        assert streamer._flush_task is None and streamer._timer is None
+
+        abandoned = app_module.OutputStreamer(ws.send_json, "row-0", "other", flush_interval=0.01)
+        await abandoned.feed("stdout", "lost")
+        abandoned.discard()
+        await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+    assert [(message["command"], message["data"]) for message in ws.messages] == [("cmd", "a"), ("cmd", "b")]
+
+
+def test_output_buffer_keeps_head_and_ring_buffered_tail(app_module, tmp_path):
+    buffer = app_module.OutputBuffer(head_size=10, tail_size=10, spill_dir=str(tmp_path))
+    for i in range(1000):
+        buffer.append(f"{i:04d}\n")
+    buffer.close()
+
+    value = buffer.getvalue()
+    assert buffer.truncated and buffer.size == 5000
+    assert value.startswith("0000\n0001\n")
+    assert value.endswith("0998\n0999")
+    assert f"4980 characters truncated, full output: /api/v1/outputs/{buffer.output_id}" in value
+    assert (tmp_path / f"{buffer.output_id}.log").read_text() == "".join(f"{i:04d}\n" for i in range(1000))
+
+
+def test_long_output_is_truncated_and_fetchable(app_module, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(app_module, "OUTPUT_HEAD_SIZE", 100)
+    monkeypatch.setattr(app_module, "OUTPUT_TAIL_SIZE", 100)
+    monkeypatch.setattr(app_module, "OUTPUT_SPILL_DIR", str(tmp_path / "spill"))
+    command = "seq 1 20000"
+    expected = "\n".join(str(i) for i in range(1, 20001))
+
+    for mode in ("exec", "session"):
+        messages = run_against_local_sshd(app_module, [command], executionMode=mode)
+        final = messages[0]
+
+        assert final["truncated"] is True, mode
+        assert final["outputSize"] == len(expected) + 1
+        assert final["output"].startswith("1\n2\n3\n")
+        assert final["output"].endswith("19999\n20000")
+        assert len(final["output"]) < 400
+
+        response = TestClient(app_module.app).get(f"/api/v1/outputs/{final['outputId']}")
+        assert response.status_code == 200
+        assert response.text.rstrip("\n") == expected
+
+    response = TestClient(app_module.app).get("/api/v1/outputs/../../etc/passwd")
+    assert response.status_code == 404
+
+
+class HangingProcess:
+    """Remote process that never produces output or exits until it is killed."""
+
+    def __init__(self):
+        self.stdout = self
+        self.signals = []
+        self.closed = False
+
+    async def read(self, n=-1):
+        await asyncio.sleep(3600)
+
+    async def wait(self):
+        await asyncio.sleep(3600)
+
+    def kill(self):
+        self.signals.append("KILL")
+
+    def close(self):
+        self.closed = True
+
+
+class HangingConnection(SessionLimitedConnection):
+    def __init__(self):
+        super().__init__(max_sessions=10)
+        self.processes = []
+
+    async def create_process(self, command, **kwargs):
+        proc = HangingProcess()
+        self.processes.append(proc)
+        return proc
+
+
+def test_command_timeout_kills_remote_process(app_module, monkeypatch):
+    conn = HangingConnection()
+    install_fake_connections(app_module, monkeypatch, [conn])
+    ws = RecordingWebSocket()
+    row = make_row(app_module, ["sleep 100"])
+    row.commandTimeout = 0.2
+
+    started = time.monotonic()
+    asyncio.run(app_module.exec_row(row, ws, "req-test"))
+
+    assert time.monotonic() - started < 1
+    assert ws.messages[0]["exitStatus"] is None
+    assert "[Command timed out after 0 seconds]" in ws.messages[0]["output"]
+    assert conn.processes[0].signals == ["KILL"]
+    assert conn.processes[0].closed
+
+
+def test_job_deadline_is_shared_by_all_commands_of_a_row(app_module, monkeypatch):
+    conn = HangingConnection()
+    install_fake_connections(app_module, monkeypatch, [conn])
+    ws = RecordingWebSocket()
+    row = make_row(app_module, ["sleep 100", "sleep 200"])
+
+    started = time.monotonic()
+    asyncio.run(app_module.exec_row(row, ws, "req-test", deadline=app_module.Deadline.after(0.3)))
+
+    assert time.monotonic() - started < 1
+    assert len(conn.processes) == 2
+    assert all(proc.signals == ["KILL"] and proc.closed for proc in conn.processes)
+
+    ws = RecordingWebSocket()
+    asyncio.run(app_module.exec_row(row, ws, "req-test", deadline=app_module.Deadline.after(0)))
+    assert ws.messages == [app_module.websocket_error("row-0", "DEADLINE_EXCEEDED")]
+
+
+def test_stop_on_failure_skips_remaining_commands(app_module):
+    commands = ["echo one", "false", "echo three"]
+    for mode in ("exec", "session"):
+        messages = run_against_local_sshd(app_module, commands, executionMode=mode, stopOnFailure=True)
+
+        results = [message for message in messages if "output" in message]
+        assert [(message["command"], message["exitStatus"]) for message in results] == [("echo one", 0), ("false", 1)], mode
+        skipped = [message for message in messages if "error" in message]
+        assert [message["error"]["code"] for message in skipped] == ["COMMAND_SKIPPED"], mode
+
+
+def test_results_are_persisted_by_the_writer_thread(app_module, monkeypatch):
+    conn = SessionLimitedConnection(max_sessions=4)
+    install_fake_connections(app_module, monkeypatch, [conn])
+    row = make_row(app_module, [f"echo {i}" for i in range(25)])
+
+    asyncio.run(app_module.exec_row(row, RecordingWebSocket(), "req-test"))
+    app_module.result_writer.flush()
+
+    db = app_module.SessionLocal()
+    try:
+        saved = db.query(app_module.ServerCommandResult).all()
+    finally:
+        db.close()
+    assert sorted(result.command for result in saved) == sorted(f"echo {i}" for i in range(25))
+    assert {result.password for result in saved} == {"*****"}
+
+
+def test_writer_group_commits_queued_batches(app_module):
+    writer = app_module.ResultWriter(max_batches=4, group_rows=1000)
+    record = {"ip": "10.0.0.1", "user": "root", "password": "*****", "port": 22, "command": "id", "output": "", "exit_status": 0}
+
+    async def scenario():
+        await asyncio.gather(*(writer.submit([record] * 5) for _ in range(40)))
+
+    asyncio.run(scenario())
+    writer.close()
+
+    stats = writer.stats()
+    assert stats["rowsWritten"] == 200
+    assert stats["commits"] < 40
+    assert stats["queued"] == 0
@@ -0,0 +1,173 @@
+import asyncio
+
+
+async def run_rows(scheduler, room, hosts, order, hold=0.01, jump=None):
+    async def run(host):
+        async with scheduler.slot(room, host, jump):
+            order.append((room, host))
+            await asyncio.sleep(hold)
+
+    await asyncio.gather(*(run(host) for host in hosts))
+
+
+def test_small_room_is_not_starved_behind_large_room(app_module):
+    scheduler = app_module.ExecutionScheduler(max_slots=2)
+    order = []
+
+    async def scenario():
+        big = asyncio.create_task(run_rows(scheduler, "big", [f"10.0.0.{i}" for i in range(20)], order))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(run_rows(scheduler, "small", ["10.1.0.1", "10.1.0.2"], order))
+        await asyncio.gather(big, small)
+
+    asyncio.run(scenario())
+    small_positions = [index for index, (room, _) in enumerate(order) if room == "small"]
+    assert max(small_positions) < 6
+    stats = scheduler.stats()
+    assert stats["running"] == 0
+    assert stats["rooms"]["big"]["admitted"] == 20
+    assert stats["rooms"]["small"]["wait_max"] > 0
+
+
+def test_higher_priority_room_runs_first(app_module):
+    scheduler = app_module.ExecutionScheduler(max_slots=1)
+    scheduler.register_room("low", priority=0)
+    scheduler.register_room("high", priority=10)
+    order = []
+
+    async def scenario():
+        low = asyncio.create_task(run_rows(scheduler, "low", [f"10.0.0.{i}" for i in range(5)], order))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(run_rows(scheduler, "high", ["10.1.0.1", "10.1.0.2"], order))
+        await asyncio.gather(low, high)
+
+    asyncio.run(scenario())
+    assert [room for room, _ in order[:3]] == ["low", "high", "high"]
+
+
+def test_host_and_jump_caps_apply_across_rooms(app_module):
+    scheduler = app_module.ExecutionScheduler(max_slots=50, max_per_host=2, max_per_jump=3)
+    peaks = {"host": 0, "jump": 0}
+
+    async def scenario():
+        async def sample():
+            while True:
+                peaks["host"] = max(peaks["host"], scheduler._host_running.get("10.0.0.1", 0))
+                peaks["jump"] = max(peaks["jump"], scheduler._jump_running.get("bastion", 0))
+                await asyncio.sleep(0.001)
+
+        sampler = asyncio.create_task(sample())
+        await asyncio.gather(
+            run_rows(scheduler, "a", ["10.0.0.1"] * 4, []),
+            run_rows(scheduler, "b", ["10.0.0.1"] * 4, []),
+            run_rows(scheduler, "c", [f"10.2.0.{i}" for i in range(6)], [], jump="bastion"),
+        )
+        sampler.cancel()
+
+    asyncio.run(scenario())
+    assert peaks == {"host": 2, "jump": 3}
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_cancelled_waiter_leaves_queue(app_module):
+    scheduler = app_module.ExecutionScheduler(max_slots=1)
+
+    async def scenario():
+        await scheduler.acquire("a", "10.0.0.1")
+        waiter = asyncio.create_task(scheduler.acquire("b", "10.0.0.2"))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["rooms"]["b"]["queued"] == 1
+        waiter.cancel()
+        await asyncio.sleep(0)
+        scheduler.release("a", "10.0.0.1")
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["running"] == 0
+    assert stats["rooms"]["b"]["queued"] == 0
+
+
+def test_adaptive_limit_grows_while_healthy_and_halves_on_congestion(app_module):
+    controller = app_module.AdaptiveConcurrency(initial=10, min_limit=2, max_limit=100, cooldown=60)
+
+    for _ in range(10):
+        controller.record_success("bastion", 0.05)
+    assert controller.limit("bastion") == 20
+    assert controller.limit(None) == 10  # 直连与各跳板机分别跟踪
+
+    controller.record_failure("bastion", "SSH_CONNECTION_TIMEOUT")
+    controller.record_failure("bastion", "SSH_CONNECTION_TIMEOUT")  # 冷却期内不重复回退
+    controller.record_failure("bastion", "SSH_AUTH_FAILED")  # 与负载无关的错误不回退
+    assert controller.limit("bastion") == 10
+
+    for _ in range(12):
+        controller.record_success("bastion", 0.05)
+    assert controller.limit("bastion") == 11  # 回退后改为加性增长：约每 limit 次成功加1
+
+    stats = controller.stats()["groups"]["bastion"]
+    assert stats["failures"] == 3
+    assert stats["last_reason"] == "healthy"
+    assert {"from": 20, "to": 10, "reason": "SSH_CONNECTION_TIMEOUT"}.items() <= stats["changes"][-2].items()
+
+
+def test_adaptive_limit_backs_off_when_connect_latency_rises(app_module):
+    controller = app_module.AdaptiveConcurrency(initial=16, latency_floor=0.1, cooldown=0)
+
+    controller.record_success("bastion", 0.1)
+    for _ in range(5):
+        controller.record_success("bastion", 2.0)
+
+    assert controller.limit("bastion") < 16
+    assert controller.stats()["groups"]["bastion"]["last_reason"].startswith("connect latency")
+
+
+def test_scheduler_follows_adaptive_limit_per_jump_host(app_module):
+    controller = app_module.AdaptiveConcurrency(initial=2, min_limit=1)
+    scheduler = app_module.ExecutionScheduler(max_slots=50, concurrency=controller)
+    peak = {"bastion": 0}
+
+    async def scenario():
+        async def run(host):
+            async with scheduler.slot("a", host, "bastion"):
+                peak["bastion"] = max(peak["bastion"], scheduler._jump_running["bastion"])
+                await asyncio.sleep(0.01)
+
+        tasks = [asyncio.create_task(run(f"10.0.0.{i}")) for i in range(6)]
+        await asyncio.sleep(0.005)
+        assert scheduler.stats()["queued"] == 4
+        controller.record_success("bastion", 0.01)  # 上限提高后立即唤醒排队的行
+        assert scheduler.running == 3
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert peak["bastion"] == 3
+
+
+def test_concurrent_rooms_share_the_default_global_budget(app_module):
+    scheduler = app_module.ExecutionScheduler()
+    assert app_module.execution_scheduler.max_slots == scheduler.max_slots == app_module.EXEC_MAX_CONCURRENT_ROWS
+    peak = {"running": 0}
+    rooms = [f"room-{index}" for index in range(5)]
+
+    async def scenario():
+        async def sample():
+            while True:
+                peak["running"] = max(peak["running"], scheduler.running)
+                await asyncio.sleep(0.001)
+
+        sampler = asyncio.create_task(sample())
+        order = []
+        # 5 个房间各 100 行，合计远超全局额度
+        await asyncio.gather(*(
+            run_rows(scheduler, room, [f"10.{index}.{row // 256}.{row % 256}" for row in range(100)], order, hold=0.02)
+            for index, room in enumerate(rooms)
+        ))
+        sampler.cancel()
+        return order
+
+    order = asyncio.run(scenario())
+    assert len(order) == 500
+    assert peak["running"] == scheduler.max_slots
+    # 第一个房间先占满额度；之后释放的额度在排队的房间之间公平分配
+    second_wave = [room for room, _ in order[scheduler.max_slots:2 * scheduler.max_slots]]
+    assert all(second_wave.count(room) >= 15 for room in rooms[1:])
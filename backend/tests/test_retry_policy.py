@@ -0,0 +1,102 @@
+import asyncio
+import socket
+
+import asyncssh
+
+
+def test_non_retryable_errors_fail_fast(app_module):
+    policy = app_module.RetryPolicy()
+
+    for exc in (
+        asyncssh.PermissionDenied("denied"),
+        asyncssh.HostKeyNotVerifiable("host key mismatch"),
+        ConnectionRefusedError("refused"),
+    ):
+        tracker = policy.begin("room")
+        assert tracker.next_delay(exc) is None
+        assert tracker.stop_reason == "non_retryable"
+
+    try:
+        try:
+            raise asyncssh.PermissionDenied("denied")
+        except asyncssh.PermissionDenied as e:
+            raise Exception("Jump server authentication failed") from e
+    except Exception as wrapped:
+        assert policy.begin("room").next_delay(wrapped) is None
+
+    assert policy.room_stats("room")["fast_failed"] == 4
+
+
+def test_resets_broken_pipes_and_timeouts_are_retried(app_module):
+    policy = app_module.RetryPolicy()
+
+    for exc in (
+        ConnectionResetError("reset by peer"),
+        BrokenPipeError("broken pipe"),
+        asyncio.TimeoutError(),
+        asyncssh.ConnectionLost("lost"),
+    ):
+        assert policy.retryable(exc)
+        tracker = policy.begin("room")
+        assert tracker.next_delay(exc) is not None
+        assert tracker.stop_reason is None
+
+
+def test_delays_use_decorrelated_jitter_within_bounds(app_module):
+    policy = app_module.RetryPolicy(max_attempts=50, base_delay=1.0, max_delay=10.0, room_initial=100, process_initial=100)
+    tracker = policy.begin("room")
+
+    previous = policy.base_delay
+    delays = []
+    for _ in range(20):
+        delay = tracker.next_delay(asyncio.TimeoutError(), elapsed=0.5)
+        assert policy.base_delay <= delay <= min(policy.max_delay, previous * 3)
+        previous = delay
+        delays.append(delay)
+
+    assert len(set(delays)) > 1
+    stats = policy.room_stats("room")
+    assert stats["retries"] == 20
+    assert abs(stats["wasted_time"] - (20 * 0.5 + sum(delays))) < 0.01
+
+
+def test_room_budget_caps_retries_relative_to_first_attempts(app_module):
+    policy = app_module.RetryPolicy(max_attempts=3, budget_ratio=0.5, room_initial=1, process_initial=100)
+
+    outcomes = []
+    for _ in range(4):
+        tracker = policy.begin("room")
+        while tracker.next_delay(asyncio.TimeoutError()) is not None:
+            pass
+        outcomes.append(tracker.stop_reason)
+
+    # 初始1个令牌加每次首次尝试0.5个：4次操作最多重试 1 + 4 * 0.5 = 3 次
+    stats = policy.room_stats("room")
+    assert stats["retries"] == 3
+    assert stats["operations"] == 4
+    assert "budget_exhausted" in outcomes
+    assert policy.begin("other").next_delay(asyncio.TimeoutError()) is not None  # 房间预算互不影响
+
+
+def test_retries_stop_when_backoff_would_pass_the_deadline(app_module):
+    policy = app_module.RetryPolicy(max_attempts=10, base_delay=1.0)
+    tracker = policy.begin()
+
+    assert tracker.next_delay(asyncio.TimeoutError(), deadline=app_module.Deadline.after(0.5)) is None
+    assert tracker.stop_reason == "deadline"
+
+
+def test_refused_connection_is_reported_without_retrying(app_module):
+    from test_exec_row import RecordingWebSocket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    row = app_module.Row(ip="127.0.0.1", user="tester", password="secret", port=port, commands=["true"], rowId="row-0")
+    ws = RecordingWebSocket()
+    asyncio.run(app_module.exec_row(row, ws, "req-test", room="room-1"))
+
+    assert ws.messages[0]["errorCode"] == "SSH_CONNECTION_REFUSED"
+    assert ws.messages[0]["error"]["details"] == {"attempts": 1, "retryStop": "non_retryable"}
+    assert app_module.retry_policy.room_stats("room-1")["fast_failed"] == 1
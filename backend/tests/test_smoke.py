@@ -1,4 +1,7 @@
+import asyncio
+import datetime
 import importlib
+import json
 import sys
 from pathlib import Path
 
@@ -67,7 +70,17 @@ def test_config_crud_flow(client):
     assert missing.json()["success"] is False
 
 
-def test_execute_endpoint_registers_room_without_opening_ssh(client):
+def test_execute_endpoint_registers_room_and_starts_job(client, monkeypatch):
+    import app as app_module
+    from test_exec_row import SessionLimitedConnection
+
+    opened = []
+
+    async def fake_open_row_connection(row, leases, slot=0, wait=True):
+        opened.append(row.rowId)
+        return SessionLimitedConnection(max_sessions=1), None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
     response = client.post(
         "/api/v1/execute",
         json=[
@@ -86,6 +99,8 @@ def test_execute_endpoint_registers_room_without_opening_ssh(client):
     body = response.json()
     assert "room" in body
     assert body["room"]
+    wait_until(lambda: not app_module.active_rooms[body["room"]]["run"].running)
+    assert opened == ["row-1"]  # 不需要 WebSocket 也会执行
 
 
 def test_execute_rejects_invalid_ip_port_and_empty_command(client):
@@ -133,3 +148,595 @@ def test_execute_rejects_enabled_jump_server_without_required_fields(client):
     body = response.json()
     assert body["error"]["code"] == "VALIDATION_ERROR"
     assert any("Jump server IP and username" in detail["msg"] for detail in body["error"]["details"])
+
+
+def test_pool_stats_endpoint_reports_both_pools(client):
+    response = client.get("/api/v1/pool/stats")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["ssh"]["size"] == 0
+    assert body["jump"]["name"] == "jump"
+    assert "evictions" in body["ssh"]
+
+
+def test_execute_prewarm_yields_slots_to_the_run_rows(client, monkeypatch):
+    import app as app_module
+    from test_exec_row import SessionLimitedConnection
+
+    opened = []
+
+    async def fake_open_row_connection(row, leases, slot=0, wait=True):
+        opened.append(row.rowId)
+        return SessionLimitedConnection(max_sessions=10), None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    monkeypatch.setattr(app_module, "execution_scheduler", app_module.ExecutionScheduler(max_slots=2))
+    rows = [
+        {
+            "ip": f"10.0.0.{i}",
+            "user": "root",
+            "password": "example-password",
+            "port": 22,
+            "commands": ["echo hello"],
+            "rowId": f"row-{i}",
+        }
+        for i in range(8)
+    ]
+    response = client.post("/api/v1/execute?prewarm=true", json=rows)
+
+    assert response.status_code == 200
+    room_data = app_module.active_rooms[response.json()["room"]]
+    wait_until(lambda: not room_data["run"].running and room_data["prewarm_task"].done())
+    # 各行先拿到额度并自行建连，预热排在其后并跳过已开始的行：每行只建连一次
+    assert sorted(opened) == sorted(row["rowId"] for row in rows)
+    assert room_data["prewarm_task"].result() == 0
+    assert room_data["run"].summary()["rowsCompleted"] == 8
+    assert app_module.execution_scheduler.stats()["running"] == 0
+
+
+def test_prewarm_endpoint_uses_saved_config(client, monkeypatch):
+    import app as app_module
+
+    warmed = []
+
+    async def fake_open_row_connection(row, leases):
+        warmed.append((row.ip, row.jumpServer.ip if row.jumpServer else None))
+        return object(), None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    created = client.post("/api/v1/configs", json={
+        "name": "fleet",
+        "data": {
+            "commands": ["uptime"],
+            "servers": [
+                {"ip": "10.0.0.1", "user": "root", "password": "pw", "port": 22},
+                {"ip": "", "user": "root", "password": "pw", "port": 22},
+            ],
+            "jumpServer": {"enabled": True, "config": {"ip": "10.0.0.254", "user": "ops", "port": 22}},
+        },
+    }).json()
+
+    response = client.post("/api/v1/pool/prewarm", json={"config_id": created["id"]})
+
+    assert response.status_code == 200
+    assert response.json()["server_count"] == 1
+    client.get("/api/v1/pool/stats")
+    assert warmed == [("10.0.0.1", "10.0.0.254")]
+    # 预热任务被持有直到结束，结束后注销其在全局调度器中的房间
+    wait_until(lambda: not app_module.prewarm_tasks)
+    assert app_module.execution_scheduler.stats()["running"] == 0
+
+    missing = client.post("/api/v1/pool/prewarm", json={"config_id": 9999})
+    assert missing.json()["success"] is False
+
+
+def start_hanging_room(client, monkeypatch, row_count=3, **params):
+    import app as app_module
+    from test_exec_row import HangingConnection
+
+    conn = HangingConnection()
+
+    async def fake_open_row_connection(row, leases, slot=0, wait=True):
+        return conn, None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    monkeypatch.setattr(app_module, "execution_scheduler", app_module.ExecutionScheduler(max_slots=1))
+    rows = [
+        {
+            "ip": f"10.0.0.{i}",
+            "user": "root",
+            "password": "example-password",
+            "port": 22,
+            "commands": ["sleep 100"],
+            "rowId": f"row-{i}",
+        }
+        for i in range(row_count)
+    ]
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    room = client.post(f"/api/v1/execute?{query}", json=rows).json()["room"]
+    return app_module, conn, room
+
+
+def wait_until(predicate, timeout=2.0):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_websocket_cancel_message_stops_room_and_reports_summary(client, monkeypatch):
+    app_module, conn, room = start_hanging_room(client, monkeypatch)
+
+    with client.websocket_connect(f"/ws/{room}") as ws:
+        wait_until(lambda: conn.processes)
+        ws.send_json({"type": "cancel"})
+        message = ws.receive_json()
+
+    assert message["status"] == "cancelled"
+    assert message["summary"] == dict(
+        message["summary"],
+        rows=3, rowsCompleted=0, rowsCancelled=1, rowsSkipped=2, commandsCompleted=0, reason="client",
+    )
+    assert conn.processes[0].signals == ["KILL"] and conn.processes[0].closed
+    assert len(conn.processes) == 1  # 排队的行没有开始执行
+    assert app_module.execution_scheduler.stats()["running"] == 0
+
+
+def test_cancel_endpoint_and_cancel_on_disconnect(client, monkeypatch):
+    app_module, conn, room = start_hanging_room(client, monkeypatch)
+
+    assert client.post("/api/v1/rooms/missing/cancel").status_code == 404
+
+    with client.websocket_connect(f"/ws/{room}") as ws:
+        wait_until(lambda: conn.processes)
+        body = client.post(f"/api/v1/rooms/{room}/cancel").json()
+        assert ws.receive_json()["status"] == "cancelled"
+
+    assert body["success"] is True
+    assert body["summary"]["reason"] == "api"
+    assert body["summary"]["rowsSkipped"] == 2
+    assert client.post(f"/api/v1/rooms/{room}/cancel").json() == {"success": False, "error": "Room is not running"}
+
+    app_module, conn, room = start_hanging_room(client, monkeypatch, cancel_on_disconnect="true")
+    with client.websocket_connect(f"/ws/{room}"):
+        wait_until(lambda: conn.processes)
+    wait_until(lambda: not app_module.active_rooms[room]["run"].running)
+    assert app_module.active_rooms[room]["run"].summary()["reason"] == "disconnect"
+    assert conn.processes[0].closed
+
+
+def test_room_is_cleaned_up_only_after_its_run_ends(client, monkeypatch):
+    import time
+
+    app_module, conn, room = start_hanging_room(client, monkeypatch)
+    monkeypatch.setattr(app_module, "ROOM_RETENTION", 0.05)
+    wait_until(lambda: conn.processes)
+    time.sleep(0.2)
+    assert room in app_module.active_rooms  # 执行中的房间不会因保留期限到期被移除
+
+    assert client.post(f"/api/v1/rooms/{room}/cancel").json()["success"] is True
+    wait_until(lambda: room not in app_module.active_rooms)
+    assert not app_module.room_cleanup_tasks
+
+
+def test_shutdown_cancels_running_rooms_before_closing_the_writer(app_module, monkeypatch):
+    with TestClient(app_module.app) as client:
+        _, conn, room = start_hanging_room(client, monkeypatch)
+        wait_until(lambda: conn.processes)
+        run = app_module.active_rooms[room]["run"]
+        run_id = app_module.active_rooms[room]["run_id"]
+
+    assert not run.running and run.summary()["reason"] == "shutdown"
+    assert conn.processes[0].closed
+    assert not app_module.room_cleanup_tasks
+    db = app_module.SessionLocal()
+    try:
+        assert db.get(app_module.ExecutionRun, run_id).status == "cancelled"
+    finally:
+        db.close()
+
+
+def start_failing_room(client, monkeypatch, row_count, **params):
+    import app as app_module
+    from test_exec_row import SessionLimitedConnection
+
+    class FailingProcess:
+        def __init__(self):
+            self.stdout = self
+
+        async def read(self, n=-1):
+            return ""
+
+        async def wait(self):
+            return type("Completed", (), {"exit_status": 1})()
+
+    class FailingConnection(SessionLimitedConnection):
+        def __init__(self):
+            super().__init__(max_sessions=10)
+            self.commands = []
+
+        async def create_process(self, command, **kwargs):
+            self.commands.append(command)
+            return FailingProcess()
+
+    conn = FailingConnection()
+
+    async def fake_open_row_connection(row, leases, slot=0, wait=True):
+        return conn, None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    monkeypatch.setattr(app_module, "execution_scheduler", app_module.ExecutionScheduler(max_slots=1))
+    rows = [
+        {"ip": f"10.0.0.{i}", "user": "root", "password": "pw", "port": 22, "commands": ["false"], "rowId": f"row-{i}"}
+        for i in range(row_count)
+    ]
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    response = client.post(f"/api/v1/execute?{query}", json=rows)
+    return conn, response
+
+
+def receive_until_status(ws):
+    while True:
+        message = ws.receive_json()
+        if "status" in message:
+            return message
+
+
+def test_room_aborts_after_failure_threshold(client, monkeypatch):
+    conn, response = start_failing_room(client, monkeypatch, 10, max_failures=3)
+
+    with client.websocket_connect(f"/ws/{response.json()['room']}") as ws:
+        message = receive_until_status(ws)
+
+    assert message["status"] == "aborted"
+    assert message["summary"]["reason"] == "max_failures"
+    assert message["summary"]["rowsFailed"] == 3
+    assert len(conn.commands) == 3  # 之后的行不再建连执行
+
+
+def test_canary_failure_stops_before_remaining_rows(client, monkeypatch):
+    conn, response = start_failing_room(client, monkeypatch, 5, canary=1)
+
+    with client.websocket_connect(f"/ws/{response.json()['room']}") as ws:
+        message = receive_until_status(ws)
+
+    assert message["status"] == "aborted"
+    assert message["summary"]["reason"] == "canary_failed"
+    assert len(conn.commands) == 1
+
+
+def test_execute_rejects_invalid_abort_thresholds(client, monkeypatch):
+    _, response = start_failing_room(client, monkeypatch, 1, max_failure_rate=1.5)
+    assert response.status_code == 400
+    assert response.json()["error"]["code"] == "VALIDATION_ERROR"
+
+
+def test_job_runs_without_subscribers_and_fans_out_to_all(client, monkeypatch):
+    app_module, conn, room = start_hanging_room(client, monkeypatch)
+    run = app_module.active_rooms[room]["run"]
+
+    wait_until(lambda: conn.processes)  # 没有 WebSocket 也已开始执行
+    with client.websocket_connect(f"/ws/{room}") as first:
+        with client.websocket_connect(f"/ws/{room}"):
+            wait_until(lambda: len(run.subscribers) == 2)
+        # 一个订阅者断开不影响执行，也不会重新执行
+        wait_until(lambda: len(run.subscribers) == 1)
+        assert run.running
+        with client.websocket_connect(f"/ws/{room}") as second:
+            wait_until(lambda: len(run.subscribers) == 2)
+            first.send_json({"type": "cancel"})
+            assert first.receive_json()["status"] == "cancelled"
+            assert second.receive_json()["status"] == "cancelled"
+
+    assert len(conn.processes) == 1
+    with client.websocket_connect(f"/ws/{room}") as late:
+        assert late.receive_json()["status"] == "cancelled"
+
+
+def test_reconnecting_subscriber_replays_only_missed_events(client, monkeypatch):
+    import app as app_module
+    from test_exec_row import SessionLimitedConnection
+
+    async def fake_open_row_connection(row, leases, slot=0, wait=True):
+        return SessionLimitedConnection(max_sessions=4), None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    rows = [
+        {"ip": f"10.0.0.{i}", "user": "root", "password": "pw", "port": 22, "commands": ["echo a", "echo b"], "rowId": f"row-{i}"}
+        for i in range(3)
+    ]
+    room = client.post("/api/v1/execute", json=rows).json()["room"]
+    wait_until(lambda: not app_module.active_rooms[room]["run"].running)
+
+    with client.websocket_connect(f"/ws/{room}") as ws:
+        events = [ws.receive_json() for _ in range(7)]
+    assert [event["eventSeq"] for event in events] == list(range(1, 8))
+    assert events[-1]["status"] == "completed"
+
+    with client.websocket_connect(f"/ws/{room}?since=4") as ws:
+        missed = [ws.receive_json() for _ in range(3)]
+    assert missed == events[4:]
+
+
+def test_event_log_compacts_oldest_events_into_summary(client):
+    import app as app_module
+
+    log = app_module.RoomEventLog(max_events=3)
+    for i in range(5):
+        log.append({"rowId": f"row-{i % 2}", "command": "false", "output": "", "exitStatus": i % 2})
+    log.append(app_module.websocket_error("row-0", "SSH_CONNECTION_FAILED"))
+
+    assert len(log.events) == 3
+    replay = log.since(1)
+    assert replay[0] == {
+        "type": "compacted",
+        "eventSeq": 3,
+        "rows": {"row-0": {"commands": 2, "failed": 0, "errors": 0}, "row-1": {"commands": 1, "failed": 1, "errors": 0}},
+        "errors": 0,
+    }
+    assert [event["eventSeq"] for event in replay[1:]] == [4, 5, 6]
+    assert [event["eventSeq"] for event in log.since(5)] == [6]
+
+
+def test_slow_subscriber_drops_progress_but_keeps_every_result(app_module, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(app_module, "SUBSCRIBER_QUEUE_SIZE", 4)
+
+    class SlowWebSocket:
+        def __init__(self):
+            self.frames = []
+
+        async def send_text(self, text):
+            await asyncio.sleep(0.01)
+            self.frames.append(json.loads(text))
+
+    async def scenario():
+        run = app_module.RoomRun("room", [])
+        ws = SlowWebSocket()
+        subscriber = run.attach(ws, stream=True, batch=True)
+        sender = asyncio.create_task(subscriber.run_sender())
+        await asyncio.sleep(0.02)
+        for i in range(30):
+            await run.send_json({"type": "output", "rowId": "row-0", "data": "x"})
+            await run.send_json({"rowId": "row-0", "command": f"echo {i}", "output": "", "exitStatus": 0})
+        await run.send_json({"status": "completed"})
+        subscriber.close()
+        await asyncio.wait_for(sender, 5)
+        return ws.frames, subscriber.stats()
+
+    frames, stats = asyncio.run(scenario())
+    messages = [message for frame in frames for message in frame]
+    assert [message["eventSeq"] for message in messages if "eventSeq" in message] == list(range(1, 32))
+    assert stats["dropped"] > 0
+    assert stats["fellBehind"] > 0
+    assert stats["queuePeak"] <= 4
+    assert stats["frames"] < len(messages)
+
+
+def test_batched_subscriber_receives_array_frames_and_stats_endpoint(client, monkeypatch):
+    import app as app_module
+    from test_exec_row import SessionLimitedConnection
+
+    async def fake_open_row_connection(row, leases, slot=0, wait=True):
+        return SessionLimitedConnection(max_sessions=4), None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    rows = [
+        {"ip": f"10.0.0.{i}", "user": "root", "password": "pw", "port": 22, "commands": ["echo a"], "rowId": f"row-{i}"}
+        for i in range(5)
+    ]
+    room = client.post("/api/v1/execute", json=rows).json()["room"]
+    wait_until(lambda: not app_module.active_rooms[room]["run"].running)
+
+    with client.websocket_connect(f"/ws/{room}?batch=true") as ws:
+        frame = ws.receive_json()
+    assert isinstance(frame, list)
+    assert [message["eventSeq"] for message in frame] == list(range(1, 7))
+
+    stats = client.get(f"/api/v1/rooms/{room}/stats").json()
+    assert stats["running"] is False
+    assert stats["events"]["lastSeq"] == 6
+    assert client.get("/api/v1/rooms/missing/stats").status_code == 404
+
+
+def test_msgpack_protocol_interns_row_and_command_ids(client, monkeypatch):
+    import msgpack
+
+    import app as app_module
+    from test_exec_row import SessionLimitedConnection
+
+    async def fake_open_row_connection(row, leases, slot=0, wait=True):
+        return SessionLimitedConnection(max_sessions=4), None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    rows = [
+        {"ip": "10.0.0.1", "user": "root", "password": "pw", "port": 22, "commands": ["echo a", "echo b"], "rowId": "row-0"},
+    ]
+    room = client.post("/api/v1/execute", json=rows).json()["room"]
+    wait_until(lambda: not app_module.active_rooms[room]["run"].running)
+
+    with client.websocket_connect(f"/ws/{room}?protocol=msgpack&batch=true") as ws:
+        hello = ws.receive_json()
+        frame = msgpack.unpackb(ws.receive_bytes(), strict_map_key=False)
+    keys = hello["keys"]
+    row_key, command_key = keys.index("rowId"), keys.index("command")
+
+    assert hello["protocol"] == "msgpack"
+    assert frame[0][row_key] == [0, "row-0"]
+    assert frame[1][row_key] == 0  # 同一连接内重复的 rowId 只发送编号
+    assert sorted(message[command_key][1] for message in frame[:2]) == ["echo a", "echo b"]
+    assert frame[2][keys.index("status")] == "completed"
+
+    with client.websocket_connect(f"/ws/{room}?protocol=xml") as ws:
+        assert ws.receive_json()["error"]["code"] == "VALIDATION_ERROR"
+
+
+def test_room_progress_counts_incrementally(app_module):
+    progress = app_module.RoomProgress(total_rows=3)
+    rows = [app_module.Row(ip=f"10.0.0.{i}", user="root", password="pw", port=22, commands=["id"], rowId=f"row-{i}") for i in range(3)]
+
+    for row in rows[:2]:
+        progress.row_started(row)
+    for seconds in (0.01, 0.02, 0.03, 2.0):
+        progress.connected(seconds)
+    progress.command_finished(0, 0.5)
+    progress.command_finished(1, 0.5)
+    progress.error("SSH_CONNECTION_TIMEOUT")
+    progress.row_finished(rows[0], ok=False)
+
+    snapshot = progress.snapshot()
+    assert snapshot["rows"] == {"total": 3, "pending": 1, "running": 1, "succeeded": 0, "failed": 1}
+    assert snapshot["commands"] == {"succeeded": 1, "failed": 1, "errors": 1}
+    assert snapshot["errorCodes"] == {"SSH_CONNECTION_TIMEOUT": 1}
+    assert 10 <= snapshot["connectMs"]["p50"] <= 25
+    assert snapshot["connectMs"]["max"] == 2000.0
+    assert [host["rowId"] for host in snapshot["slowest"]] == ["row-1"]
+
+
+def test_summary_subscriber_gets_aggregates_instead_of_results(client, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, "PROGRESS_INTERVAL", 0.05)
+    _, conn, room = start_hanging_room(client, monkeypatch)
+
+    with client.websocket_connect(f"/ws/{room}?mode=summary") as ws:
+        wait_until(lambda: conn.processes)
+        frames = [ws.receive_json() for _ in range(3)]
+        client.post(f"/api/v1/rooms/{room}/cancel")
+        while "status" not in frames[-1]:
+            frames.append(ws.receive_json())
+
+    assert all(frame["type"] == "progress" for frame in frames[:-1])
+    assert frames[-2]["rows"]["running"] == 1
+    assert frames[-2]["slowest"][0]["rowId"] == "row-0"
+    assert frames[-1]["status"] == "cancelled"
+
+    events = client.get(f"/api/v1/rooms/{room}/events", params={"row_id": "row-0"}).json()
+    assert events["events"] == []  # 被取消的行没有结果
+    assert events["lastSeq"] == 1
+
+
+def test_run_record_links_results_and_counts_them(client, monkeypatch):
+    import app as app_module
+
+    _, response = start_failing_room(client, monkeypatch, 3)
+    run_id = response.json()["run_id"]
+    with client.websocket_connect(f"/ws/{response.json()['room']}") as ws:
+        assert receive_until_status(ws)["status"] == "completed"
+    wait_until(lambda: client.get(f"/api/v1/runs/{run_id}").json()["status"] == "completed")
+    app_module.result_writer.flush()
+
+    run = client.get(f"/api/v1/runs/{run_id}").json()
+    assert run["requestId"] == response.json()["request_id"]
+    assert (run["serverCount"], run["results"], run["failedResults"], run["rowsFailed"]) == (3, 3, 3, 3)
+    assert run["config"]["options"]["stream"] is False
+    assert "password" not in run["config"]["rows"][0]
+
+    listed = client.get("/api/v1/runs").json()
+    assert [item["id"] for item in listed["runs"]] == [run_id]
+
+    first = client.get(f"/api/v1/runs/{run_id}/results?limit=2").json()
+    rest = client.get(f"/api/v1/runs/{run_id}/results?after={first['nextAfter']}").json()
+    results = first["results"] + rest["results"]
+    assert sorted(result["ip"] for result in results) == ["10.0.0.0", "10.0.0.1", "10.0.0.2"]
+    assert all(result["exitStatus"] == 1 and result["runId"] == run_id for result in results)
+    assert rest["nextAfter"] is None
+
+    assert client.get("/api/v1/runs/999").json()["error"]["code"] == "RUN_NOT_FOUND"
+
+
+def test_results_api_filters_paginates_and_searches_outputs(client):
+    import app as app_module
+
+    def result(ip, command, output, exit_status=0, days_ago=0):
+        return {"ip": ip, "user": "root", "password": "*****", "port": 22, "command": command, "output": output,
+                "exit_status": exit_status, "timestamp": datetime.datetime(2026, 10, 17) - datetime.timedelta(days=days_ago)}
+
+    app_module.save_results_batch([
+        result("10.0.0.1", "dmesg | tail", "Out of memory: Killed process 4242 (java)", 0, days_ago=2),
+        result("10.0.0.2", "dmesg | tail", "Out of memory: Killed process 4242 (java)", 0, days_ago=20),
+        result("10.0.0.3", "dmesg | tail", "eth0: link up"),
+        result("10.0.0.1", "systemctl is-active sshd", "inactive", 3),
+        result("10.0.0.2", "uname -r", "6.1.0-oom-fix"),
+    ])
+
+    oom = client.get("/api/v1/results", params={"q": "out of memory"}).json()["results"]
+    assert sorted(item["ip"] for item in oom) == ["10.0.0.1", "10.0.0.2"]
+    assert oom[0]["output"] == "Out of memory: Killed process 4242 (java)"
+    recent = client.get("/api/v1/results", params={"q": "Killed", "since": "2026-10-10T00:00:00Z"}).json()["results"]
+    assert [item["ip"] for item in recent] == ["10.0.0.1"]
+    assert [item["command"] for item in client.get("/api/v1/results", params={"exit_status": 3}).json()["results"]] == ["systemctl is-active sshd"]
+    assert client.get("/api/v1/results", params={"q": "-r (java"}).status_code == 200  # 查询语法字符按普通文本处理
+
+    first = client.get("/api/v1/results", params={"ip": "10.0.0.2", "limit": 1}).json()
+    second = client.get("/api/v1/results", params={"ip": "10.0.0.2", "limit": 1, "before": first["nextBefore"]}).json()
+    assert [first["results"][0]["command"], second["results"][0]["command"]] == ["uname -r", "dmesg | tail"]
+    assert client.get("/api/v1/results", params={"q": "  "}).json()["error"]["code"] == "VALIDATION_ERROR"
+
+
+def test_shutdown_cancels_background_tasks_and_closes_pools(app_module):
+    with TestClient(app_module.app):
+        tasks = list(app_module.background_tasks)
+        assert len(tasks) == 2 and not any(task.done() for task in tasks)
+
+    assert all(task.cancelled() for task in tasks)
+    assert app_module.background_tasks == []
+    assert len(app_module.ssh_connections) == 0 and len(app_module.jump_server_connections) == 0
+
+
+def test_failure_rate_is_measured_over_completed_rows(app_module):
+    policy = app_module.AbortPolicy(3000, max_failure_rate=0.5)
+    reasons = [policy.record(ok=False) for _ in range(policy.min_sample)]
+    # 按已完成的行计算比例：达到最小样本数时即终止，而不是等到 1501 行失败
+    assert reasons[:-1] == [None] * (policy.min_sample - 1)
+    assert reasons[-1] == "max_failure_rate"
+
+    healthy = app_module.AbortPolicy(3000, max_failure_rate=0.5)
+    assert all(healthy.record(ok=index % 3 != 0) is None for index in range(3000))  # 约 33% 失败不终止
+
+    windowed = app_module.AbortPolicy(100, max_failure_rate=0.5, window=4)
+    assert [windowed.record(ok) for ok in (False, True, False, False)] == [None, None, None, "max_failure_rate"]
+
+
+def test_prewarm_dials_share_the_global_scheduler_across_rooms(app_module, monkeypatch):
+    scheduler = app_module.ExecutionScheduler(max_slots=3, max_per_jump=2)
+    monkeypatch.setattr(app_module, "execution_scheduler", scheduler)
+    dialing = {"now": 0, "peak": 0, "jump": 0, "jump_peak": 0}
+
+    async def fake_open_row_connection(row, leases):
+        via_jump = row.jumpServer is not None
+        dialing["now"] += 1
+        dialing["jump"] += via_jump
+        dialing["peak"] = max(dialing["peak"], dialing["now"])
+        dialing["jump_peak"] = max(dialing["jump_peak"], dialing["jump"])
+        await asyncio.sleep(0.01)
+        dialing["now"] -= 1
+        dialing["jump"] -= via_jump
+        return object(), None
+
+    monkeypatch.setattr(app_module, "open_row_connection", fake_open_row_connection)
+    jump = {"enabled": True, "ip": "10.0.0.254", "user": "ops", "port": 22}
+
+    def rows(room, count, jump_server=None):
+        return [
+            app_module.Row(ip=f"10.{room}.0.{i}", user="root", password="pw", port=22,
+                           commands=["uptime"], rowId=f"{room}-{i}", jumpServer=jump_server)
+            for i in range(count)
+        ]
+
+    async def main():
+        # 多个房间同时预热：总建连数受全局额度限制，经跳板机的建连受单跳板机上限限制
+        return await asyncio.gather(
+            app_module.prewarm_rows(rows(1, 10), "room-1", "req-1"),
+            app_module.prewarm_rows(rows(2, 10), "room-2", "req-2"),
+            app_module.prewarm_rows(rows(3, 10, jump), "room-3", "req-3"),
+        )
+
+    assert asyncio.run(main()) == [10, 10, 10]
+    assert dialing["peak"] == 3
+    assert dialing["jump_peak"] == 2
+    assert scheduler.stats()["running"] == 0
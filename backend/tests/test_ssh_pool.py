@@ -0,0 +1,300 @@
+import asyncio
+
+
+class FakeConnection:
+    def __init__(self, name, probe_ok=True):
+        self.name = name
+        self.probe_ok = probe_ok
+        self.probes = 0
+        self.closed = False
+
+    async def run(self, command, check=False):
+        self.probes += 1
+        if not self.probe_ok:
+            raise ConnectionError("probe failed")
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def make_dialer(app_module, conns):
+    calls = []
+
+    async def dial():
+        conn = conns[len(calls)]
+        calls.append(conn)
+        client = app_module.PoolClient()
+        return conn, client
+
+    return dial, calls
+
+
+def test_checkout_reuses_connection_without_probe(app_module):
+    pool = app_module.SSHConnectionPool("test")
+    dial, calls = make_dialer(app_module, [FakeConnection("a")])
+
+    async def scenario():
+        first = await pool.get("host:22:root", dial)
+        second = await pool.get("host:22:root", dial)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is second
+    assert len(calls) == 1
+    assert first.probes == 0
+
+
+def test_connection_lost_callback_forces_redial(app_module):
+    pool = app_module.SSHConnectionPool("test")
+    dial, calls = make_dialer(app_module, [FakeConnection("a"), FakeConnection("b")])
+
+    async def scenario():
+        first = await pool.get("host:22:root", dial)
+        pool._entries["host:22:root"].client.connection_lost(None)
+        second = await pool.get("host:22:root", dial)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.name == "a" and second.name == "b"
+    assert first.probes == 0
+    assert first.closed
+
+
+def test_suspect_connection_is_probed_before_reuse(app_module):
+    pool = app_module.SSHConnectionPool("test")
+    dial, calls = make_dialer(app_module, [FakeConnection("a"), FakeConnection("b", probe_ok=False), FakeConnection("c")])
+
+    async def scenario():
+        healthy = await pool.get("a", dial)
+        pool.mark_suspect("a")
+        assert await pool.get("a", dial) is healthy
+
+        broken = await pool.get("b", dial)
+        pool.mark_suspect("b")
+        replacement = await pool.get("b", dial)
+        return healthy, broken, replacement
+
+    healthy, broken, replacement = asyncio.run(scenario())
+    assert healthy.probes == 1
+    assert broken.probes == 1 and broken.closed
+    assert replacement.name == "c"
+
+
+def test_concurrent_checkouts_share_one_dial(app_module):
+    pool = app_module.SSHConnectionPool("test")
+    dials = []
+
+    async def dial():
+        dials.append(1)
+        await asyncio.sleep(0.01)
+        return FakeConnection("shared"), app_module.PoolClient()
+
+    async def scenario():
+        return await asyncio.gather(*(pool.get("bastion:22:ops", dial) for _ in range(50)))
+
+    conns = asyncio.run(scenario())
+    assert len(dials) == 1
+    assert all(conn is conns[0] for conn in conns)
+    assert len(pool) == 1
+
+
+def test_dial_failure_fans_out_to_all_waiters(app_module):
+    pool = app_module.SSHConnectionPool("test")
+    dials = []
+
+    async def dial():
+        dials.append(1)
+        await asyncio.sleep(0.01)
+        raise ConnectionRefusedError("refused")
+
+    async def scenario():
+        return await asyncio.gather(*(pool.get("down:22:root", dial) for _ in range(10)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert len(dials) == 1
+    assert all(isinstance(result, ConnectionRefusedError) for result in results)
+    assert "down:22:root" not in pool
+    assert not pool._pending
+
+
+def fake_dialer(app_module):
+    async def dial():
+        return FakeConnection("conn"), app_module.PoolClient()
+
+    return dial
+
+
+def test_full_pool_evicts_least_recently_used_idle_connection(app_module):
+    pool = app_module.SSHConnectionPool("test", max_size=2)
+    dial = fake_dialer(app_module)
+
+    async def scenario():
+        a = await pool.get("a", dial, host="a")
+        b = await pool.get("b", dial, host="b")
+        pool.release("a", a)
+        pool.release("b", b)
+        await pool.get("a", dial, host="a")  # a is now the most recently used
+        pool.release("a", a)
+        await pool.get("c", dial, host="c")
+        return a, b
+
+    a, b = asyncio.run(scenario())
+    assert "b" not in pool and b.closed
+    assert "a" in pool and not a.closed
+    assert pool.stats()["evictions"] == 1
+
+
+def test_per_host_cap_queues_waiters_until_release(app_module):
+    pool = app_module.SSHConnectionPool("test", max_per_host=1)
+    dial = fake_dialer(app_module)
+    order = []
+
+    async def scenario():
+        first = await pool.get("web:22:root", dial, host="web")
+
+        async def other_user(name):
+            await pool.get(f"web:22:{name}", dial, host="web")
+            order.append(name)
+
+        waiters = [asyncio.ensure_future(other_user(name)) for name in ("ops", "dev")]
+        await asyncio.sleep(0.01)
+        assert order == [] and pool.stats()["waiting"] == 2
+
+        pool.release("web:22:root", first)
+        await asyncio.sleep(0.01)
+        assert order == ["ops"]
+
+        pool.release("web:22:ops", pool._entries["web:22:ops"].conn)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(scenario())
+    assert order == ["ops", "dev"]
+    assert len(pool) == 1
+
+
+def test_waiters_on_one_host_do_not_block_dials_to_other_hosts(app_module):
+    pool = app_module.SSHConnectionPool("test", max_size=100, max_per_host=1)
+    dial = fake_dialer(app_module)
+
+    async def scenario():
+        first = await pool.get("web:22:root", dial, host="web")
+        waiters = [asyncio.ensure_future(pool.get(f"web:22:{name}", dial, host="web")) for name in ("ops", "dev")]
+        await asyncio.sleep(0.01)
+        assert pool.stats()["waiting"] == 2
+
+        # 其他主机的上限空闲，不必排在 web 的排队者之后
+        await asyncio.wait_for(pool.get("db:22:root", dial, host="db"), timeout=1)
+
+        pool.release("web:22:root", first)
+        await asyncio.sleep(0.01)
+        pool.release("web:22:ops", await waiters[0])
+        await asyncio.gather(*waiters)
+
+    asyncio.run(scenario())
+    assert "db:22:root" in pool and pool.stats()["waiting"] == 0
+
+
+def test_non_waiting_checkout_raises_instead_of_queueing(app_module):
+    pool = app_module.SSHConnectionPool("test", max_per_host=1)
+    dial = fake_dialer(app_module)
+
+    async def scenario():
+        await pool.get("web:22:root", dial, host="web")
+        try:
+            await pool.get("web:22:root#2", dial, host="web", wait=False)
+        except app_module.PoolExhausted:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
+    assert pool.stats()["waiting"] == 0 and "web:22:root#2" not in pool
+
+
+def test_stats_count_hits_misses_and_dials(app_module):
+    pool = app_module.SSHConnectionPool("test")
+    dial = fake_dialer(app_module)
+
+    async def scenario():
+        conn = await pool.get("a", dial, host="a")
+        await pool.get("a", dial, host="a")
+        pool.release("a", conn)
+        pool.release("a", conn)
+
+    asyncio.run(scenario())
+    stats = pool.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["dials"] == 1
+    assert stats["in_use"] == 0
+    assert stats["dial_latency"]["p50"] is not None
+
+
+def test_idle_connections_expire_at_their_own_deadline(app_module):
+    pool = app_module.SSHConnectionPool("test", idle_ttl=0.05, via_jump_idle_ttl=0.2)
+    dial = fake_dialer(app_module)
+
+    async def scenario():
+        maintenance = asyncio.ensure_future(pool.run_maintenance())
+        direct = await pool.get("direct", dial, host="a")
+        via_jump = await pool.get("via", dial, host="b", jump="bastion")
+        busy = await pool.get("busy", dial, host="c")
+        pool.release("direct", direct)
+        pool.release("via", via_jump)
+
+        await asyncio.sleep(0.12)
+        assert "direct" not in pool and direct.closed
+        assert "via" in pool
+        assert "busy" in pool  # leased connections never expire
+
+        await asyncio.sleep(0.15)
+        assert "via" not in pool
+        maintenance.cancel()
+
+    asyncio.run(scenario())
+    assert pool.stats()["expired"] == 2
+
+
+def test_health_checks_are_rate_limited_and_skip_recently_used(app_module):
+    pool = app_module.SSHConnectionPool("test", health_check_interval=10, health_check_rate=1, health_check_burst=2)
+    dial = fake_dialer(app_module)
+
+    async def scenario():
+        conns = [await pool.get(f"h{i}", dial, host=f"h{i}") for i in range(5)]
+        later = app_module.time.monotonic() + 100
+        for entry in pool._entries.values():
+            entry.last_ok -= 100
+        pool._entries["h0"].last_ok = later  # a hot connection with a fresh successful channel
+        tasks = pool.start_health_checks(later)
+        await asyncio.gather(*tasks)
+        return conns
+
+    conns = asyncio.run(scenario())
+    assert conns[0].probes == 0
+    assert sum(conn.probes for conn in conns) == 2
+    assert len(pool._health_heap) == 5
+
+
+def test_keepalive_hint_reads_asyncssh_counter_and_tolerates_its_absence(app_module):
+    import asyncssh
+    from conftest import local_sshd
+
+    async def scenario():
+        async with local_sshd() as port:
+            async with asyncssh.connect("127.0.0.1", port, username="root", password="pw", known_hosts=None,
+                                        keepalive_interval=60, keepalive_count_max=3) as conn:
+                # asyncssh 改名或移除该私有属性时这里会失败，需要同步修改 keepalive_pending
+                assert isinstance(getattr(conn, app_module.ASYNCSSH_KEEPALIVE_COUNT_ATTR, None), int)
+                entry = app_module.PooledConnection("root@127.0.0.1", conn)
+                assert not entry.keepalive_pending()
+                setattr(conn, app_module.ASYNCSSH_KEEPALIVE_COUNT_ATTR, 1)
+                assert entry.keepalive_pending()
+                setattr(conn, app_module.ASYNCSSH_KEEPALIVE_COUNT_ATTR, 0)
+
+    asyncio.run(scenario())
+
+    entry = app_module.PooledConnection("root@10.0.0.1", FakeConnection("no-counter"))
+    assert not entry.keepalive_pending()
+    assert not entry.needs_probe(entry.last_ok, probe_idle=180)
@@ -0,0 +1,152 @@
+import importlib
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+
+
+def test_sqlite_engine_uses_wal_and_tuned_pragmas(app_module):
+    with app_module.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == -app_module.SQLITE_CACHE_SIZE_KB
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 30000
+
+
+def test_database_lives_in_configured_data_dir(tmp_path, monkeypatch):
+    backend_dir = Path(__file__).resolve().parents[1]
+    data_dir = tmp_path / "backend-data"
+    data_dir.mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CYCLOPS_DATA_DIR", str(data_dir))
+    sys.path.insert(0, str(backend_dir))
+    try:
+        sys.modules.pop("app", None)
+        module = importlib.import_module("app")
+        module.save_results_batch([
+            {"ip": "10.0.0.1", "user": "root", "password": "*****", "port": 22, "command": "id", "output": "uid=0", "exit_status": 0},
+        ])
+        with module.engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM server_command_results")).scalar() == 1
+        module.engine.dispose()
+    finally:
+        sys.modules.pop("app", None)
+        sys.path.remove(str(backend_dir))
+
+    assert (data_dir / "test.db").exists()
+    assert not (tmp_path / "test.db").exists()
+
+
+def result(ip, output):
+    return {"ip": ip, "user": "root", "password": "*****", "port": 22, "command": "uname -a", "output": output, "exit_status": 0}
+
+
+def test_identical_outputs_are_stored_once_compressed(app_module):
+    app_module.save_results_batch([result("10.0.0.1", "Linux 6.1\n" * 50), result("10.0.0.2", "Linux 6.1\n" * 50)])
+    app_module.save_results_batch([result("10.0.0.3", "Linux 6.1\n" * 50), result("10.0.0.4", "Linux 5.15\n")])
+
+    with app_module.engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM output_blobs")).scalar() == 2
+        assert conn.execute(text("SELECT count(*) FROM server_command_results WHERE output IS NOT NULL")).scalar() == 0
+        size, stored = conn.execute(text("SELECT size, length(data) FROM output_blobs ORDER BY size DESC")).first()
+    assert size == 500 and stored < size
+
+    db = app_module.SessionLocal()
+    try:
+        rows = db.query(app_module.ServerCommandResult).order_by(app_module.ServerCommandResult.ip).all()
+        assert [row.output_text for row in rows] == ["Linux 6.1\n" * 50] * 3 + ["Linux 5.15\n"]
+    finally:
+        db.close()
+
+
+def test_inline_outputs_are_migrated_to_blobs(app_module):
+    with app_module.engine.begin() as conn:
+        for ip, output in [("10.0.0.1", "legacy"), ("10.0.0.2", "legacy"), ("10.0.0.3", "other")]:
+            conn.execute(
+                text("INSERT INTO server_command_results (ip, user, password, port, command, output) VALUES (:ip, 'root', '', 22, 'id', :output)"),
+                {"ip": ip, "output": output},
+            )
+
+    assert app_module.migrate_inline_outputs(chunk_size=2) == 3
+    assert app_module.migrate_inline_outputs() == 0
+
+    db = app_module.SessionLocal()
+    try:
+        rows = db.query(app_module.ServerCommandResult).order_by(app_module.ServerCommandResult.ip).all()
+        assert [row.output for row in rows] == [None, None, None]
+        assert [row.output_text for row in rows] == ["legacy", "legacy", "other"]
+        assert db.query(app_module.OutputBlob).count() == 2
+    finally:
+        db.close()
+
+
+def test_blobs_written_before_search_was_enabled_are_backfilled(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "OUTPUT_SEARCH_ENABLED", False)
+    app_module.save_results_batch([result("10.0.0.1", "kernel: oom-killer invoked")])
+    monkeypatch.setattr(app_module, "OUTPUT_SEARCH_ENABLED", True)
+    db = app_module.SessionLocal()
+    try:
+        assert app_module.search_results(db, q="oom") == []
+    finally:
+        db.close()
+
+    assert app_module.index_unsearchable_outputs() == 1
+    assert app_module.index_unsearchable_outputs() == 0
+    db = app_module.SessionLocal()
+    try:
+        assert [row.ip for row in app_module.search_results(db, q="oom")] == ["10.0.0.1"]
+    finally:
+        db.close()
+
+
+def test_blob_written_concurrently_by_another_writer_does_not_drop_the_batch(app_module):
+    import hashlib
+    import sqlite3
+
+    from sqlalchemy import event
+
+    output = "same output everywhere"
+    racing = sqlite3.connect(app_module.engine.url.database)
+    raced = []
+
+    def write_same_blob_first(conn, cursor, statement, parameters, context, executemany):
+        # 在查询已有哈希之后、写入输出块之前，由另一个连接（如迁移线程）写入同一输出块
+        if statement.startswith("INSERT INTO output_blobs") and not raced:
+            raced.append(statement)
+            with racing:
+                racing.execute("INSERT INTO output_blobs (hash, size, data) VALUES (?, ?, ?)",
+                               (hashlib.sha256(output.encode()).hexdigest(), len(output), b"x"))
+
+    event.listen(app_module.engine, "before_cursor_execute", write_same_blob_first)
+    try:
+        app_module.save_results_batch([result("10.0.0.9", output), result("10.0.0.8", output)])
+    finally:
+        event.remove(app_module.engine, "before_cursor_execute", write_same_blob_first)
+        racing.close()
+
+    assert raced
+    with app_module.engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM server_command_results")).scalar() == 2
+        assert conn.execute(text("SELECT count(*) FROM output_blobs")).scalar() == 1
+
+
+def test_writer_retries_per_batch_and_counts_failed_rows(app_module, monkeypatch):
+    save = app_module.save_results_batch
+
+    def save_rejecting_bad_rows(results):
+        if any(item["ip"] == "bad" for item in results):
+            raise RuntimeError("disk I/O error")
+        save(results)
+
+    monkeypatch.setattr(app_module, "save_results_batch", save_rejecting_bad_rows)
+    writer = app_module.ResultWriter(retries=2)
+    writer.queue.put([result("10.0.0.1", "a")])
+    writer.queue.put([result("bad", "b")])
+    writer.queue.put([result("10.0.0.2", "c")])
+    writer.start()
+    writer.close()
+
+    stats = writer.stats()
+    assert (stats["rowsWritten"], stats["rowsFailed"], stats["commitFailures"]) == (2, 1, 1)
+    with app_module.engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM server_command_results")).scalar() == 2
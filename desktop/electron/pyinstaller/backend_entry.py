@@ -18,6 +18,8 @@ def main():
     data_dir = Path(args.data_dir or os.getcwd()).expanduser().resolve()
     data_dir.mkdir(parents=True, exist_ok=True)
     os.chdir(data_dir)
+    # 数据库等持久化文件放在数据目录下，与工作目录无关
+    os.environ.setdefault("CYCLOPS_DATA_DIR", str(data_dir))
 
     from app import app as fastapi_app
 
@@ -4,6 +4,7 @@ import 'handsontable/dist/handsontable.full.min.css';
 import Handsontable from 'handsontable';
 import { ansiToHtml } from './ansi-to-html';
 import { formatBackendError, isValidIpAddress, isValidPort } from './validation';
+import { createWireDecoder } from './msgpack';
 import './App.css';
 
 // 注册数值类型单元格
@@ -53,6 +54,8 @@ const desktopConfig = window.__CYCLOPS_DESKTOP_CONFIG__ || {};
 const canExportDesktopLogs = typeof desktopConfig.exportDebugLogs === 'function';
 const API_BASE_URL = (desktopConfig.apiBaseUrl || import.meta.env.VITE_BACKEND_API_BASE_URL || '').replace(/\/$/, '');
 const apiUrl = (path) => `${API_BASE_URL}${path}`;
+// 执行中 WebSocket 意外断开后的最大重连次数
+const MAX_RECONNECTS = 5;
 
 export default function App() {
   const hotRef = useRef(null);
@@ -85,6 +88,8 @@ export default function App() {
   });
   const [showOperationGuide, setShowOperationGuide] = useState(false);
   const fileInputRef = useRef(null);
+  // 当前执行的 WebSocket，用于发送取消消息
+  const wsRef = useRef(null);
 
   const updateCommandHeader = (hotInstance, colIndex, newHeader) => {
     const currentHeader = hotInstance.getColHeader(colIndex);
@@ -519,6 +524,13 @@ export default function App() {
   };
 
   // 执行命令
+  // 通知后端取消当前执行：排队的服务器不再执行，执行中的命令被结束
+  const cancelRun = () => {
+    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+      wsRef.current.send(JSON.stringify({ type: 'cancel' }));
+    }
+  };
+
   const run = async () => {
     if (!hotRef.current) {
       console.error('Table reference not initialized');
@@ -612,7 +624,8 @@ export default function App() {
     setErrorMessages([]);
 
     try {
-      const res = await fetch(apiUrl('/api/v1/execute'), {
+      // 提交后后端立即在后台执行，各行拿到执行额度时自行建连；stream=true 产生实时输出分块
+      const res = await fetch(apiUrl('/api/v1/execute?stream=true'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(rows)
@@ -626,132 +639,207 @@ export default function App() {
         const wsUrl = wsBaseUrl
           ? `${wsBaseUrl.replace(/\/$/, '')}/ws/${room}`
           : `${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${import.meta.env.VITE_BACKEND_WS_HOST || window.location.hostname}:${import.meta.env.VITE_BACKEND_WS_PORT || '8000'}/ws/${room}`;
-        const ws = new WebSocket(wsUrl);
+        // stream=true：命令执行过程中实时接收输出分块
+        // 按 rowId + 命令累积的实时输出，收到完整结果后以完整结果为准
+        const partialOutputs = new Map();
+        let lastSeq = 0;
+        let finished = false;
+        let reconnects = 0;
+        const connect = () => {
+          const ws = new WebSocket(`${wsUrl}?stream=true&batch=true&protocol=msgpack&since=${lastSeq}`);
+          ws.binaryType = 'arraybuffer';
+          wsRef.current = ws;
+          // protocol=msgpack：握手消息为 JSON 文本帧，携带字段表；之后的事件为二进制帧
+          let decodeFrame = null;
+
+          ws.onopen = () => {
+            console.log('WebSocket connection established');
+            reconnects = 0;
+            setConnectionStatus('connected');
+          };
 
-        ws.onopen = () => {
-          console.log('WebSocket connection established');
-          setConnectionStatus('connected');
-        };
+          // batch=true：一帧可能是多条消息组成的数组
+          ws.onmessage = (event) => {
+            if (typeof event.data !== 'string') {
+              decodeFrame(event.data).forEach(handleMessage);
+              return;
+            }
+            const data = JSON.parse(event.data);
+            if (data.type === 'hello') {
+              decodeFrame = createWireDecoder(data.keys);
+              return;
+            }
+            (Array.isArray(data) ? data : [data]).forEach(handleMessage);
+          };
+
+          const handleMessage = (message) => {
+            if (message.eventSeq) {
+              lastSeq = message.eventSeq;
+            }
 
-        ws.onmessage = (event) => {
-          const message = JSON.parse(event.data);
+            // 重连时错过的早期事件已被压缩：结果仍保存在后端，这里只提示数量
+            if (message.type === 'compacted') {
+              const commands = Object.values(message.rows || {}).reduce((total, row) => total + row.commands, 0);
+              setErrorMessages(prevErrors => [...prevErrors, `${commands} earlier results were missed while disconnected`]);
+              return;
+            }
+            if (message.status) {
+              finished = true;
+            }
           
-          // 处理完成状态消息
-          if (message.status === "completed") {
-            console.log("All commands completed successfully");
-            setIsRunning(false);
-            setConnectionStatus(null);
-            return;
-          }
+            // 处理取消/提前终止消息：汇总已执行和跳过的服务器
+            if (message.status === "cancelled" || message.status === "aborted") {
+              const summary = message.summary || {};
+              const label = message.status === "aborted" ? `Execution aborted (${summary.reason})` : "Execution cancelled";
+              setErrorMessages(prevErrors => [...prevErrors, `${label}: ${summary.rowsCompleted || 0} servers completed, ${summary.rowsFailed || 0} failed, ${summary.rowsCancelled || 0} interrupted, ${summary.rowsSkipped || 0} skipped`]);
+              setIsRunning(false);
+              setConnectionStatus(null);
+              return;
+            }
+
+            // 处理完成状态消息；failed 时错误信息随消息一起到达
+            if (message.status === "failed") {
+              setErrorMessages(prevErrors => [...prevErrors, message.error.message || message.error.code]);
+            }
+            if (message.status === "completed" || message.status === "failed") {
+              console.log("All commands completed successfully");
+              setIsRunning(false);
+              setConnectionStatus(null);
+              return;
+            }
           
-          // 处理错误消息
-          if (message.error) {
-            const errorText = message.errorMessage || message.error.message || message.error;
-            const formattedError = message.errorCode ? `${message.errorCode}: ${errorText}` : errorText;
-            setErrorMessages(prevErrors => [...prevErrors, formattedError]);
-            return;
-          }
+            // 处理错误消息
+            if (message.error) {
+              const errorText = message.errorMessage || message.error.message || message.error;
+              const formattedError = message.errorCode ? `${message.errorCode}: ${errorText}` : errorText;
+              setErrorMessages(prevErrors => [...prevErrors, formattedError]);
+              return;
+            }
           
-          // 确保消息包含rowId字段
-          if (!message.rowId) {
-            console.warn("Received message without rowId:", message);
-            return;
-          }
+            // 确保消息包含rowId字段
+            if (!message.rowId) {
+              console.warn("Received message without rowId:", message);
+              return;
+            }
           
-          // 解析行ID以获取行索引
-          const rowIdParts = message.rowId.split('-');
-          const rowIndex = parseInt(rowIdParts[1]);
+            // 解析行ID以获取行索引
+            const rowIdParts = message.rowId.split('-');
+            const rowIndex = parseInt(rowIdParts[1]);
           
-          if (isNaN(rowIndex) || rowIndex < 0) {
-            console.error('Invalid row index from rowId:', message.rowId);
-            return;
-          }
+            if (isNaN(rowIndex) || rowIndex < 0) {
+              console.error('Invalid row index from rowId:', message.rowId);
+              return;
+            }
           
-          // 更新对应命令的输出
-          if (message.command && message.output) {
-            // 找到对应的命令列
-            const commandIndex = currentCommands.indexOf(message.command);
+            // 实时输出分块：累积后先显示在对应单元格中
+            if (message.type === 'output') {
+              if (message.stream !== 'stdout') return;
+              const key = `${message.rowId}\u0000${message.command}`;
+              const text = (partialOutputs.get(key) || '') + message.data;
+              partialOutputs.set(key, text);
+              message = { rowId: message.rowId, command: message.command, output: text };
+            } else if (message.type === 'commandCompleted') {
+              partialOutputs.delete(`${message.rowId}\u0000${message.command}`);
+              return;
+            }
+
+            // 更新对应命令的输出
+            if (message.command && message.output) {
+              // 找到对应的命令列
+              const commandIndex = currentCommands.indexOf(message.command);
             
-            if (commandIndex !== -1) {
-              const columnIndex = 4 + commandIndex; // IP, User, Password, Port 占用前4列
+              if (commandIndex !== -1) {
+                const columnIndex = 4 + commandIndex; // IP, User, Password, Port 占用前4列
               
+                // 处理ANSI转义序列
+                const processedOutput = message.output;
+              
+                // 创建一个自定义的单元格渲染器
+                if (!hotInstance.getCellMeta(rowIndex, columnIndex).renderer) {
+                  hotInstance.setCellMeta(rowIndex, columnIndex, 'renderer', function(instance, td, row, col, prop, value) {
+                    // 默认渲染
+                    Handsontable.renderers.TextRenderer.apply(this, arguments);
+                  
+                    // 如果有值，应用ANSI转换
+                    if (value) {
+                      // 使用innerHTML设置转换后的HTML
+                      td.innerHTML = ansiToHtml(value);
+                    
+                      // 添加自定义类以应用额外样式
+                      td.className += ' ansi-enabled-cell';
+                    }
+                  });
+                }
+              
+                // 设置原始值（不带HTML）到单元格数据
+                hotInstance.setDataAtCell(rowIndex, columnIndex, processedOutput);
+              
+                // 确保单元格仍可选择和复制
+                const cellMeta = hotInstance.getCellMeta(rowIndex, columnIndex);
+                cellMeta.copyable = true;
+              
+                // 重新渲染表格
+                hotInstance.render();
+              }
+            } else if (message.output) {
+              // 如果没有指定命令，将输出添加到通用输出字段
+              const lastColumnIndex = hotInstance.countCols() - 1;
+            
               // 处理ANSI转义序列
               const processedOutput = message.output;
-              
+            
               // 创建一个自定义的单元格渲染器
-              if (!hotInstance.getCellMeta(rowIndex, columnIndex).renderer) {
-                hotInstance.setCellMeta(rowIndex, columnIndex, 'renderer', function(instance, td, row, col, prop, value) {
+              if (!hotInstance.getCellMeta(rowIndex, lastColumnIndex).renderer) {
+                hotInstance.setCellMeta(rowIndex, lastColumnIndex, 'renderer', function(instance, td, row, col, prop, value) {
                   // 默认渲染
                   Handsontable.renderers.TextRenderer.apply(this, arguments);
-                  
+                
                   // 如果有值，应用ANSI转换
                   if (value) {
                     // 使用innerHTML设置转换后的HTML
                     td.innerHTML = ansiToHtml(value);
-                    
+                  
                     // 添加自定义类以应用额外样式
                     td.className += ' ansi-enabled-cell';
                   }
                 });
               }
-              
+            
               // 设置原始值（不带HTML）到单元格数据
-              hotInstance.setDataAtCell(rowIndex, columnIndex, processedOutput);
-              
+              hotInstance.setDataAtCell(rowIndex, lastColumnIndex, processedOutput);
+            
               // 确保单元格仍可选择和复制
-              const cellMeta = hotInstance.getCellMeta(rowIndex, columnIndex);
+              const cellMeta = hotInstance.getCellMeta(rowIndex, lastColumnIndex);
               cellMeta.copyable = true;
-              
+            
               // 重新渲染表格
               hotInstance.render();
             }
-          } else if (message.output) {
-            // 如果没有指定命令，将输出添加到通用输出字段
-            const lastColumnIndex = hotInstance.countCols() - 1;
-            
-            // 处理ANSI转义序列
-            const processedOutput = message.output;
-            
-            // 创建一个自定义的单元格渲染器
-            if (!hotInstance.getCellMeta(rowIndex, lastColumnIndex).renderer) {
-              hotInstance.setCellMeta(rowIndex, lastColumnIndex, 'renderer', function(instance, td, row, col, prop, value) {
-                // 默认渲染
-                Handsontable.renderers.TextRenderer.apply(this, arguments);
-                
-                // 如果有值，应用ANSI转换
-                if (value) {
-                  // 使用innerHTML设置转换后的HTML
-                  td.innerHTML = ansiToHtml(value);
-                  
-                  // 添加自定义类以应用额外样式
-                  td.className += ' ansi-enabled-cell';
-                }
-              });
-            }
-            
-            // 设置原始值（不带HTML）到单元格数据
-            hotInstance.setDataAtCell(rowIndex, lastColumnIndex, processedOutput);
-            
-            // 确保单元格仍可选择和复制
-            const cellMeta = hotInstance.getCellMeta(rowIndex, lastColumnIndex);
-            cellMeta.copyable = true;
-            
-            // 重新渲染表格
-            hotInstance.render();
-          }
-        };
+          };
         
-        ws.onerror = (error) => {
-          console.error('WebSocket error:', error);
-          setConnectionStatus('error');
-          setErrorMessages(prevErrors => [...prevErrors, 'WebSocket connection error']);
-        };
+          ws.onerror = (error) => {
+            console.error('WebSocket error:', error);
+            setConnectionStatus('error');
+            setErrorMessages(prevErrors => [...prevErrors, 'WebSocket connection error']);
+          };
 
-        ws.onclose = () => {
-          console.log('WebSocket connection closed');
-          setIsRunning(false);
-          setConnectionStatus(null);
+          ws.onclose = () => {
+            console.log('WebSocket connection closed');
+            if (wsRef.current === ws) {
+              wsRef.current = null;
+            }
+            // 执行在后台继续：意外断开时带上最后的 eventSeq 重连，只补收错过的事件
+            if (!finished && reconnects < MAX_RECONNECTS) {
+              reconnects += 1;
+              setConnectionStatus('connecting');
+              setTimeout(connect, 1000 * reconnects);
+              return;
+            }
+            setIsRunning(false);
+            setConnectionStatus(null);
+          };
         };
+        connect();
 
       } else {
         const rawBody = await res.text();
@@ -1424,6 +1512,14 @@ export default function App() {
           {isRunning ? 'Running Commands' : 'Run Commands'}
           {isRunning && <span className="loading"></span>}
         </button>
+        {isRunning && (
+          <button
+            onClick={cancelRun}
+            className="button secondary-button"
+          >
+            Stop
+          </button>
+        )}
 
         <div className="status-and-errors">
           {connectionStatus && (
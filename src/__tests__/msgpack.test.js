@@ -0,0 +1,30 @@
+import { describe, expect, it } from 'vitest'
+import { createWireDecoder, decodeMsgpack } from '../msgpack'
+
+const utf8 = (text) => [...new TextEncoder().encode(text)]
+
+describe('decodeMsgpack', () => {
+  it('decodes scalars, strings, arrays and maps', () => {
+    expect(decodeMsgpack(new Uint8Array([0x93, 0x01, 0xff, 0xcd, 0x01, 0x00]))).toEqual([1, -1, 256])
+    expect(decodeMsgpack(new Uint8Array([0x82, 0xa1, 0x61, 0xc0, 0xa1, 0x62, 0xc3]))).toEqual({ a: null, b: true })
+    expect(decodeMsgpack(new Uint8Array([0xd9, 6, ...utf8('中文')]))).toBe('中文')
+    expect(decodeMsgpack(new Uint8Array([0xcb, 0x3f, 0xf8, 0, 0, 0, 0, 0, 0]))).toBe(1.5)
+  })
+})
+
+describe('createWireDecoder', () => {
+  it('restores numbered keys, interned values and legacy error fields', () => {
+    const decode = createWireDecoder(['rowId', 'command', 'output', 'exitStatus', 'eventSeq', 'type', 'stream', 'seq', 'data', 'status', 'error'])
+    // [{0: [0, "row-0"], 1: [0, "ls"], 3: 0}, {0: 0, 1: 0, 10: {"code": "X", "message": "m"}}]
+    const frame = new Uint8Array([
+      0x92,
+      0x83, 0x00, 0x92, 0x00, 0xa5, ...utf8('row-0'), 0x01, 0x92, 0x00, 0xa2, ...utf8('ls'), 0x03, 0x00,
+      0x83, 0x00, 0x00, 0x01, 0x00, 0x0a, 0x82, 0xa4, ...utf8('code'), 0xa1, ...utf8('X'), 0xa7, ...utf8('message'), 0xa1, ...utf8('m'),
+    ])
+
+    expect(decode(frame)).toEqual([
+      { rowId: 'row-0', command: 'ls', exitStatus: 0 },
+      { rowId: 'row-0', command: 'ls', error: { code: 'X', message: 'm' }, errorCode: 'X', errorMessage: 'm' },
+    ])
+  })
+})
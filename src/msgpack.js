@@ -0,0 +1,110 @@
+// MessagePack 解码，只实现后端 protocol=msgpack 用到的类型（不含 ext）
+const textDecoder = new TextDecoder();
+
+const decodeMsgpack = (input) => {
+  const bytes = input instanceof Uint8Array ? input : new Uint8Array(input);
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  let offset = 0;
+
+  const readString = (length) => {
+    const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+    offset += length;
+    return value;
+  };
+
+  const readBinary = (length) => {
+    const value = bytes.slice(offset, offset + length);
+    offset += length;
+    return value;
+  };
+
+  const readArray = (length) => {
+    const value = new Array(length);
+    for (let i = 0; i < length; i++) {
+      value[i] = read();
+    }
+    return value;
+  };
+
+  const readMap = (length) => {
+    const value = {};
+    for (let i = 0; i < length; i++) {
+      const key = read();
+      value[key] = read();
+    }
+    return value;
+  };
+
+  const read = () => {
+    const type = bytes[offset++];
+    if (type <= 0x7f) return type;
+    if (type >= 0xe0) return type - 0x100;
+    if ((type & 0xf0) === 0x80) return readMap(type & 0x0f);
+    if ((type & 0xf0) === 0x90) return readArray(type & 0x0f);
+    if ((type & 0xe0) === 0xa0) return readString(type & 0x1f);
+
+    let value;
+    switch (type) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: value = view.getUint8(offset); offset += 1; return readBinary(value);
+      case 0xc5: value = view.getUint16(offset); offset += 2; return readBinary(value);
+      case 0xc6: value = view.getUint32(offset); offset += 4; return readBinary(value);
+      case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+      case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+      case 0xcc: value = view.getUint8(offset); offset += 1; return value;
+      case 0xcd: value = view.getUint16(offset); offset += 2; return value;
+      case 0xce: value = view.getUint32(offset); offset += 4; return value;
+      case 0xcf: value = Number(view.getBigUint64(offset)); offset += 8; return value;
+      case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+      case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+      case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+      case 0xd3: value = Number(view.getBigInt64(offset)); offset += 8; return value;
+      case 0xd9: value = view.getUint8(offset); offset += 1; return readString(value);
+      case 0xda: value = view.getUint16(offset); offset += 2; return readString(value);
+      case 0xdb: value = view.getUint32(offset); offset += 4; return readString(value);
+      case 0xdc: value = view.getUint16(offset); offset += 2; return readArray(value);
+      case 0xdd: value = view.getUint32(offset); offset += 4; return readArray(value);
+      case 0xde: value = view.getUint16(offset); offset += 2; return readMap(value);
+      case 0xdf: value = view.getUint32(offset); offset += 4; return readMap(value);
+      default:
+        throw new Error(`Unsupported MessagePack type 0x${type.toString(16)} at offset ${offset - 1}`);
+    }
+  };
+
+  return read();
+};
+
+// 按握手消息中的字段表还原消息：序号字段名、按连接编号的 rowId/command，以及旧的 errorCode/errorMessage 字段
+const INTERNED_KEYS = ['rowId', 'command'];
+
+const createWireDecoder = (keys) => {
+  const interned = Object.fromEntries(INTERNED_KEYS.map(key => [key, []]));
+
+  const decodeMessage = (encoded) => {
+    const message = {};
+    for (const [rawKey, rawValue] of Object.entries(encoded)) {
+      const key = /^\d+$/.test(rawKey) ? keys[Number(rawKey)] : rawKey;
+      let value = rawValue;
+      if (interned[key]) {
+        if (Array.isArray(value)) {
+          interned[key][value[0]] = value[1];
+          value = value[1];
+        } else if (typeof value === 'number') {
+          value = interned[key][value];
+        }
+      }
+      message[key] = value;
+    }
+    if (message.error && typeof message.error === 'object') {
+      message.errorCode = message.error.code;
+      message.errorMessage = message.error.message;
+    }
+    return message;
+  };
+
+  return (data) => decodeMsgpack(data).map(decodeMessage);
+};
+
+export { decodeMsgpack, createWireDecoder };